@@ -18,7 +18,7 @@ module.exports = function(callback) {
         var arr = top_entries[arr_name]['vals']
 
         // If the list is full and we're lower, give up
-        if (arr.length > max_entries) {
+        if (arr.length >= max_entries) {
             var last_entry = arr[arr.length-1];
             if (last_entry > val) {
                 return false;
@@ -38,10 +38,9 @@ module.exports = function(callback) {
                 }
                 return true;
             }
-            if (i > max_entries) {
+            if (i >= max_entries) {
                 return false;
             }
-            i++;
         }
     }
 
@@ -0,0 +1,153 @@
+import argparse
+import calendar
+import datetime
+import sys
+import time
+
+# Converts answers to and from the bytes32 the contract stores, for each answer type in docs/encoding.rst:
+#   bool              1 or 0
+#   uint              unsigned number
+#   int               signed number, two's complement
+#   single-select     index of the chosen option
+#   multiple-select   bitmask, bit i set if option i is chosen
+#   datetime          unix timestamp
+# Numbers go through int.to_bytes/int.from_bytes rather than hex strings.
+# encode_many and decode_many work on a whole list at once, packed into one buffer of 32-byte words.
+#   python answer_codec.py -n 100000     # time against to_answer_for_contract/from_answer_for_contract
+
+WORD = 32
+
+UINT_MAX = 2**256 - 1
+
+def encode_uint(value):
+    return value.to_bytes(WORD, 'big')
+
+def decode_uint(data):
+    return int.from_bytes(data, 'big')
+
+def encode_int(value):
+    return value.to_bytes(WORD, 'big', signed=True)
+
+def decode_int(data):
+    return int.from_bytes(data, 'big', signed=True)
+
+def encode_bool(value):
+    return encode_uint(1 if value else 0)
+
+def decode_bool(data):
+    value = decode_uint(data)
+    if value > 1:
+        raise ValueError("Not a bool answer: {}".format(value))
+    return value == 1
+
+def encode_multiple_select(indexes):
+    mask = 0
+    for i in indexes:
+        if i < 0 or i >= WORD * 8:
+            raise ValueError("Option {} is out of range for a bitmask".format(i))
+        mask = mask | (1 << i)
+    return encode_uint(mask)
+
+def decode_multiple_select(data):
+    # Indexes of the options chosen, lowest first
+    mask = decode_uint(data)
+    indexes = []
+    i = 0
+    while mask:
+        if mask & 1:
+            indexes.append(i)
+        mask = mask >> 1
+        i = i + 1
+    return indexes
+
+def encode_datetime(value):
+    # Takes a naive UTC datetime, or a timestamp
+    if isinstance(value, datetime.datetime):
+        value = calendar.timegm(value.utctimetuple())
+    return encode_uint(value)
+
+def decode_datetime(data):
+    return datetime.datetime.utcfromtimestamp(decode_uint(data))
+
+ENCODERS = {
+    'bool': encode_bool,
+    'uint': encode_uint,
+    'int': encode_int,
+    'single-select': encode_uint,
+    'multiple-select': encode_multiple_select,
+    'datetime': encode_datetime,
+}
+
+DECODERS = {
+    'bool': decode_bool,
+    'uint': decode_uint,
+    'int': decode_int,
+    'single-select': decode_uint,
+    'multiple-select': decode_multiple_select,
+    'datetime': decode_datetime,
+}
+
+# Plain numbers, done inline by encode_many and decode_many rather than through a function call per answer
+UNSIGNED_TYPES = ('uint', 'single-select')
+
+def _coder(coders, answer_type):
+    if answer_type not in coders:
+        raise ValueError("Unknown answer type: {}".format(answer_type))
+    return coders[answer_type]
+
+def encode(answer_type, value):
+    return _coder(ENCODERS, answer_type)(value)
+
+def decode(answer_type, data):
+    return _coder(DECODERS, answer_type)(data)
+
+def encode_many(answer_type, values):
+    if answer_type in UNSIGNED_TYPES:
+        return b''.join([v.to_bytes(WORD, 'big') for v in values])
+    return b''.join([_coder(ENCODERS, answer_type)(v) for v in values])
+
+def decode_many(answer_type, buf):
+    if len(buf) % WORD:
+        raise ValueError("Buffer of {} bytes is not a whole number of 32-byte words".format(len(buf)))
+    # Slicing bytes turns out quicker than slicing a memoryview for words this small
+    buf = bytes(buf)
+    if answer_type in UNSIGNED_TYPES:
+        from_bytes = int.from_bytes
+        return [from_bytes(buf[o:o+WORD], 'big') for o in range(0, len(buf), WORD)]
+    fn = _coder(DECODERS, answer_type)
+    return [fn(buf[o:o+WORD]) for o in range(0, len(buf), WORD)]
+
+def main():
+    from harness import to_answer_for_contract, from_answer_for_contract
+
+    parser = argparse.ArgumentParser(description='Time the answer codec against the hex string helpers')
+    parser.add_argument('-n', type=int, default=100000, help='number of answers (default: %(default)s)')
+    args = parser.parse_args()
+
+    values = [(i * 2654435761) % UINT_MAX for i in range(args.n)]
+
+    started = time.time()
+    encoded = [to_answer_for_contract(v) for v in values]
+    decoded = [from_answer_for_contract(a) for a in encoded]
+    helpers = time.time() - started
+
+    started = time.time()
+    single = [decode_uint(encode_uint(v)) for v in values]
+    codec = time.time() - started
+
+    started = time.time()
+    buf = encode_many('uint', values)
+    many = decode_many('uint', buf)
+    batch = time.time() - started
+
+    if not (decoded == single == many == values) or buf != b''.join(encoded):
+        sys.stdout.write("Codec results differ from the hex string helpers\n")
+        sys.exit(1)
+
+    sys.stdout.write("{} uint answers, encoded and decoded\n".format(args.n))
+    sys.stdout.write("hex string helpers: {:.3f}s\n".format(helpers))
+    sys.stdout.write("codec, one by one:  {:.3f}s ({:.1f}x)\n".format(codec, helpers / codec))
+    sys.stdout.write("codec, one buffer:  {:.3f}s ({:.1f}x)\n".format(batch, helpers / batch))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+from rlp.utils import decode_hex, encode_hex
+from sha3 import keccak_256
+
+# Rebuilds the claimWinnings arguments for questions from their LogNewAnswer events.
+# Events are taken in log order, as decoded by the contract translator or web3.
+# Each entry is checked against the history_hash the contract logged for it,
+# the same link _verifyHistoryInputOrRevert will check when the claim is made.
+
+# Rough costs for claimWinnings, used to size claims to a gas budget.
+# These are on the high side; claim_bench.py gives the measured figures for the current contract.
+CLAIM_BASE_GAS = 60000
+CLAIM_GAS_PER_ENTRY = 35000
+
+class HistoryError(Exception):
+    pass
+
+def calculate_history_hash(last_history_hash, answer, bond, addr, is_commitment):
+    # As _addAnswerToHistory: keccak256(history_hash, answer_or_commitment_id, bond, answerer, is_commitment)
+    return decode_hex(keccak_256(last_history_hash + answer + decode_hex(hex(bond)[2:].zfill(64)) + addr + (b'\x01' if is_commitment else b'\x00')).hexdigest())
+
+NULL_HASH = b'\x00' * 32
+
+class AnswerHistory(object):
+
+    # Keeps the claimWinnings arguments for a question as answers are given, without reading anything back from the contract.
+    # Entries are appended first-to-last and only reversed when the claim arguments are asked for.
+
+    def __init__(self):
+        self.hashes = [] # the history hash before each entry
+        self.addrs = []
+        self.bonds = []
+        self.answers = [] # answer, or commitment ID for commitments
+        self.commitments = []
+        self.history_hash = NULL_HASH
+
+    def add(self, addr, bond, answer, is_commitment=False):
+        self.hashes.append(self.history_hash)
+        self.addrs.append(addr)
+        self.bonds.append(bond)
+        self.answers.append(answer)
+        self.commitments.append(is_commitment)
+        self.history_hash = calculate_history_hash(self.history_hash, answer, bond, addr, is_commitment)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def claim_args(self, start=0, end=None):
+        # Last-to-first, as claimWinnings wants them.
+        # start and end count back from the latest entry, so claim_args(0, n) is the first chunk to claim.
+        n = len(self.hashes)
+        end = n if end is None else min(end, n)
+        lo, hi = n - end, n - start
+        return self.hashes[lo:hi][::-1], self.addrs[lo:hi][::-1], self.bonds[lo:hi][::-1], self.answers[lo:hi][::-1]
+
+def _address(addr):
+    # The tester's translator gives addresses as 0x-prefixed hex, but the contract and the history hash want 20 bytes
+    if isinstance(addr, bytes) and len(addr) == 20:
+        return addr
+    if addr.startswith('0x'):
+        addr = addr[2:]
+    return decode_hex(addr)
+
+def rebuild_histories(events, question_ids=None):
+    # One pass over the events, appending to each question's history.
+    # Returns a dict of question_id => AnswerHistory. Other event types are skipped.
+    histories = {}
+    for ev in events:
+        if ev.get('_event_type', b'LogNewAnswer') not in (b'LogNewAnswer', 'LogNewAnswer'):
+            continue
+        question_id = ev['question_id']
+        if question_ids is not None and question_id not in question_ids:
+            continue
+
+        hist = histories.get(question_id)
+        if hist is None:
+            hist = AnswerHistory()
+            histories[question_id] = hist
+
+        hist.add(_address(ev['user']), ev['bond'], ev['answer'], ev['is_commitment'])
+        if hist.history_hash != ev['history_hash']:
+            raise HistoryError("History hash mismatch for question {} at entry {}: expected {}, got {}".format(
+                encode_hex(question_id), len(hist) - 1, encode_hex(ev['history_hash']), encode_hex(hist.history_hash)))
+
+    return histories
+
+def claimed_entries(hist, current_history_hash):
+    # How many entries, counting back from the latest, have already been claimed.
+    # claimWinnings leaves questions[question_id].history_hash at the hash where it stopped, and at NULL_HASH once it's done.
+    if current_history_hash == hist.history_hash:
+        return 0
+    if current_history_hash == NULL_HASH:
+        return len(hist)
+    n = len(hist)
+    for i in range(n - 1, -1, -1):
+        # hashes[i] is the history hash before entry i, which is what's left after claiming entries i to n-1
+        if hist.hashes[i] == current_history_hash:
+            return n - i
+    raise HistoryError("History hash {} is not in this history".format(encode_hex(current_history_hash)))
+
+def entries_per_claim(gas_budget, base_gas=CLAIM_BASE_GAS, gas_per_entry=CLAIM_GAS_PER_ENTRY):
+    n = (gas_budget - base_gas) // gas_per_entry
+    if n < 1:
+        raise HistoryError("A gas budget of {} won't cover a claim of even one entry".format(gas_budget))
+    return n
+
+def claim_chunks(hist, gas_budget, start=0, base_gas=CLAIM_BASE_GAS, gas_per_entry=CLAIM_GAS_PER_ENTRY):
+    # Splits the unclaimed part of the history into claimWinnings argument sets that each fit in gas_budget.
+    # Each set is (history_hashes, addrs, bonds, answers), last-to-first, to be sent in the order returned.
+    per_claim = entries_per_claim(gas_budget, base_gas, gas_per_entry)
+    return [hist.claim_args(s, s + per_claim) for s in range(start, len(hist), per_claim)]
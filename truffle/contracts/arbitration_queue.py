@@ -0,0 +1,167 @@
+import heapq
+import time
+
+from event_stream import ingest
+
+# Keeps the arbitrator's owner working through frozen questions, best paid and longest waiting first.
+# Follows two contracts' events, from a stream on each:
+#   Arbitrator      LogRequestArbitration           fee_paid adds to what's been paid towards the dispute fee
+#   RealityCheck    LogNotifyOfArbitrationRequest   the fee is paid in full and the question is frozen: queue it
+#                   LogFinalize                     the arbitrator has answered: done
+# Questions wait in a heap on (-paid, frozen_ts), so the question paying most comes out first, and the one that has
+# waited longest among those paying the same. A payment arriving after the question is queued (the two streams can
+# deliver the same block in either order) pushes a new entry, and the old one is skipped when it comes up.
+#
+# next_batch(n) hands out up to n questions for one round of submitAnswerByArbitrator transactions, and keeps them as
+# in flight until their LogFinalize turns up. requeue() puts back any whose transaction didn't go through.
+# metrics(now) reports the queue depth and how long questions stayed frozen, so a backlog shows before it hurts.
+#
+#   queue = ArbitrationQueue()
+#   queue.run([EventStream(source, arb.address, arb.translator, ['LogRequestArbitration'], confirmations=6),
+#              EventStream(source, rc.address, rc.translator, ['LogNotifyOfArbitrationRequest', 'LogFinalize'], confirmations=6)],
+#             decide, lambda batch: send_resolutions(arb, rc.address, batch), report=log_metrics)
+# decide(question_id, requester) is the owner's judgment, returning (answer, answerer).
+
+# How many recent resolution times metrics() works from
+RESOLUTION_WINDOW = 1000
+
+def _event_type(ev):
+    t = ev['_event_type']
+    return t.decode('utf8') if isinstance(t, bytes) else t
+
+class ArbitrationQueue(object):
+
+    def __init__(self):
+        # question_id => total paid towards the dispute fee, for questions not yet answered by the arbitrator
+        self.paid = {}
+        # question_id => (requester, frozen_ts), for frozen questions not yet handed out by next_batch()
+        self.waiting = {}
+        # question_id => (requester, frozen_ts), handed out but not yet seen finalized
+        self.in_flight = {}
+        # (-paid, frozen_ts, question_id). An entry whose paid is no longer current, or whose question isn't waiting, is skipped.
+        self.heap = []
+        # Seconds from frozen to finalized, for the most recent RESOLUTION_WINDOW questions, in the order they finished
+        self.resolution_times = []
+        self.resolved = 0
+
+    def __len__(self):
+        return len(self.waiting)
+
+    def _push(self, question_id):
+        _, frozen_ts = self.waiting[question_id]
+        heapq.heappush(self.heap, (-self.paid.get(question_id, 0), frozen_ts, question_id))
+
+    def process_event(self, ev, timestamp):
+        event_type = _event_type(ev)
+        question_id = ev.get('question_id')
+        if event_type == 'LogRequestArbitration':
+            self.paid[question_id] = self.paid.get(question_id, 0) + ev['fee_paid']
+            if question_id in self.waiting:
+                self._push(question_id)
+        elif event_type == 'LogNotifyOfArbitrationRequest':
+            if question_id not in self.waiting and question_id not in self.in_flight:
+                self.waiting[question_id] = (ev['user'], timestamp)
+                self._push(question_id)
+        elif event_type == 'LogFinalize':
+            # submitAnswerByArbitrator clears the payments along with the freeze
+            self.paid.pop(question_id, None)
+            entry = self.waiting.pop(question_id, None) or self.in_flight.pop(question_id, None)
+            if entry is not None:
+                self.resolution_times.append(timestamp - entry[1])
+                if len(self.resolution_times) > RESOLUTION_WINDOW:
+                    del self.resolution_times[0]
+                self.resolved = self.resolved + 1
+
+    def process_block(self, block_number, timestamp, events):
+        # For event_stream.ingest
+        for ev in events:
+            self.process_event(ev, timestamp)
+
+    def _discard_stale(self):
+        while self.heap:
+            neg_paid, _, question_id = self.heap[0]
+            if question_id in self.waiting and -neg_paid == self.paid.get(question_id, 0):
+                return
+            heapq.heappop(self.heap)
+
+    def peek(self):
+        # The question next_batch() would hand out first, or None
+        self._discard_stale()
+        return self.heap[0][2] if self.heap else None
+
+    def next_batch(self, n):
+        # Returns up to n (question_id, requester, paid), most urgent first, and marks them in flight
+        batch = []
+        while len(batch) < n:
+            self._discard_stale()
+            if not self.heap:
+                break
+            neg_paid, _, question_id = heapq.heappop(self.heap)
+            entry = self.waiting.pop(question_id)
+            self.in_flight[question_id] = entry
+            batch.append((question_id, entry[0], -neg_paid))
+        return batch
+
+    def requeue(self, question_id):
+        # For a question whose submission failed. It goes back in where it was before.
+        entry = self.in_flight.pop(question_id, None)
+        if entry is not None:
+            self.waiting[question_id] = entry
+            self._push(question_id)
+
+    def metrics(self, now):
+        frozen = [entry[1] for entry in self.waiting.values()] + [entry[1] for entry in self.in_flight.values()]
+        times = sorted(self.resolution_times)
+
+        def percentile(p):
+            if not times:
+                return None
+            return times[min(len(times) - 1, int(len(times) * p))]
+
+        return {
+            'depth': len(self.waiting),
+            'in_flight': len(self.in_flight),
+            # Paid towards the fee, but not yet enough to freeze the question
+            'part_paid': len([q for q in self.paid if q not in self.waiting and q not in self.in_flight]),
+            'oldest_wait': now - min(frozen) if frozen else 0,
+            'resolved': self.resolved,
+            'resolution_p50': percentile(0.5),
+            'resolution_p95': percentile(0.95),
+            'resolution_max': times[-1] if times else None,
+        }
+
+    def run(self, streams, decide, submit, batch_size=20, poll_interval=5, report=None, clock=time.time, sleep=time.sleep):
+        # Follows the streams, sending what's waiting in batches of up to batch_size until the queue is empty, then
+        # waits poll_interval seconds before looking again.
+        # submit(resolutions) gets a list of (question_id, answer, answerer) and returns the question IDs that failed,
+        # which go back in the queue for the next round.
+        # There's no rollback, so give the streams enough confirmations that reorgs don't reach them.
+        # Put the Arbitrator's stream first, so a payment is never read after the LogFinalize that cleared it.
+        while True:
+            for stream in streams:
+                ingest(stream.poll(), self)
+            while len(self):
+                resolutions = []
+                for question_id, requester, paid in self.next_batch(batch_size):
+                    answer, answerer = decide(question_id, requester)
+                    resolutions.append((question_id, answer, answerer))
+                failed = submit(resolutions)
+                for question_id in failed:
+                    self.requeue(question_id)
+                if failed:
+                    break
+            if report is not None:
+                report(self.metrics(clock()))
+            sleep(poll_interval)
+
+def send_resolutions(arbitrator, realitycheck_address, resolutions, startgas=200000):
+    # A submit() for run(), over a t.ABIContract for the Arbitrator. Returns the question IDs whose transaction failed,
+    # typically because someone else's answer got there first.
+    from ethereum.tools.tester import TransactionFailed
+    failed = []
+    for question_id, answer, answerer in resolutions:
+        try:
+            arbitrator.submitAnswerByArbitrator(realitycheck_address, question_id, answer, answerer, startgas=startgas)
+        except TransactionFailed:
+            failed.append(question_id)
+    return failed
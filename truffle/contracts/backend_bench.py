@@ -0,0 +1,100 @@
+import argparse
+import sys
+import time
+
+from ethereum.tools import tester as t
+
+from harness import to_answer_for_contract
+from answer_history import AnswerHistory
+import evm_backends
+
+# Runs the same RealityCheck workload on each EVM backend that's installed, and compares their throughput.
+#   python backend_bench.py                          # every backend we can run here
+#   python backend_bench.py --backends eth-tester    # just the one
+# Each round asks a question, answers it `--answers` times with each bond double the last, lets it finalize and
+# claims the bonds. Deployment is timed separately, so the rates are for the round trips a test would make.
+
+# The fixture's arbitrator charges 100 to ask a question
+BOUNTY = 1100
+TIMEOUT = 10
+
+ANSWERERS = [t.k3, t.k4, t.k5, t.k6]
+
+class BackendBench(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.txs = 0
+        self.rounds = 0
+
+    def setup(self):
+        self.chain = evm_backends.get_backend(self.name)
+        self.arb = self.chain.deploy('Arbitrator', sender=t.k0)
+        self.arb.setDisputeFee(10000000000000000, sender=t.k0, startgas=200000)
+        self.rc = self.chain.deploy('RealityCheck', sender=t.k0)
+        self.arb.setQuestionFee(self.rc.address, 100)
+        self.chain.mine()
+
+    def round(self, nonce, answers, bond):
+        question_id = self.rc.askQuestion(0, "backend bench question", self.arb.address, TIMEOUT, 0, nonce, value=BOUNTY, startgas=200000)
+        hist = AnswerHistory()
+        for i in range(answers):
+            sender = ANSWERERS[i % len(ANSWERERS)]
+            answer = to_answer_for_contract(1 + i % 2)
+            hist.add(self.chain.address(sender), bond * 2**i, answer)
+            self.rc.submitAnswer(question_id, answer, 0, value=bond * 2**i, sender=sender, startgas=200000)
+        self.chain.advance_time(TIMEOUT + 1)
+        self.chain.mine()
+        assert self.rc.isFinalized(question_id)
+        hashes, addrs, bonds, answers_list = hist.claim_args()
+        self.rc.claimWinnings(question_id, hashes, addrs, bonds, answers_list, startgas=100000 + answers * 50000)
+        self.chain.mine()
+        self.txs = self.txs + answers + 2
+        self.rounds = self.rounds + 1
+
+    def run(self, rounds, answers, bond):
+        start = time.time()
+        self.setup()
+        setup_time = time.time() - start
+        start = time.time()
+        for nonce in range(rounds):
+            self.round(nonce, answers, bond)
+        elapsed = time.time() - start
+        return {
+            'backend': self.name,
+            'setup_seconds': setup_time,
+            'seconds': elapsed,
+            'txs': self.txs,
+            'rounds': self.rounds,
+            'txs_per_second': self.txs / elapsed if elapsed > 0 else None,
+        }
+
+def report(results, stream=sys.stdout):
+    stream.write("{:<12} {:>10} {:>10} {:>8} {:>10}\n".format('backend', 'setup s', 'run s', 'txs', 'tx/s'))
+    for r in results:
+        stream.write("{:<12} {:>10.2f} {:>10.2f} {:>8} {:>10.1f}\n".format(r['backend'], r['setup_seconds'], r['seconds'], r['txs'], r['txs_per_second'] or 0))
+    if len(results) > 1:
+        slowest = min(r['txs_per_second'] for r in results)
+        for r in results:
+            stream.write("{}: {:.2f}x the slowest\n".format(r['backend'], r['txs_per_second'] / slowest))
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare RealityCheck throughput on each EVM backend')
+    parser.add_argument('--backends', nargs='+', help='backends to run (default: every one installed)')
+    parser.add_argument('--rounds', type=int, default=20, help='questions to ask, answer and claim (default: %(default)s)')
+    parser.add_argument('--answers', type=int, default=8, help='answers per question (default: %(default)s)')
+    parser.add_argument('--bond', type=int, default=10, help='first bond (default: %(default)s)')
+    args = parser.parse_args()
+
+    available = evm_backends.available_backends()
+    names = args.backends or available
+    results = []
+    for name in names:
+        if name not in available:
+            sys.stderr.write("Skipping {}, which isn't installed\n".format(name))
+            continue
+        results.append(BackendBench(name).run(args.rounds, args.answers, args.bond))
+    report(results)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,355 @@
+import argparse
+import multiprocessing
+import random
+import sys
+import time
+
+# Simulates bond-escalation games on a question, to see how bounties, bond sizes and arbitration fees
+# play out over millions of games rather than the handful in test_bonds and test_bond_claim_*.
+#
+# A game is an answer history: each entry is (player, bond, answer, is_commitment, is_revealed), with the arbitrator's
+# answer last if there was one. Answers are 1 for the truth and 0 for a lie.
+# payouts() pays a finished game out as a single claimWinnings would: the first right answer from the top takes the bounty,
+# each lower right answer from a different player takes over the queue for a fee equal to its own bond,
+# and unrevealed commitments count as wrong.
+# play() generates a game from a mix of strategies. Each move must at least double the bond (bondMustDouble),
+# and a revealed commitment becomes the current answer straight away.
+# If the answer left standing is wrong, a truthful player who can afford it and thinks it's worth it requests
+# arbitration, and the arbitrator credits them with the right answer.
+#
+# There's no numpy here, so games are run in batches through a tight loop over plain lists, spread over processes.
+#   python bond_sim.py -n 1000000 -j 8 --players honest,troll,committer
+#   python bond_sim.py --differential 20      # replay sampled games on the tester and check payouts against balanceOf
+
+TRUTH = 1
+LIE = 0
+
+# truthful: answers the truth, or lies
+# commit: chance of answering by commitment rather than in the clear
+# reveal: chance of revealing a commitment
+# arbitrate: will pay for arbitration if a wrong answer stands
+STRATEGIES = {
+    'honest': {'truthful': True, 'commit': 0.0, 'reveal': 1.0, 'arbitrate': True},
+    'committer': {'truthful': True, 'commit': 1.0, 'reveal': 0.9, 'arbitrate': True},
+    'troll': {'truthful': False, 'commit': 0.0, 'reveal': 1.0, 'arbitrate': False},
+    'sniper': {'truthful': False, 'commit': 1.0, 'reveal': 0.5, 'arbitrate': False},
+}
+
+class GameConfig(object):
+
+    def __init__(self, players, bounty=1000, min_bond=1, budget=2**20, arbitration_fee=10000,
+                 multipliers=(2, 2, 2, 3, 4), stop_chance=0.1, max_entries=64):
+        # players is a list of strategy names, one per player
+        for name in players:
+            if name not in STRATEGIES:
+                raise ValueError("Unknown strategy {}, expected one of {}".format(name, ', '.join(sorted(STRATEGIES))))
+        self.players = players
+        self.bounty = bounty
+        self.min_bond = min_bond
+        self.budget = budget
+        self.arbitration_fee = arbitration_fee
+        # Each new bond is the last one times one of these
+        self.multipliers = multipliers
+        # Chance, before each move, that the question times out on the current answer
+        self.stop_chance = stop_chance
+        self.max_entries = max_entries
+
+class Game(object):
+
+    def __init__(self, players, bonds, answers, commitments, revealed, best_answer, spent, arbitrated):
+        self.players = players
+        self.bonds = bonds
+        self.answers = answers
+        self.commitments = commitments
+        self.revealed = revealed
+        # None if no answer was ever revealed, in which case the question can't finalize
+        self.best_answer = best_answer
+        # What each player paid in, bonds and arbitration fees
+        self.spent = spent
+        self.arbitrated = arbitrated
+
+    def __len__(self):
+        return len(self.players)
+
+def play(config, rng):
+    players = []
+    bonds = []
+    answers = []
+    commitments = []
+    revealed = []
+    n = len(config.players)
+    strategies = [STRATEGIES[name] for name in config.players]
+    answer_of = [TRUTH if s['truthful'] else LIE for s in strategies]
+    commit_chance = [s['commit'] for s in strategies]
+    reveal_chance = [s['reveal'] for s in strategies]
+    spent = [0] * n
+    budget = config.budget
+    min_bond = config.min_bond
+    multipliers = config.multipliers
+    stop_chance = config.stop_chance
+    rand = rng.random
+    choice = rng.choice
+    bond = 0
+    best_answer = None
+
+    while len(players) < config.max_entries:
+        if best_answer is not None and rand() < stop_chance:
+            break
+        next_bond = max(min_bond, bond * 2)
+        movers = [p for p in range(n) if answer_of[p] != best_answer and spent[p] + next_bond <= budget]
+        if not movers:
+            break
+        p = choice(movers)
+        new_bond = max(min_bond, bond * choice(multipliers))
+        if spent[p] + new_bond > budget:
+            new_bond = next_bond
+        answer = answer_of[p]
+        is_commitment = rand() < commit_chance[p]
+        is_revealed = not is_commitment or rand() < reveal_chance[p]
+
+        players.append(p)
+        bonds.append(new_bond)
+        answers.append(answer)
+        commitments.append(is_commitment)
+        revealed.append(is_revealed)
+        spent[p] = spent[p] + new_bond
+        bond = new_bond
+        if is_revealed:
+            best_answer = answer
+
+    arbitrated = False
+    if best_answer == LIE and bond + config.bounty >= config.arbitration_fee:
+        requesters = [p for p in range(n) if strategies[p]['arbitrate'] and spent[p] + config.arbitration_fee <= budget]
+        if requesters:
+            p = choice(requesters)
+            spent[p] = spent[p] + config.arbitration_fee
+            players.append(p)
+            bonds.append(0)
+            answers.append(TRUTH)
+            commitments.append(False)
+            revealed.append(True)
+            best_answer = TRUTH
+            arbitrated = True
+
+    return Game(players, bonds, answers, commitments, revealed, best_answer, spent, arbitrated)
+
+def payouts(game, bounty):
+    # Returns {player: amount} as claimWinnings would credit them, with None for anything paid to the null address.
+    # Mirrors the loop in claimWinnings and _processHistoryItem, last entry first.
+    paid = {}
+    payee = None
+    queued = 0
+    last_bond = 0
+    players = game.players
+    bonds = game.bonds
+    answers = game.answers
+    revealed = game.revealed
+    best_answer = game.best_answer
+    for i in range(len(players) - 1, -1, -1):
+        queued = queued + last_bond
+        bond = bonds[i]
+        last_bond = bond
+        if not revealed[i] or answers[i] != best_answer:
+            continue
+        addr = players[i]
+        if payee is None:
+            payee = addr
+            queued = queued + bounty
+            bounty = 0
+        elif addr != payee:
+            fee = bond if queued >= bond else queued
+            paid[payee] = paid.get(payee, 0) + queued - fee
+            payee = addr
+            queued = fee
+    paid[payee] = paid.get(payee, 0) + queued + last_bond
+    return paid
+
+class Totals(object):
+
+    # Running totals over many games, per strategy
+
+    def __init__(self, strategies=None):
+        self.games = 0
+        self.unfinalized = 0
+        self.arbitrated = 0
+        self.right = 0
+        self.entries = 0
+        self.final_bond = 0
+        self.spent = dict((name, 0) for name in strategies or STRATEGIES)
+        self.paid = dict((name, 0) for name in strategies or STRATEGIES)
+        self.played = dict((name, 0) for name in strategies or STRATEGIES)
+
+    def add(self, config, game, paid):
+        self.games = self.games + 1
+        if game.best_answer is None:
+            self.unfinalized = self.unfinalized + 1
+        if game.arbitrated:
+            self.arbitrated = self.arbitrated + 1
+        if game.best_answer == TRUTH:
+            self.right = self.right + 1
+        self.entries = self.entries + len(game)
+        if game.bonds:
+            self.final_bond = self.final_bond + max(game.bonds)
+        for p, name in enumerate(config.players):
+            self.played[name] = self.played[name] + 1
+            self.spent[name] = self.spent[name] + game.spent[p]
+            self.paid[name] = self.paid[name] + paid.get(p, 0)
+
+    def merge(self, other):
+        self.games = self.games + other.games
+        self.unfinalized = self.unfinalized + other.unfinalized
+        self.arbitrated = self.arbitrated + other.arbitrated
+        self.right = self.right + other.right
+        self.entries = self.entries + other.entries
+        self.final_bond = self.final_bond + other.final_bond
+        for name in other.played:
+            self.played[name] = self.played.get(name, 0) + other.played[name]
+            self.spent[name] = self.spent.get(name, 0) + other.spent[name]
+            self.paid[name] = self.paid.get(name, 0) + other.paid[name]
+
+def simulate(config, n, seed=None):
+    # Plays n games and returns their Totals
+    rng = random.Random(seed)
+    totals = Totals(set(config.players))
+    for _ in range(n):
+        game = play(config, rng)
+        paid = payouts(game, config.bounty) if game.best_answer is not None else {}
+        totals.add(config, game, paid)
+    return totals
+
+def _simulate_batch(job):
+    config, n, seed = job
+    return simulate(config, n, seed)
+
+def simulate_parallel(config, n, processes=None, batch_size=50000, seed=0):
+    # Splits the games into batches over a pool of processes. Each batch has its own seed, so a run can be repeated.
+    jobs = []
+    for i, start in enumerate(range(0, n, batch_size)):
+        jobs.append((config, min(batch_size, n - start), seed * 1000003 + i))
+    totals = Totals(set(config.players))
+    pool = multiprocessing.Pool(processes)
+    try:
+        for batch in pool.imap_unordered(_simulate_batch, jobs):
+            totals.merge(batch)
+    finally:
+        pool.close()
+        pool.join()
+    return totals
+
+def replay(fixture, config, game, nonce=1):
+    # Plays a game out on the tester from the fixture's snapshot, claims, and returns {player: balanceOf increase}.
+    # Players 0 to 8 are t.k1 to t.k9; the arbitrator's owner is t.k0.
+    from ethereum.tools import tester as t
+    from ethereum.tools import keys
+    from harness import to_answer_for_contract, calculate_commitment_hash, calculate_commitment_id, advance_time, make_room
+    from answer_history import AnswerHistory
+    from answer_history import claim_chunks
+
+    player_keys = [t.k1, t.k2, t.k3, t.k4, t.k5, t.k6, t.k7, t.k8, t.k9]
+    if len(config.players) > len(player_keys):
+        raise ValueError("Can't replay a game with more than {} players".format(len(player_keys)))
+    addrs = [keys.privtoaddr(k) for k in player_keys[:len(config.players)]]
+
+    fixture.revert()
+    c = fixture.c
+    rc = fixture.rc0
+    arb = fixture.arb0
+    arb.setDisputeFee(config.arbitration_fee, sender=t.k0, startgas=200000)
+    question_fee = rc.arbitrator_question_fees(arb.address)
+    question_id = rc.askQuestion(0, "simulated", arb.address, 10, 0, nonce, value=config.bounty + question_fee, startgas=200000)
+
+    hist = AnswerHistory()
+    for i in range(len(game)):
+        p = game.players[i]
+        answer = to_answer_for_contract(game.answers[i])
+        if game.arbitrated and i == len(game) - 1:
+            arb.requestArbitration(rc.address, question_id, value=config.arbitration_fee, sender=player_keys[p], startgas=200000)
+            arb.submitAnswerByArbitrator(rc.address, question_id, answer, addrs[p], sender=t.k0, startgas=200000)
+            hist.add(addrs[p], 0, answer)
+        elif game.commitments[i]:
+            answer_hash = calculate_commitment_hash(answer, i + 1)
+            rc.submitAnswerCommitment(question_id, answer_hash, 0, addrs[p], value=game.bonds[i], sender=player_keys[p], startgas=200000)
+            hist.add(addrs[p], game.bonds[i], calculate_commitment_id(question_id, answer_hash, game.bonds[i]), True)
+            if game.revealed[i]:
+                rc.submitAnswerReveal(question_id, answer, i + 1, game.bonds[i], sender=player_keys[p], startgas=200000)
+        else:
+            rc.submitAnswer(question_id, answer, 0, value=game.bonds[i], sender=player_keys[p], startgas=200000)
+            hist.add(addrs[p], game.bonds[i], answer)
+
+    # Claim in a fresh block, after the timeout, as fuzz_claims.play does. An arbitrated game is already final.
+    advance_time(c, 11)
+
+    null_address = b'\x00' * 20
+    before = [rc.balanceOf(addr) for addr in addrs + [null_address]]
+    for args in claim_chunks(hist, 600000):
+        make_room(c, 600000)
+        rc.claimWinnings(question_id, *args, startgas=600000)
+    after = [rc.balanceOf(addr) for addr in addrs + [null_address]]
+
+    deltas = {}
+    for p, (b, a) in enumerate(zip(before, after)):
+        if a != b:
+            deltas[None if p == len(addrs) else p] = a - b
+    return deltas
+
+def differential(config, n, seed=0, fixture=None):
+    # Replays n sampled games that can finalize, and returns a list of (game, model payouts, balanceOf increases)
+    # for each that doesn't match
+    if fixture is None:
+        from harness import get_fixture
+        fixture = get_fixture()
+    rng = random.Random(seed)
+    mismatches = []
+    replayed = 0
+    while replayed < n:
+        game = play(config, rng)
+        if game.best_answer is None:
+            continue
+        expected = dict((p, v) for p, v in payouts(game, config.bounty).items() if v > 0)
+        actual = replay(fixture, config, game)
+        if actual != expected:
+            mismatches.append((game, expected, actual))
+        replayed = replayed + 1
+    return mismatches
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate bond escalation on RealityCheck questions')
+    parser.add_argument('-n', type=int, default=100000, help='number of games (default: %(default)s)')
+    parser.add_argument('-j', type=int, default=multiprocessing.cpu_count(), help='processes (default: %(default)s)')
+    parser.add_argument('--players', default='honest,troll', help='comma-separated strategies, one per player: {}'.format(', '.join(sorted(STRATEGIES))))
+    parser.add_argument('--bounty', type=int, default=1000)
+    parser.add_argument('--min-bond', type=int, default=1)
+    parser.add_argument('--budget', type=int, default=2**20, help='most each player will pay in (default: %(default)s)')
+    parser.add_argument('--arbitration-fee', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--differential', type=int, metavar='N', help='replay N sampled games on the tester instead')
+    args = parser.parse_args()
+
+    config = GameConfig(args.players.split(','), bounty=args.bounty, min_bond=args.min_bond, budget=args.budget,
+                        arbitration_fee=args.arbitration_fee)
+
+    if args.differential:
+        # Keep each game's transactions inside one block
+        config.max_entries = 10
+        mismatches = differential(config, args.differential, args.seed)
+        for game, expected, actual in mismatches:
+            sys.stdout.write("Mismatch: players {} bonds {} answers {} commitments {} revealed {}\n  model {}\n  chain {}\n".format(
+                game.players, game.bonds, game.answers, game.commitments, game.revealed, expected, actual))
+        sys.stdout.write("{} games replayed, {} mismatches\n".format(args.differential, len(mismatches)))
+        sys.exit(1 if mismatches else 0)
+
+    started = time.time()
+    totals = simulate_parallel(config, args.n, args.j, seed=args.seed)
+    elapsed = time.time() - started
+
+    sys.stdout.write("{} games in {:.1f}s ({:.0f}/s)\n".format(totals.games, elapsed, totals.games / elapsed))
+    sys.stdout.write("right answer: {:.2%}  arbitrated: {:.2%}  never finalized: {:.2%}\n".format(
+        totals.right / totals.games, totals.arbitrated / totals.games, totals.unfinalized / totals.games))
+    sys.stdout.write("mean entries: {:.2f}  mean top bond: {:.1f}\n".format(totals.entries / totals.games, totals.final_bond / totals.games))
+    for name in sorted(totals.played):
+        played = totals.played[name]
+        sys.stdout.write("{:10} mean paid in {:12.1f}  mean paid out {:12.1f}  mean profit {:12.1f}\n".format(
+            name, totals.spent[name] / played, totals.paid[name] / played, (totals.paid[name] - totals.spent[name]) / played))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+import asyncio
+import time
+
+from rlp.utils import decode_hex
+
+from event_stream import ingest
+from finalization_scheduler import FinalizationScheduler
+
+# Delivers CallerBacker callbacks as soon as their questions are final, best paid first.
+# Follows two contracts' events:
+#   CallerBacker    LogFundCallbackRequest      a bounty for calling client back with gas, once the question is final
+#                   LogSendCallback             delivered, by us or anyone else, and whether the client's callback threw
+#   RealityCheck    everything a FinalizationScheduler follows, which says when each question becomes final
+# Funding for a question that's already final is ready straight away. The scheduler forgets questions once they're
+# final, so funding for a question it isn't following counts as final from when it's seen. If that's a question from
+# before the streams started that isn't final yet, sendCallback fails and the delivery is retried, then abandoned.
+# Follow RealityCheck before CallerBacker, so a question asked and funded in the same block is known to be open.
+#
+# dispatch(now) sends everything ready, in rounds that each fit in a block's gas (so the best paid aren't
+# competing for space with the rest), best bounty first, with at most `concurrency` sendCallback transactions
+# outstanding at a time. sendCallback is sent with min_bounty set to the bounty we saw, so if someone beats us to
+# it the transaction fails cheaply instead of running the callback for nothing.
+#
+# A client whose callback throws still pays the bounty, but burns all the gas it asked for. After failure_threshold
+# of those in a row the client's circuit opens, and its deliveries wait for a cooldown that doubles each time it
+# opens again, up to max_cooldown. Then one delivery goes through as a trial: if it works the circuit closes.
+# A transaction that fails outright is retried after retry_delay, doubling, up to max_attempts times.
+#
+#   dispatcher = CallbackDispatcher(send)
+#   await dispatcher.run([EventStream(source, rc.address, rc.translator, confirmations=6),
+#                         EventStream(source, backer.address, backer.translator, CALLBACK_EVENT_TYPES, confirmations=6)])
+# send(question_id, client, gas, bounty) is a coroutine returning sendCallback's result. tester_sender() makes one for
+# the tester; against a node it would sign and submit the transaction, and wait for the receipt.
+
+CALLBACK_EVENT_TYPES = ['LogFundCallbackRequest', 'LogSendCallback']
+
+# Gas sendCallback needs on top of what it forwards to the client
+CALLBACK_OVERHEAD = 100000
+
+# How many recent delivery latencies stats() works from
+LATENCY_WINDOW = 1000
+
+def _address(addr):
+    # The tester's translator gives addresses as 0x-prefixed hex, and the contract takes 20 bytes
+    if isinstance(addr, bytes) and len(addr) == 20:
+        return addr
+    if addr.startswith('0x'):
+        addr = addr[2:]
+    return decode_hex(addr)
+
+def _event_type(ev):
+    t = ev['_event_type']
+    return t.decode('utf8') if isinstance(t, bytes) else t
+
+class CircuitBreaker(object):
+
+    def __init__(self, failure_threshold=3, cooldown=60, max_cooldown=3600):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        # client => [consecutive failures, times opened, open until]
+        self.clients = {}
+
+    def allow(self, client, now):
+        state = self.clients.get(client)
+        return state is None or state[0] < self.failure_threshold or now >= state[2]
+
+    def is_open(self, client, now):
+        return not self.allow(client, now)
+
+    def is_trial(self, client):
+        # Whether the client's next delivery is a trial after a cooldown
+        state = self.clients.get(client)
+        return state is not None and state[0] >= self.failure_threshold
+
+    def record(self, client, ok, now):
+        if ok:
+            self.clients.pop(client, None)
+            return
+        state = self.clients.setdefault(client, [0, 0, 0])
+        state[0] = state[0] + 1
+        if state[0] >= self.failure_threshold:
+            # Opened, or a trial after the cooldown failed: wait longer this time
+            state[1] = state[1] + 1
+            state[2] = now + min(self.max_cooldown, self.cooldown * 2 ** (state[1] - 1))
+
+class CallbackDispatcher(object):
+
+    def __init__(self, send, concurrency=4, block_gas=3000000, failure_threshold=3, cooldown=60, max_cooldown=3600,
+                 retry_delay=15, max_attempts=5):
+        self.send = send
+        self.concurrency = concurrency
+        self.block_gas = block_gas
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self.breaker = CircuitBreaker(failure_threshold, cooldown, max_cooldown)
+        self.scheduler = FinalizationScheduler()
+        # question_id => {(client, gas): bounty}, for requests not yet delivered
+        self.requests = {}
+        # question_id => finalize_ts, for final questions with requests not yet delivered
+        self.final = {}
+        # (question_id, client, gas) => [attempts, retry at], for deliveries whose transaction failed
+        self.retries = {}
+        self.in_flight = set()
+        # Seconds from finalization to delivery, most recent last
+        self.latencies = []
+        self.delivered = 0
+        self.exploded = 0
+        self.failed = 0
+        self.abandoned = 0
+
+    def process_event(self, ev, timestamp):
+        event_type = _event_type(ev)
+        if event_type == 'LogFundCallbackRequest':
+            key = (_address(ev['ctrct']), ev['gas'])
+            requests = self.requests.setdefault(ev['question_id'], {})
+            requests[key] = requests.get(key, 0) + ev['bounty']
+            if ev['question_id'] not in self.final and ev['question_id'] not in self.scheduler.questions:
+                self.final[ev['question_id']] = timestamp
+        elif event_type == 'LogSendCallback':
+            # Whoever sent it, the request is spent, and the client has shown whether it works.
+            # Unless we sent it, in which case we've already counted it.
+            client = _address(ev['ctrct'])
+            if self._spend(ev['question_id'], client, ev['gas']):
+                self.breaker.record(client, ev['callback_result'], timestamp)
+        else:
+            self.scheduler.process_event(ev, timestamp)
+
+    def _spend(self, question_id, client, gas):
+        # Forgets a request. Returns whether we had it.
+        requests = self.requests.get(question_id)
+        if requests is None or (client, gas) not in requests:
+            return False
+        del requests[(client, gas)]
+        if not requests:
+            del self.requests[question_id]
+            self.final.pop(question_id, None)
+        self.retries.pop((question_id, client, gas), None)
+        return True
+
+    def process_block(self, block_number, timestamp, events):
+        # For event_stream.ingest
+        for ev in events:
+            self.process_event(ev, timestamp)
+
+    def wake(self, now):
+        # Marks the questions final by now that have requests waiting. Returns all the IDs that became final.
+        due = self.scheduler.due_at(now)
+        for finalize_ts, question_id in due:
+            if question_id in self.requests:
+                self.final[question_id] = finalize_ts
+        return [question_id for _, question_id in due]
+
+    def ready(self, now):
+        # (question_id, client, gas, bounty) for each delivery we can send now, best bounty first
+        deliveries = []
+        for question_id, requests in self.requests.items():
+            if question_id not in self.final:
+                continue
+            for (client, gas), bounty in requests.items():
+                delivery = (question_id, client, gas)
+                if bounty == 0 or delivery in self.in_flight or not self.breaker.allow(client, now):
+                    continue
+                retry = self.retries.get(delivery)
+                if retry is not None and now < retry[1]:
+                    continue
+                deliveries.append((question_id, client, gas, bounty))
+        deliveries.sort(key=lambda d: -d[3])
+        return deliveries
+
+    def rounds(self, deliveries):
+        # Packs deliveries into rounds that each fit in block_gas, keeping them in order as far as they'll go.
+        # One that asks for more than a block can hold gets a round of its own, and the node can decide.
+        rounds = []
+        for delivery in deliveries:
+            gas = delivery[2] + CALLBACK_OVERHEAD
+            for r in rounds:
+                if r[0] + gas <= self.block_gas:
+                    r[0] = r[0] + gas
+                    r[1].append(delivery)
+                    break
+            else:
+                rounds.append([gas, [delivery]])
+        return [r[1] for r in rounds]
+
+    async def _deliver(self, semaphore, delivery, now):
+        question_id, client, gas, bounty = delivery
+        key = (question_id, client, gas)
+        # Read now, as spending the question's last request forgets it
+        finalize_ts = self.final[question_id]
+        async with semaphore:
+            try:
+                result = await self.send(question_id, client, gas, bounty)
+            except Exception:
+                self.failed = self.failed + 1
+                retry = self.retries.setdefault(key, [0, 0])
+                retry[0] = retry[0] + 1
+                if retry[0] >= self.max_attempts:
+                    # Give up on it. It stays funded on chain, for anyone else who wants the bounty.
+                    self.abandoned = self.abandoned + 1
+                    self._spend(question_id, client, gas)
+                else:
+                    retry[1] = now + self.retry_delay * 2 ** (retry[0] - 1)
+                return None
+            finally:
+                self.in_flight.discard(key)
+        # Done now rather than when LogSendCallback turns up, so nothing is sent twice
+        self._spend(question_id, client, gas)
+        self.breaker.record(client, result, now)
+        self.delivered = self.delivered + 1
+        if not result:
+            self.exploded = self.exploded + 1
+        self.latencies.append(now - finalize_ts)
+        if len(self.latencies) > LATENCY_WINDOW:
+            del self.latencies[0]
+        return result
+
+    async def dispatch(self, now):
+        # Sends everything ready now. Returns a list of (question_id, client, gas, bounty, result), with None as the
+        # result for a transaction that failed.
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = []
+        trials = set()
+        for deliveries in self.rounds(self.ready(now)):
+            sent = []
+            for delivery in deliveries:
+                client = delivery[1]
+                # A client whose circuit opened earlier in this dispatch waits, and one on trial gets one delivery
+                if not self.breaker.allow(client, now) or client in trials:
+                    continue
+                if self.breaker.is_trial(client):
+                    trials.add(client)
+                self.in_flight.add(delivery[:3])
+                sent.append(delivery)
+            outcomes = await asyncio.gather(*[self._deliver(semaphore, delivery, now) for delivery in sent])
+            results.extend(delivery + (result,) for delivery, result in zip(sent, outcomes))
+        return results
+
+    def stats(self, now):
+        times = sorted(self.latencies)
+
+        def percentile(p):
+            if not times:
+                return None
+            return times[min(len(times) - 1, int(len(times) * p))]
+
+        return {
+            'waiting': sum(len(r) for q, r in self.requests.items() if q in self.final),
+            'delivered': self.delivered,
+            'exploded': self.exploded,
+            'failed': self.failed,
+            'abandoned': self.abandoned,
+            'open_circuits': len([c for c in self.breaker.clients if self.breaker.is_open(c, now)]),
+            'latency_p50': percentile(0.5),
+            'latency_p95': percentile(0.95),
+        }
+
+    async def run(self, streams, poll_interval=5, report=None, clock=time.time):
+        # Follows the streams, dispatching whatever is ready, and waits until the next question becomes final or it's
+        # time to poll again, whichever comes first.
+        # There's no rollback, so give the streams enough confirmations that reorgs don't reach them.
+        while True:
+            for stream in streams:
+                ingest(stream.poll(), self)
+            self.wake(clock())
+            await self.dispatch(clock())
+            if report is not None:
+                report(self.stats(clock()))
+            wait = poll_interval
+            next_ts = self.scheduler.next_due()
+            if next_ts is not None:
+                wait = max(0, min(wait, next_ts - clock()))
+            await asyncio.sleep(wait)
+
+def tester_sender(c, caller_backer, sender=None):
+    # A send() for CallbackDispatcher over the tester. The tester runs each transaction as it's sent, so nothing is
+    # really concurrent, but it goes through the same pool.
+    from ethereum.tools import tester as t
+    from harness import make_room
+    if sender is None:
+        sender = t.k0
+
+    async def send(question_id, client, gas, bounty):
+        startgas = gas + CALLBACK_OVERHEAD
+        make_room(c, startgas)
+        return caller_backer.sendCallback(question_id, client, gas, bounty, sender=sender, startgas=startgas)
+
+    return send
@@ -0,0 +1,144 @@
+import asyncio
+import json
+
+from rlp.utils import encode_hex, decode_hex
+
+from ethereum.messages import apply_message
+
+# A minimal JSON-RPC server over the tester's t.Chain, enough for rpc_client.py to be tested without a node.
+# Serves eth_call, eth_blockNumber and net_version, singly or in batches, over HTTP/1.1 with keep-alive.
+#   server = ChainRPCServer(self.c)
+#   await server.start()
+#   client = rpc_client.RPCClient(server.url)
+# Calls run on a throwaway copy of the state, so they never change the chain.
+# 'latest' reads the tester's head state, which includes transactions not yet mined, as the tests' own calls do.
+# A block number reads the state after that block.
+#
+# Run it on the thread that owns the chain: the tester isn't safe to use from two threads at once.
+
+GAS_LIMIT = 10000000
+
+# asyncio.current_task() is new in Python 3.7. Before that it's Task.current_task(), which 3.9 removes.
+_current_task = getattr(asyncio, 'current_task', None) or asyncio.Task.current_task
+
+def _hex(data):
+    return '0x' + encode_hex(data)
+
+def _unhex(data):
+    return decode_hex(data[2:] if data.startswith('0x') else data)
+
+class RPCMethodError(Exception):
+
+    def __init__(self, message, code=-32000):
+        Exception.__init__(self, message)
+        self.code = code
+
+class ChainRPCServer(object):
+
+    def __init__(self, c, host='127.0.0.1', port=0):
+        self.c = c
+        self.host = host
+        self.port = port
+        self.server = None
+        self.connections = set()
+        # Counts, so tests can see how the client batched its calls
+        self.requests = 0
+        self.batches = 0
+
+    @property
+    def url(self):
+        return 'http://{}:{}/'.format(self.host, self.port)
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        for task in list(self.connections):
+            task.cancel()
+        if self.connections:
+            await asyncio.wait(list(self.connections))
+        await self.server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        task = _current_task()
+        self.connections.add(task)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                length = 0
+                keep_alive = True
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    name = name.strip().lower()
+                    if name == 'content-length':
+                        length = int(value)
+                    elif name == 'connection' and value.strip().lower() == 'close':
+                        keep_alive = False
+                body = await reader.readexactly(length)
+                data = json.dumps(self.handle(body)).encode('utf8')
+                head = "HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n".format(len(data))
+                writer.write(head.encode('ascii') + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self.connections.discard(task)
+            writer.close()
+
+    def handle(self, body):
+        # Returns the JSON-RPC response for a request body, one response per request in a batch
+        try:
+            payload = json.loads(body.decode('utf8'))
+        except ValueError:
+            return {'jsonrpc': '2.0', 'id': None, 'error': {'code': -32700, 'message': 'Parse error'}}
+        if isinstance(payload, list):
+            self.batches = self.batches + 1
+            return [self._respond(req) for req in payload]
+        return self._respond(payload)
+
+    def _respond(self, req):
+        self.requests = self.requests + 1
+        res = {'jsonrpc': '2.0', 'id': req.get('id')}
+        handler = getattr(self, '_' + str(req.get('method')), None)
+        if handler is None:
+            res['error'] = {'code': -32601, 'message': 'Method not found: {}'.format(req.get('method'))}
+            return res
+        try:
+            res['result'] = handler(*req.get('params', []))
+        except RPCMethodError as e:
+            res['error'] = {'code': e.code, 'message': str(e)}
+        return res
+
+    def _state_at(self, block):
+        if block in ('latest', 'pending'):
+            self.c.head_state.commit()
+            return self.c.head_state.ephemeral_clone()
+        number = int(block, 16) if isinstance(block, str) else block
+        if number > self.c.chain.head.header.number:
+            raise RPCMethodError("Unknown block {}".format(block))
+        return self.c.chain.mk_poststate_of_blockhash(self.c.chain.get_blockhash_by_number(number)).ephemeral_clone()
+
+    def _eth_call(self, tx, block='latest'):
+        state = self._state_at(block)
+        sender = _unhex(tx['from']) if 'from' in tx else b'\x00' * 20
+        gas = int(tx['gas'], 16) if 'gas' in tx else GAS_LIMIT
+        value = int(tx['value'], 16) if 'value' in tx else 0
+        result = apply_message(state, sender=sender, to=_unhex(tx['to']), value=value, gas=gas, data=_unhex(tx.get('data', '0x')))
+        if result is None:
+            raise RPCMethodError("execution reverted")
+        return _hex(result)
+
+    def _eth_blockNumber(self):
+        return hex(self.c.chain.head.header.number)
+
+    def _net_version(self):
+        return str(self.c.chain.env.config['NETWORK_ID'])
@@ -0,0 +1,209 @@
+import argparse
+import json
+import sys
+
+from ethereum.tools import tester as t
+from ethereum.tools import keys
+
+from harness import ChainFixture, rich_alloc, measure_gas, advance_time
+from answer_history import AnswerHistory
+from harness import to_answer_for_contract, calculate_commitment_hash, calculate_commitment_id
+import claim_planner
+
+# Measures how the gas for claimWinnings grows with the length of the answer history,
+# claiming in one call and in chunks through the question_claims resume path,
+# and works out the longest history that can be claimed in one block.
+#   python claim_bench.py
+#   python claim_bench.py --block-gas-limit 6700000 --json claim_bench.json
+#   python claim_bench.py --costs     # just fit claim_planner's cost model for claimMultipleAndWithdrawBalance
+#
+# Every answer has to at least double the bond, and SafeMath reverts once bond * 2 overflows,
+# so a history starting from a 1 wei bond can't get much past 250 entries. The longest one we build is 240.
+
+HISTORY_LENGTHS = [1, 2, 5, 10, 20, 40, 80, 120, 160, 200, 240]
+CHUNK_SIZES = [10, 25, 50]
+
+DEFAULT_BLOCK_GAS_LIMIT = 8000000
+
+TIMEOUT = 86400
+BOUNTY = 1000
+NONCE = 1234
+
+ANSWERERS = [t.k3, t.k4, t.k5, t.k6]
+
+# The tester's block gas limit is about 4.7m, less than a long claim needs.
+# We only raise it for the claim itself, and never mine afterwards, since the real block header still has the old limit.
+UNLIMITED_GAS = 10**9
+
+class ClaimBench(object):
+
+    def __init__(self):
+        self.fixture = ChainFixture(alloc=rich_alloc(2**254))
+
+    def start(self):
+        self.fixture.revert()
+        self.c = self.fixture.c
+        self.rc0 = self.fixture.rc0
+        self.arb0 = self.fixture.arb0
+
+    def ask(self, nonce):
+        qid, _ = measure_gas(self.c, self.rc0.askQuestion, 0, "claim bench question", self.arb0.address, TIMEOUT, 0, nonce, value=BOUNTY, startgas=200000)
+        return qid
+
+    def answer(self, qid, length):
+        # Mixes plain answers, commitments (every third entry, every other one of which is never revealed)
+        # and, for histories longer than one entry, finishes with an arbitrator's answer.
+        hist = AnswerHistory()
+        for i in range(length):
+            sender = ANSWERERS[i % len(ANSWERERS)]
+            addr = keys.privtoaddr(sender)
+            answer = to_answer_for_contract(1 + i % 2)
+            bond = 2**i
+
+            if i == length - 1 and length > 1:
+                fee, _ = measure_gas(self.c, self.arb0.getDisputeFee, qid, startgas=100000)
+                measure_gas(self.c, self.arb0.requestArbitration, self.rc0.address, qid, value=fee, sender=t.k7, startgas=200000)
+                measure_gas(self.c, self.arb0.submitAnswerByArbitrator, self.rc0.address, qid, answer, addr, startgas=200000)
+                hist.add(addr, 0, answer)
+
+            elif i % 3 == 1:
+                answer_hash = calculate_commitment_hash(answer, NONCE)
+                commitment_id = calculate_commitment_id(qid, answer_hash, bond)
+                measure_gas(self.c, self.rc0.submitAnswerCommitment, qid, answer_hash, 0, addr, value=bond, sender=sender, startgas=200000)
+                hist.add(addr, bond, commitment_id, True)
+                if i % 6 == 1:
+                    measure_gas(self.c, self.rc0.submitAnswerReveal, qid, answer, NONCE, bond, sender=sender, startgas=200000)
+
+            else:
+                measure_gas(self.c, self.rc0.submitAnswer, qid, answer, 0, value=bond, sender=sender, startgas=200000)
+                hist.add(addr, bond, answer)
+
+        return hist
+
+    def finish(self):
+        advance_time(self.c, TIMEOUT + 1)
+        self.c.head_state.gas_limit = UNLIMITED_GAS
+
+    def build_history(self, length):
+        qid = self.ask(length)
+        hist = self.answer(qid, length)
+        self.finish()
+        return qid, hist
+
+    def claim_in_chunks(self, qid, hist, chunk_size):
+        # Returns the gas for each claimWinnings call
+        gas_per_call = []
+        for start in range(0, len(hist), chunk_size):
+            hashes, addrs, bonds, answers = hist.claim_args(start, start + chunk_size)
+            _, gas = measure_gas(self.c, self.rc0.claimWinnings, qid, hashes, addrs, bonds, answers, startgas=UNLIMITED_GAS // 2)
+            gas_per_call.append(gas)
+        return gas_per_call
+
+    def measure_claim_multiple(self, questions, entries):
+        self.start()
+        histories = {}
+        for i in range(questions):
+            qid = self.ask(i + 1)
+            histories[qid] = self.answer(qid, entries)
+        self.finish()
+        batch = claim_planner.ClaimBatch()
+        for qid in sorted(histories):
+            batch.add(qid, histories[qid], 0, None)
+        # Claimed by someone with nothing to withdraw, so the withdrawal costs the same every time
+        _, gas = measure_gas(self.c, self.rc0.claimMultipleAndWithdrawBalance, *batch.args(), sender=t.k8, startgas=UNLIMITED_GAS // 2)
+        return gas
+
+    def measure_claim_costs(self, entries=10, questions=5):
+        # Fits claim_planner's linear cost model to three claimMultipleAndWithdrawBalance calls
+        return claim_planner.ClaimCosts.from_measurements(
+            self.measure_claim_multiple(1, 1),
+            self.measure_claim_multiple(1, entries), entries,
+            self.measure_claim_multiple(questions, 1), questions)
+
+    def run(self, lengths=HISTORY_LENGTHS, chunk_sizes=CHUNK_SIZES):
+        results = []
+        for length in lengths:
+            res = {'length': length, 'chunks': {}}
+
+            self.start()
+            qid, hist = self.build_history(length)
+            res['single'] = self.claim_in_chunks(qid, hist, length)[0]
+
+            for chunk_size in chunk_sizes:
+                if chunk_size >= length:
+                    continue
+                self.start()
+                qid, hist = self.build_history(length)
+                res['chunks'][chunk_size] = self.claim_in_chunks(qid, hist, chunk_size)
+
+            results.append(res)
+        return results
+
+def fit_line(points):
+    # Least squares fit of gas = intercept + slope * length
+    n = float(len(points))
+    sx = sum(x for x, _ in points)
+    sy = sum(y for _, y in points)
+    sxx = sum(x * x for x, _ in points)
+    sxy = sum(x * y for x, y in points)
+    slope = (n * sxy - sx * sy) / (n * sxx - sx * sx)
+    intercept = (sy - slope * sx) / n
+    return intercept, slope
+
+def largest_single_claim(results, block_gas_limit):
+    # The longest measured history that fits, and the length where the fitted line reaches the limit
+    fits = [r['length'] for r in results if r['single'] <= block_gas_limit]
+    measured = max(fits) if fits else 0
+    points = [(r['length'], r['single']) for r in results]
+    if len(points) < 2:
+        return measured, None
+    intercept, slope = fit_line(points)
+    return measured, int((block_gas_limit - intercept) / slope)
+
+def report(results, block_gas_limit, stream=sys.stdout):
+    stream.write("{:>7} {:>11} {:>10}".format("length", "single", "per entry"))
+    chunk_sizes = sorted(set(k for r in results for k in r['chunks']))
+    for k in chunk_sizes:
+        stream.write(" {:>17}".format("chunks of {}".format(k)))
+    stream.write("\n")
+
+    for r in results:
+        stream.write("{:>7} {:>11} {:>10}".format(r['length'], r['single'], r['single'] // r['length']))
+        for k in chunk_sizes:
+            if k in r['chunks']:
+                total = sum(r['chunks'][k])
+                stream.write(" {:>11} {:>5}".format(total, total // r['length']))
+            else:
+                stream.write(" {:>17}".format("-"))
+        stream.write("\n")
+
+    intercept, slope = fit_line([(r['length'], r['single']) for r in results]) if len(results) > 1 else (None, None)
+    if slope is not None:
+        stream.write("\nclaimWinnings costs about {:.0f} + {:.0f} gas per entry\n".format(intercept, slope))
+    measured, fitted = largest_single_claim(results, block_gas_limit)
+    stream.write("Longest history measured that fits in a {} gas block: {}\n".format(block_gas_limit, measured))
+    if fitted is not None:
+        stream.write("Longest history that would fit, going by the fit: {}\n".format(fitted))
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure claimWinnings gas against answer history length')
+    parser.add_argument('--block-gas-limit', type=int, default=DEFAULT_BLOCK_GAS_LIMIT, help='block gas limit to fit a claim into (default: %(default)s)')
+    parser.add_argument('--lengths', type=int, nargs='+', default=HISTORY_LENGTHS, help='history lengths to measure')
+    parser.add_argument('--chunks', type=int, nargs='+', default=CHUNK_SIZES, help='chunk sizes for split claims')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--costs', action='store_true', help='measure the claim_planner cost model instead')
+    args = parser.parse_args()
+
+    if args.costs:
+        costs = ClaimBench().measure_claim_costs()
+        sys.stdout.write("ClaimCosts(base_gas={}, question_gas={}, entry_gas={})\n".format(costs.base_gas, costs.question_gas, costs.entry_gas))
+        return
+
+    results = ClaimBench().run(args.lengths, args.chunks)
+    report(results, args.block_gas_limit)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+from answer_history import HistoryError
+
+# Packs the claims for many finalized questions into as few claimMultipleAndWithdrawBalance transactions as fit under a gas ceiling.
+# Questions are placed largest first, each into the first transaction with room for it (first-fit decreasing).
+# A question too big for one transaction is split, using the contract's resume path: its full-sized chunks
+# go out on their own first, and the rest is packed along with the other questions.
+
+class ClaimCosts(object):
+
+    # Linear model of the gas used by claimMultipleAndWithdrawBalance:
+    # base_gas once per transaction, question_gas per question and entry_gas per history entry.
+    # The defaults are on the high side. claim_bench.py --costs measures them for the current contract.
+
+    def __init__(self, base_gas=80000, question_gas=30000, entry_gas=35000):
+        self.base_gas = base_gas
+        self.question_gas = question_gas
+        self.entry_gas = entry_gas
+
+    def question(self, entries):
+        return self.question_gas + entries * self.entry_gas
+
+    def batch(self, entries_per_question):
+        return self.base_gas + sum(self.question(n) for n in entries_per_question)
+
+    def max_entries(self, gas_ceiling):
+        # The most entries of a single question that fit in one transaction
+        n = (gas_ceiling - self.base_gas - self.question_gas) // self.entry_gas
+        if n < 1:
+            raise HistoryError("A gas ceiling of {} won't cover a claim of even one entry".format(gas_ceiling))
+        return n
+
+    @classmethod
+    def from_measurements(cls, one_entry, more_entries, entries, more_questions, questions):
+        # one_entry: gas for one question with one entry
+        # more_entries: gas for one question with `entries` entries
+        # more_questions: gas for `questions` questions with one entry each
+        if entries < 2:
+            raise ValueError("Need a claim of at least 2 entries to measure the gas per entry, got {}".format(entries))
+        if questions < 2:
+            raise ValueError("Need a claim of at least 2 questions to measure the gas per question, got {}".format(questions))
+        entry_gas = (more_entries - one_entry) // (entries - 1)
+        question_gas = (more_questions - one_entry) // (questions - 1) - entry_gas
+        base_gas = one_entry - question_gas - entry_gas
+        return cls(base_gas, question_gas, entry_gas)
+
+class ClaimBatch(object):
+
+    # The arguments for one claimMultipleAndWithdrawBalance transaction
+
+    def __init__(self):
+        self.question_ids = []
+        self.lengths = []
+        self.hist_hashes = []
+        self.addrs = []
+        self.bonds = []
+        self.answers = []
+        self.gas = 0
+
+    def add(self, question_id, hist, start, end):
+        hashes, addrs, bonds, answers = hist.claim_args(start, end)
+        self.question_ids.append(question_id)
+        self.lengths.append(len(hashes))
+        self.hist_hashes.extend(hashes)
+        self.addrs.extend(addrs)
+        self.bonds.extend(bonds)
+        self.answers.extend(answers)
+
+    def args(self):
+        return self.question_ids, self.lengths, self.hist_hashes, self.addrs, self.bonds, self.answers
+
+def plan_claims(histories, gas_ceiling, costs=None, starts=None):
+    # histories: question_id => AnswerHistory
+    # starts: question_id => entries already claimed, as answer_history.claimed_entries() works out. Defaults to none.
+    # Returns a list of ClaimBatch, to be sent in order. Each has its estimated gas in .gas, to use as startgas.
+    if costs is None:
+        costs = ClaimCosts()
+    if starts is None:
+        starts = {}
+
+    max_entries = costs.max_entries(gas_ceiling)
+
+    solo = []
+    items = []
+    for question_id in histories:
+        hist = histories[question_id]
+        start = starts.get(question_id, 0)
+        while len(hist) - start > max_entries:
+            batch = ClaimBatch()
+            batch.add(question_id, hist, start, start + max_entries)
+            batch.gas = costs.batch(batch.lengths)
+            solo.append(batch)
+            start = start + max_entries
+        if start < len(hist):
+            items.append((costs.question(len(hist) - start), question_id, start))
+
+    # Largest first; ties broken on question_id so the plan doesn't depend on dict order
+    items.sort(key=lambda item: (-item[0], item[1]))
+
+    capacity = gas_ceiling - costs.base_gas
+    bins = []
+    for gas, question_id, start in items:
+        for b in bins:
+            if b[0] + gas <= capacity:
+                b[0] = b[0] + gas
+                b[1].append((question_id, start))
+                break
+        else:
+            bins.append([gas, [(question_id, start)]])
+
+    batches = list(solo)
+    for _, contents in bins:
+        batch = ClaimBatch()
+        for question_id, start in contents:
+            batch.add(question_id, histories[question_id], start, None)
+        batch.gas = costs.batch(batch.lengths)
+        batches.append(batch)
+    return batches
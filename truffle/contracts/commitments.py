@@ -0,0 +1,110 @@
+import argparse
+import os
+import sys
+import time
+
+from sha3 import keccak_256
+
+# Commitment hashes and IDs for many answers at once, for bots that commit to thousands of answers ahead of time.
+# Everything goes in and out as flat buffers of 32-byte words, item i at offset 32*i:
+#   answer_hash   = keccak256(answer, nonce)                    as calculate_commitment_hash
+#   commitment_id = keccak256(question_id, answer_hash, bond)   as calculate_commitment_id
+# Words are sliced out of the buffers through memoryviews and fed straight to keccak, so there's no hex on the way.
+#   python commitments.py -n 100000     # time against the one-at-a-time helpers
+
+WORD = 32
+
+def pack_uint256(values):
+    # Nonces and bonds as one buffer of big-endian uint256 words
+    return b''.join(v.to_bytes(WORD, 'big') for v in values)
+
+def unpack_uint256(buf):
+    view = memoryview(buf)
+    return [int.from_bytes(view[o:o+WORD], 'big') for o in range(0, len(view), WORD)]
+
+def split_words(buf):
+    view = memoryview(buf)
+    return [view[o:o+WORD].tobytes() for o in range(0, len(view), WORD)]
+
+def _word_count(*bufs):
+    n = len(bufs[0])
+    for buf in bufs:
+        if len(buf) != n:
+            raise ValueError("Buffers differ in length: {} and {} bytes".format(n, len(buf)))
+    if n % WORD:
+        raise ValueError("Buffer of {} bytes is not a whole number of 32-byte words".format(n))
+    return n // WORD
+
+def commitment_hashes(answers, nonces):
+    n = _word_count(answers, nonces)
+    answers = memoryview(answers)
+    nonces = memoryview(nonces)
+    out = bytearray(n * WORD)
+    for o in range(0, n * WORD, WORD):
+        h = keccak_256(answers[o:o+WORD])
+        h.update(nonces[o:o+WORD])
+        out[o:o+WORD] = h.digest()
+    return bytes(out)
+
+def commitment_ids(question_ids, answer_hashes, bonds):
+    n = _word_count(question_ids, answer_hashes, bonds)
+    question_ids = memoryview(question_ids)
+    answer_hashes = memoryview(answer_hashes)
+    bonds = memoryview(bonds)
+    out = bytearray(n * WORD)
+
+    # A bot usually commits to many answers on the same question, so hash each question_id once and copy the state
+    prefixes = {}
+    for o in range(0, n * WORD, WORD):
+        qid = question_ids[o:o+WORD].tobytes()
+        prefix = prefixes.get(qid)
+        if prefix is None:
+            prefix = keccak_256(qid)
+            prefixes[qid] = prefix
+        h = prefix.copy()
+        h.update(answer_hashes[o:o+WORD])
+        h.update(bonds[o:o+WORD])
+        out[o:o+WORD] = h.digest()
+    return bytes(out)
+
+def commitments(question_ids, answers, nonces, bonds):
+    # Returns (answer_hashes, commitment_ids), both as flat buffers
+    answer_hashes = commitment_hashes(answers, nonces)
+    return answer_hashes, commitment_ids(question_ids, answer_hashes, bonds)
+
+def main():
+    from harness import calculate_commitment_hash, calculate_commitment_id, to_answer_for_contract
+
+    parser = argparse.ArgumentParser(description='Time batch commitment hashing against the one-at-a-time helpers')
+    parser.add_argument('-n', type=int, default=100000, help='number of commitments (default: %(default)s)')
+    parser.add_argument('--questions', type=int, default=10, help='number of distinct questions (default: %(default)s)')
+    args = parser.parse_args()
+
+    qids = [os.urandom(WORD) for _ in range(args.questions)]
+    question_ids = [qids[i % len(qids)] for i in range(args.n)]
+    answers = [to_answer_for_contract(i % 1000) for i in range(args.n)]
+    nonces = [int.from_bytes(os.urandom(WORD), 'big') for _ in range(args.n)]
+    bonds = [10**18 * 2**(i % 20) for i in range(args.n)]
+
+    started = time.time()
+    expected = []
+    for i in range(args.n):
+        answer_hash = calculate_commitment_hash(answers[i], nonces[i])
+        expected.append(calculate_commitment_id(question_ids[i], answer_hash, bonds[i]))
+    single = time.time() - started
+
+    # Packing is counted, since a caller starting from python ints has to do it
+    started = time.time()
+    _, ids = commitments(b''.join(question_ids), b''.join(answers), pack_uint256(nonces), pack_uint256(bonds))
+    batch = time.time() - started
+
+    if split_words(ids) != expected:
+        sys.stdout.write("Batch results differ from calculate_commitment_id\n")
+        sys.exit(1)
+
+    sys.stdout.write("{} commitments over {} questions\n".format(args.n, args.questions))
+    sys.stdout.write("one at a time: {:.3f}s\n".format(single))
+    sys.stdout.write("batch:         {:.3f}s ({:.1f}x)\n".format(batch, single / batch))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import argparse
+import sys
+import time
+
+from sha3 import keccak_256
+
+# Content hashes for many questions at once, for indexers re-checking every LogNewQuestion against its content_hash.
+#   content_hash = keccak256(uint256 template_id, uint32 opening_ts, string question)   as askQuestion packs it
+# The 36-byte header is built once per (template_id, opening_ts), which most questions share, and the question text
+# is hashed straight after it, with no ABI encoding or hex on the way.
+# Results come back as a flat buffer of 32-byte words, item i at offset 32*i, as in commitments.py.
+#   python content_hashes.py -n 100000     # time against calculate_content_hash
+
+WORD = 32
+
+def _utf8(s):
+    return s if isinstance(s, bytes) else s.encode('utf8')
+
+def content_hash(template_id, opening_ts, question):
+    return keccak_256(template_id.to_bytes(32, 'big') + opening_ts.to_bytes(4, 'big') + _utf8(question)).digest()
+
+def content_hashes(template_ids, opening_tss, questions):
+    n = len(questions)
+    if len(template_ids) != n or len(opening_tss) != n:
+        raise ValueError("Expected as many template IDs and opening times as questions, got {}, {} and {}".format(
+            len(template_ids), len(opening_tss), n))
+    out = bytearray(n * WORD)
+    headers = {}
+    for i in range(n):
+        key = (template_ids[i], opening_tss[i])
+        header = headers.get(key)
+        if header is None:
+            header = template_ids[i].to_bytes(32, 'big') + opening_tss[i].to_bytes(4, 'big')
+            headers[key] = header
+        o = i * WORD
+        out[o:o+WORD] = keccak_256(header + _utf8(questions[i])).digest()
+    return bytes(out)
+
+def mismatched_questions(events):
+    # Takes decoded LogNewQuestion events and returns the IDs of any whose content_hash doesn't match its fields
+    hashes = content_hashes([ev['template_id'] for ev in events], [ev['opening_ts'] for ev in events], [ev['question'] for ev in events])
+    view = memoryview(hashes)
+    return [ev['question_id'] for i, ev in enumerate(events) if view[i*WORD:(i+1)*WORD] != ev['content_hash']]
+
+def main():
+    from rlp.utils import decode_hex
+    from harness import calculate_content_hash
+
+    parser = argparse.ArgumentParser(description='Time batch content hashing against calculate_content_hash')
+    parser.add_argument('-n', type=int, default=100000, help='number of questions (default: %(default)s)')
+    parser.add_argument('--templates', type=int, default=6, help='number of distinct templates (default: %(default)s)')
+    args = parser.parse_args()
+
+    template_ids = [i % args.templates for i in range(args.n)]
+    opening_tss = [0 if i % 2 else 1500000000 + i for i in range(args.n)]
+    questions = [u"Will question {} resolve?\u241fcategory-{}".format(i, i % 20) for i in range(args.n)]
+
+    started = time.time()
+    expected = [decode_hex(calculate_content_hash(template_ids[i], questions[i], opening_tss[i])[2:]) for i in range(args.n)]
+    single = time.time() - started
+
+    started = time.time()
+    hashes = content_hashes(template_ids, opening_tss, questions)
+    batch = time.time() - started
+
+    if [hashes[o:o+WORD] for o in range(0, len(hashes), WORD)] != expected:
+        sys.stdout.write("Batch results differ from calculate_content_hash\n")
+        sys.exit(1)
+
+    sys.stdout.write("{} questions over {} templates\n".format(args.n, args.templates))
+    sys.stdout.write("calculate_content_hash: {:.3f}s\n".format(single))
+    sys.stdout.write("batch:                  {:.3f}s ({:.1f}x)\n".format(batch, single / batch))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+import threading
+import time
+
+import queue
+
+from ethereum.meta import apply_block
+
+# Streams RealityCheck's events block by block, for the question index and anything else that follows the contract.
+#
+# Logs are fetched a page of blocks at a time. The page size adapts: it halves when the source refuses the range
+# or a page comes back with more than max_logs logs, and doubles while pages stay small. Each page is decoded in one batch.
+# Once the source has refused a range, growth stops short of it: pages probe halfway between the largest range taken and
+# the smallest refused, so the limit is found in a few fetches instead of every other fetch going over it.
+# Only blocks at least `confirmations` deep are read. If a block already delivered is replaced, the stream yields
+# a Rollback naming a block it read that's still on the chain, and carries on from the block after it.
+#
+# Everything is a generator, so nothing is fetched until the consumer asks for it, and a slow consumer slows the fetching.
+# prefetch() runs a producer in a thread with a bounded queue, if you want fetching to overlap with processing
+# without it running arbitrarily far ahead.
+#
+# ChainLogSource stands in for a node over the tester's t.Chain. A source for a real node needs the same four methods.
+
+EVENT_TYPES = [
+    'LogNewQuestion',
+    'LogFundAnswerBounty',
+    'LogNewAnswer',
+    'LogAnswerReveal',
+    'LogNotifyOfArbitrationRequest',
+    'LogFinalize',
+    'LogClaim',
+    'LogWithdraw',
+]
+
+# How many block hashes to remember for spotting reorgs. A reorg reaching further back than this raises ReorgError.
+REORG_WINDOW = 128
+
+class RangeTooLarge(Exception):
+    pass
+
+class ReorgError(Exception):
+    pass
+
+class EventBlock(object):
+
+    # The decoded events from one block, in log order
+
+    def __init__(self, number, block_hash, timestamp, events):
+        self.number = number
+        self.hash = block_hash
+        self.timestamp = timestamp
+        self.events = events
+
+class Rollback(object):
+
+    # Blocks after block_number were delivered but are no longer on the chain. Undo them before going on.
+
+    def __init__(self, block_number):
+        self.block_number = block_number
+
+class ChainLogSource(object):
+
+    # The tester doesn't keep receipts once a block is mined, so each block is replayed on its parent's state to get them back.
+    # max_range mimics a node that refuses eth_getLogs over too many blocks.
+
+    def __init__(self, c, max_range=1000):
+        self.c = c
+        self.max_range = max_range
+        self.receipts = {}
+
+    def head_number(self):
+        return self.c.chain.head.header.number
+
+    def block_hash(self, number):
+        # Numbers above the head can still have stale entries in the db after a rewind, so don't trust them
+        if number > self.head_number():
+            return None
+        return self.c.chain.get_blockhash_by_number(number)
+
+    def block_timestamp(self, number):
+        return self.c.chain.get_block_by_number(number).header.timestamp
+
+    def _receipts(self, block):
+        if not block.transactions:
+            return []
+        if block.hash not in self.receipts:
+            state = self.c.chain.mk_poststate_of_blockhash(block.header.prevhash)
+            apply_block(state, block)
+            self.receipts[block.hash] = state.receipts
+        return self.receipts[block.hash]
+
+    def get_logs(self, from_block, to_block, address, topics):
+        # Returns a list of (block number, block hash, block timestamp, log), for logs from address whose first topic is in topics
+        if to_block - from_block + 1 > self.max_range:
+            raise RangeTooLarge("{} blocks is over the limit of {}".format(to_block - from_block + 1, self.max_range))
+        logs = []
+        for number in range(from_block, to_block + 1):
+            block = self.c.chain.get_block_by_number(number)
+            for receipt in self._receipts(block):
+                for log in receipt.logs:
+                    if log.address == address and log.topics and log.topics[0] in topics:
+                        logs.append((number, block.hash, block.header.timestamp, log))
+        return logs
+
+def event_topics(translator, event_types):
+    topics = set()
+    for event_id, data in translator.event_data.items():
+        name = data['name']
+        if isinstance(name, bytes):
+            name = name.decode('utf8')
+        if name in event_types:
+            topics.add(event_id)
+    return topics
+
+class EventStream(object):
+
+    def __init__(self, source, address, translator, event_types=EVENT_TYPES, start_block=0, confirmations=0,
+                 page_size=100, max_page_size=5000, max_logs=1000):
+        self.source = source
+        self.address = address
+        self.translator = translator
+        self.topics = event_topics(translator, event_types)
+        self.next_block = start_block
+        self.confirmations = confirmations
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+        self.max_logs = max_logs
+        # The largest range the source has taken, and the smallest it has refused, or None if it hasn't refused any
+        self.max_ok_range = 0
+        self.refused_range = None
+        # (number, hash) of blocks already read, oldest first
+        self.seen = []
+
+    def _remember(self, number, block_hash):
+        if self.seen and self.seen[-1][0] >= number:
+            return
+        self.seen.append((number, block_hash))
+        if len(self.seen) > REORG_WINDOW:
+            del self.seen[0]
+
+    def _check_reorg(self):
+        # If something we've read has been replaced, returns the newest block we read that hasn't, otherwise None
+        if not self.seen or self.source.block_hash(self.seen[-1][0]) == self.seen[-1][1]:
+            return None
+        while self.seen:
+            number, block_hash = self.seen.pop()
+            if self.source.block_hash(number) == block_hash:
+                self.seen.append((number, block_hash))
+                return number
+        raise ReorgError("Chain reorganized back past the {} blocks remembered".format(REORG_WINDOW))
+
+    def _fetch(self, from_block, to_block):
+        # Shrinks the range until the source will take it. Returns the logs and the last block they cover.
+        while True:
+            size = to_block - from_block + 1
+            try:
+                logs = self.source.get_logs(from_block, to_block, self.address, self.topics)
+            except RangeTooLarge:
+                if self.refused_range is None or size < self.refused_range:
+                    self.refused_range = size
+                if to_block == from_block:
+                    raise
+                to_block = from_block + (to_block - from_block) // 2
+                self.page_size = to_block - from_block + 1
+                continue
+            self.max_ok_range = max(self.max_ok_range, size)
+            return logs, to_block
+
+    def _grow(self):
+        size = min(self.max_page_size, self.page_size * 2)
+        if self.refused_range is not None and size >= self.refused_range:
+            size = max(self.page_size, (self.max_ok_range + self.refused_range) // 2)
+        self.page_size = size
+
+    def _decode(self, logs):
+        blocks = []
+        for number, block_hash, timestamp, log in logs:
+            if not blocks or blocks[-1].number != number:
+                blocks.append(EventBlock(number, block_hash, timestamp, []))
+            blocks[-1].events.append(self.translator.listen(log))
+        return blocks
+
+    def poll(self):
+        # Yields EventBlock and Rollback items up to the newest confirmed block, then stops.
+        # Blocks without any of our events are skipped, except the last one of each page,
+        # which is always yielded so consumers see time move on.
+        if not self.seen and 0 < self.next_block <= self.source.head_number() + 1:
+            # Remember the block we start after, so a reorg replacing everything we read still finds a common block
+            self._remember(self.next_block - 1, self.source.block_hash(self.next_block - 1))
+        while True:
+            common = self._check_reorg()
+            if common is not None:
+                self.next_block = common + 1
+                yield Rollback(common)
+
+            last = self.source.head_number() - self.confirmations
+            if self.next_block > last:
+                return
+
+            to_block = min(last, self.next_block + self.page_size - 1)
+            logs, to_block = self._fetch(self.next_block, to_block)
+
+            blocks = self._decode(logs)
+            if not blocks or blocks[-1].number != to_block:
+                blocks.append(EventBlock(to_block, self.source.block_hash(to_block), self.source.block_timestamp(to_block), []))
+
+            if len(logs) > self.max_logs:
+                self.page_size = max(1, self.page_size // 2)
+            elif len(logs) < self.max_logs // 4:
+                self._grow()
+
+            for block in blocks:
+                self._remember(block.number, block.hash)
+            self.next_block = to_block + 1
+            for block in blocks:
+                yield block
+
+    def follow(self, interval=5):
+        # Polls forever, waiting interval seconds whenever it has caught up
+        while True:
+            for item in self.poll():
+                yield item
+            time.sleep(interval)
+
+def ingest(items, consumer):
+    # Feeds a stream to something with process_block(number, timestamp, events), like QuestionIndex.
+    # Rollbacks go to consumer.rollback(block_number); a consumer without one can't survive a reorg past its confirmations.
+    for item in items:
+        if isinstance(item, Rollback):
+            if not hasattr(consumer, 'rollback'):
+                raise ReorgError("Blocks after {} were replaced, and {} can't roll back".format(item.block_number, type(consumer).__name__))
+            consumer.rollback(item.block_number)
+        else:
+            consumer.process_block(item.number, item.timestamp, item.events)
+
+_DONE = object()
+
+def prefetch(items, maxsize=16):
+    # Runs the producer in a thread, at most maxsize items ahead of the consumer.
+    # Only for sources that are safe to read from another thread, which the tester isn't while a test is using it.
+    q = queue.Queue(maxsize)
+    failure = []
+
+    def produce():
+        try:
+            for item in items:
+                q.put(item)
+        except Exception as e:
+            failure.append(e)
+        q.put(_DONE)
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    while True:
+        item = q.get()
+        if item is _DONE:
+            break
+        yield item
+    thread.join()
+    if failure:
+        raise failure[0]
@@ -0,0 +1,293 @@
+import importlib.util
+import os
+
+from rlp.utils import encode_hex, decode_hex
+from ethereum import opcodes
+from ethereum.abi import ContractTranslator
+from ethereum.tools import tester as t
+from ethereum.tools import keys
+
+import solc_cache
+
+# One interface over the EVMs we can run the contracts on, so code written against it runs on either:
+#   pyethereum      ethereum.tools.tester, what the benchmarks and harness.get_fixture() use
+#   eth-tester      eth_tester's PyEVMBackend, on py-evm
+# eth-tester is the ethereum-tester 0.1.0b2 in requirements.txt. Its py-evm 0.2.0a5 pins rlp 0.4.7, where pyethereum
+# needs 0.5.1, so pip won't install it with the rest. It runs on 0.5.1 all the same, installed without its dependencies:
+#   pip install --no-deps py-evm==0.2.0a5 trie==0.3.2 ethereum-bloom==0.4.0
+# Pick one with EVM_BACKEND, or get_backend(name):
+#   chain = get_backend()
+#   rc = chain.deploy('RealityCheck')
+#   question_id = rc.askQuestion(0, "my question", arb.address, 10, 0, 0, value=1100)
+#   chain.timestamp = chain.timestamp + 11
+#   chain.mine()
+# Contracts are called as with t.ABIContract: rc.fn(*args, sender=t.k3, value=..., startgas=...), with the tester's
+# keys as senders, and results decoded by the same translator, so both backends return the same values.
+# Both raise TransactionFailed from this module when a transaction or call reverts. It's a t.TransactionFailed, so
+# code written for the tester catches it too.
+#
+# Where the two differ:
+#   pyethereum sends constant functions as transactions, as t.ABIContract does, so tests that count the transactions
+#   in a block or read their receipts see the same ones. eth-tester runs them as calls.
+#   pyethereum collects transactions in a pending block until mine(), and setting the timestamp mines that block
+#   and opens the next at the time given.
+#   eth-tester mines each transaction in a block of its own, a second after the last, and time only goes forward.
+#   Its calls run on the latest block, so they see the time a second behind the transactions, as do the values
+#   transactions return, which come from a call.
+#   gas_used counts the gas of the transactions since the last mine() on both, failed ones included.
+#
+#   python backend_bench.py      # compares their throughput
+
+def intrinsic_gas(data):
+    # What a transaction pays before any code runs
+    zeros = data.count(b'\x00')
+    return opcodes.GTXCOST + opcodes.GTXDATAZERO * zeros + opcodes.GTXDATANONZERO * (len(data) - zeros)
+
+class TransactionFailed(t.TransactionFailed):
+    pass
+
+class BackendUnavailable(Exception):
+    pass
+
+class Contract(object):
+
+    def __init__(self, backend, abi, address):
+        self.backend = backend
+        self.address = address
+        self.translator = ContractTranslator(abi)
+        for fn in self.translator.function_data:
+            setattr(self, fn, self._method(fn))
+
+    def _method(self, fn):
+        data = self.translator.function_data[fn]
+        constant = data['is_constant']
+        has_outputs = len(data['decode_types']) > 0
+
+        def method(*args, **kwargs):
+            sender = kwargs.get('sender', t.k0)
+            value = kwargs.get('value', 0)
+            startgas = kwargs.get('startgas', t.STARTGAS)
+            calldata = self.translator.encode_function_call(fn, args)
+            if constant and not self.backend.transact_constants:
+                output = self.backend.call(sender, self.address, value, calldata, startgas)
+            else:
+                output = self.backend.transact(sender, self.address, value, calldata, startgas, has_outputs)
+            if output is None:
+                return None
+            result = self.translator.decode_function_result(fn, output)
+            return result[0] if len(result) == 1 else result
+
+        return method
+
+class Backend(object):
+
+    # Adapters provide create(), transact(), call(), balance(), mine(), the timestamp property, snapshot() and revert()
+
+    name = None
+
+    # Whether Contract sends constant functions as transactions rather than calls
+    transact_constants = False
+
+    @classmethod
+    def available(cls):
+        return True
+
+    def __init__(self):
+        self.compiled = {}
+        self.gas_used = 0
+        self.last_gas_used = 0
+
+    def address(self, sender):
+        return keys.privtoaddr(sender)
+
+    def compile(self, name):
+        if name not in self.compiled:
+            self.compiled[name] = solc_cache.compile_file(name + '.sol')
+        return self.compiled[name]
+
+    def deploy(self, name, sender=t.k0, startgas=t.STARTGAS):
+        abi, code = self.compile(name)
+        return Contract(self, abi, self.create(sender, code, startgas))
+
+    def advance_time(self, seconds):
+        self.timestamp = self.timestamp + seconds
+
+    def _charge(self, gas):
+        self.last_gas_used = gas
+        self.gas_used = self.gas_used + gas
+
+class PyEthereumBackend(Backend):
+
+    name = 'pyethereum'
+
+    transact_constants = True
+
+    def __init__(self, alloc=None):
+        import harness
+        Backend.__init__(self)
+        self.c = t.Chain(alloc)
+        self.harness = harness
+
+    def create(self, sender, code, startgas):
+        before = self.c.head_state.gas_used
+        try:
+            address = self.c.tx(sender=sender, to=b'', data=code, startgas=startgas)
+        except t.TransactionFailed as e:
+            raise TransactionFailed(str(e))
+        finally:
+            self._charge(self.c.head_state.gas_used - before)
+        return address
+
+    def transact(self, sender, to, value, data, startgas, has_outputs=True):
+        before = self.c.head_state.gas_used
+        try:
+            output = self.c.tx(sender=sender, to=to, value=value, data=data, startgas=startgas)
+        except t.TransactionFailed as e:
+            raise TransactionFailed(str(e))
+        finally:
+            self._charge(self.c.head_state.gas_used - before)
+        return output if has_outputs else None
+
+    def call(self, sender, to, value, data, startgas):
+        from ethereum.messages import apply_message
+        self.c.head_state.commit()
+        output = apply_message(self.c.head_state.ephemeral_clone(), sender=self.address(sender), to=to, value=value, gas=startgas, data=data)
+        if output is None:
+            raise TransactionFailed("Call to 0x{} reverted".format(encode_hex(to)))
+        return output
+
+    def balance(self, address):
+        return self.c.head_state.get_balance(address)
+
+    def mine(self):
+        self.c.mine()
+        self.gas_used = 0
+
+    @property
+    def timestamp(self):
+        return self.c.head_state.timestamp
+
+    @timestamp.setter
+    def timestamp(self, ts):
+        # Mines what's pending, as harness.advance_time does, so the block it was in keeps its timestamp
+        self.mine()
+        self.harness.open_block(self.c, ts)
+
+    def snapshot(self):
+        return self.harness.snapshot_chain(self.c), self.gas_used
+
+    def revert(self, snapshot):
+        self.harness.revert_chain(self.c, snapshot[0])
+        self.gas_used = snapshot[1]
+
+class EthTesterBackend(Backend):
+
+    name = 'eth-tester'
+
+    # What each of the tester's accounts starts with, as near as the genesis accounts can fund
+    FUNDING = 10**23
+
+    @classmethod
+    def available(cls):
+        # eth-tester 0.1 runs on py-evm 0.2, which is imported as evm
+        return importlib.util.find_spec('eth_tester') is not None and importlib.util.find_spec('evm') is not None
+
+    def __init__(self):
+        try:
+            from eth_tester import EthereumTester, PyEVMBackend
+        except ImportError as e:
+            raise BackendUnavailable("eth-tester with py-evm isn't installed: {}".format(e))
+        Backend.__init__(self)
+        self.tester = EthereumTester(PyEVMBackend())
+
+        # The same senders as pyethereum's tester, so sender=t.k3 means the same account on both
+        genesis = self.tester.get_accounts()
+        for i, key in enumerate(t.keys):
+            addr = self.tester.add_account('0x' + encode_hex(key))
+            self.tester.send_transaction({'from': genesis[i % len(genesis)], 'to': addr, 'gas': 21000, 'value': self.FUNDING})
+
+    def _tx(self, sender, to, value, data, startgas):
+        tx = {'from': '0x' + encode_hex(self.address(sender)), 'gas': startgas, 'value': value, 'data': '0x' + encode_hex(data)}
+        if to:
+            tx['to'] = '0x' + encode_hex(to)
+        return tx
+
+    def _send(self, tx):
+        receipt = self.tester.get_transaction_receipt(self.tester.send_transaction(tx))
+        self._charge(receipt['gas_used'])
+        # py-evm 0.2 runs Homestead, so receipts have no status. A failed transaction uses all its gas, REVERT included.
+        if receipt['gas_used'] >= tx['gas']:
+            raise TransactionFailed("Transaction failed, using all {} gas".format(tx['gas']))
+        return receipt
+
+    def create(self, sender, code, startgas):
+        receipt = self._send(self._tx(sender, b'', 0, code, startgas))
+        return decode_hex(receipt['contract_address'][2:])
+
+    def transact(self, sender, to, value, data, startgas, has_outputs=True):
+        tx = self._tx(sender, to, value, data, startgas)
+        output = None
+        if has_outputs:
+            # Receipts don't carry the return data, so get it from a call first.
+            # If the transaction is going to fail, _send says so.
+            output = self._call(tx)[0]
+        self._send(tx)
+        return output
+
+    def _call(self, tx):
+        # Calls run as if in the latest block, after the transactions already in it, so they only get the gas it has left
+        latest = self.tester.get_block_by_number('latest')
+        tx = dict(tx, gas=min(tx['gas'], latest['gas_limit'] - latest['gas_used']))
+        return decode_hex(self.tester.call(tx)[2:]), tx
+
+    def call(self, sender, to, value, data, startgas):
+        output, tx = self._call(self._tx(sender, to, value, data, startgas))
+        # A failed call returns nothing, the same as one with nothing to return, so check whether it used all its gas.
+        # estimate_gas counts what the code used, after the intrinsic gas.
+        if not output and self.tester.estimate_gas(tx) >= tx['gas'] - intrinsic_gas(data):
+            raise TransactionFailed("Call to 0x{} failed, using all {} gas".format(encode_hex(to), tx['gas']))
+        return output
+
+    def balance(self, address):
+        return self.tester.get_balance('0x' + encode_hex(address))
+
+    def mine(self):
+        self.tester.mine_blocks(1)
+        self.gas_used = 0
+
+    @property
+    def timestamp(self):
+        return self.tester.get_block_by_number('pending')['timestamp']
+
+    @timestamp.setter
+    def timestamp(self, ts):
+        # Calls run on the latest block, and transactions in the pending one a second after it.
+        # So mine a block at ts - 1, leaving transactions to run at ts as on pyethereum.
+        if ts - 1 > self.timestamp:
+            self.tester.time_travel(ts - 1)
+        self.mine()
+
+    def snapshot(self):
+        return self.tester.take_snapshot(), self.gas_used
+
+    def revert(self, snapshot):
+        self.tester.revert_to_snapshot(snapshot[0])
+        self.gas_used = snapshot[1]
+
+BACKENDS = {
+    PyEthereumBackend.name: PyEthereumBackend,
+    EthTesterBackend.name: EthTesterBackend,
+}
+
+DEFAULT_BACKEND = PyEthereumBackend.name
+
+def get_backend(name=None):
+    if name is None:
+        name = os.environ.get('EVM_BACKEND', DEFAULT_BACKEND)
+    if name not in BACKENDS:
+        raise ValueError("Unknown EVM backend {}, expected one of {}".format(name, ', '.join(sorted(BACKENDS))))
+    return BACKENDS[name]()
+
+def available_backends():
+    # The names of the backends that can run here
+    return [name for name in sorted(BACKENDS) if BACKENDS[name].available()]
@@ -0,0 +1,96 @@
+from rlp.utils import decode_hex
+
+# getFinalAnswerIfMatches for many (question, constraints) pairs at once, from a question_store.QuestionStore
+# snapshot instead of a call per pair. For the checks a backend runs before sending claims that consumer contracts,
+# like FireInsuranceExample and MetaQuestion, will gate on the same call.
+#   store = question_store.open_questions('/var/lib/rc/questions')
+#   results = check_final_answers(store, [(question_id, content_hash, arbitrator, min_timeout, min_bond), ...], now)
+# Each result is (None, best_answer) where the call would return best_answer, or (reason, None) where it would
+# revert, with reason the first of the contract's requires to fail, in the order it checks them:
+#   NOT_FINALIZED   stateFinalized: pending arbitration, unanswered, or finalize_ts still to come.
+#                   Also a question the store doesn't have, which the contract sees as all zeroes.
+#   CONTENT_HASH    content_hash doesn't match
+#   ARBITRATOR      arbitrator doesn't match
+#   MIN_TIMEOUT     the question's timeout is less than min_timeout
+#   MIN_BOND        the final answer's bond is less than min_bond
+# now is the timestamp of the block the call would run in. The contract compares finalize_ts with uint32(now), and
+# reads min_timeout as a uint32 from the calldata, so both are cut down to 32 bits here too.
+#
+# Each question's fields are read from the store once per call, however many checks name it.
+
+NOT_FINALIZED = 'not_finalized'
+CONTENT_HASH = 'content_hash'
+ARBITRATOR = 'arbitrator'
+MIN_TIMEOUT = 'min_timeout'
+MIN_BOND = 'min_bond'
+
+UINT32_MASK = 0xffffffff
+
+def _address(addr):
+    # The tester's translator gives addresses as 0x-prefixed hex
+    if isinstance(addr, bytes) and len(addr) == 20:
+        return addr
+    if addr.startswith('0x'):
+        addr = addr[2:]
+    return decode_hex(addr)
+
+class _Columns(object):
+
+    # The views of the store's columns a batch of checks reads
+
+    def __init__(self, store):
+        self.rows = store.rows
+        self.finalize_ts = store.column('finalize_ts')
+        self.is_pending_arbitration = store.column('is_pending_arbitration')
+        self.timeout = store.column('timeout')
+        self.content_hash = store.column('content_hash')
+        self.arbitrator = store.column('arbitrator')
+        self.bond = store.column('bond')
+        self.best_answer = store.column('best_answer')
+
+    def fields(self, question_id, now):
+        # (finalized, content_hash, arbitrator, timeout, bond, best_answer), or None if the store hasn't got the question
+        row = self.rows.get(question_id)
+        if row is None:
+            return None
+        finalize_ts = self.finalize_ts[row]
+        finalized = not self.is_pending_arbitration[row] and finalize_ts > 0 and finalize_ts <= now
+        return (
+            finalized,
+            self.content_hash[row*32:(row+1)*32].tobytes(),
+            self.arbitrator[row*20:(row+1)*20].tobytes(),
+            self.timeout[row],
+            int.from_bytes(self.bond[row*32:(row+1)*32], 'big'),
+            self.best_answer[row*32:(row+1)*32].tobytes(),
+        )
+
+def check_final_answer(fields, content_hash, arbitrator, min_timeout, min_bond):
+    if fields is None or not fields[0]:
+        return NOT_FINALIZED, None
+    if content_hash != fields[1]:
+        return CONTENT_HASH, None
+    if _address(arbitrator) != fields[2]:
+        return ARBITRATOR, None
+    if min_timeout & UINT32_MASK > fields[3]:
+        return MIN_TIMEOUT, None
+    if min_bond > fields[4]:
+        return MIN_BOND, None
+    return None, fields[5]
+
+def check_final_answers(store, checks, now):
+    now = now & UINT32_MASK
+    columns = _Columns(store)
+    questions = {}
+    results = []
+    for question_id, content_hash, arbitrator, min_timeout, min_bond in checks:
+        if question_id in questions:
+            fields = questions[question_id]
+        else:
+            fields = columns.fields(question_id, now)
+            questions[question_id] = fields
+        results.append(check_final_answer(fields, content_hash, arbitrator, min_timeout, min_bond))
+    return results
+
+def matching_answers(store, checks, now):
+    # Just the answers, with None for each check the contract would revert on
+    return [answer for _, answer in check_final_answers(store, checks, now)]
@@ -0,0 +1,134 @@
+import heapq
+import time
+
+from event_stream import ingest
+
+# Tells a claim or payout bot when each question becomes claimable, without polling isFinalized on every open question.
+# Answered questions sit in a min-heap on finalize_ts. Events move their finalization time as they do in the contract:
+#   LogNewAnswer                    a plain answer restarts the timer, a commitment leaves it alone
+#   LogAnswerReveal                 revealing the latest commitment restarts the timer
+#   LogNotifyOfArbitrationRequest   freezes the question until the arbitrator answers
+#   LogFinalize                     the arbitrator's answer, which finalizes the question straight away
+# due(now) pops whatever is final by now, and next_due() says when to look again.
+# The work per event or per question returned is O(log n) in the number of questions waiting.
+#
+# update_timing() applies the same rules to any dict with the timing fields, so the question index can share them.
+
+UNANSWERED = 0
+
+def new_timing(timeout):
+    return {
+        'timeout': timeout,
+        'finalize_ts': UNANSWERED,
+        'bond': 0,
+        'is_pending_arbitration': False,
+        'arbitrated': False,
+    }
+
+def update_timing(q, event_type, ev, timestamp):
+    # Applies an event to q's timing fields. Returns the new finalize_ts if the event set one, otherwise None.
+    finalize_ts = None
+    if event_type == 'LogNewAnswer':
+        if q['arbitrated']:
+            # submitAnswerByArbitrator logs LogFinalize, then adds its answer with no timeout
+            finalize_ts = ev['ts']
+        elif not ev['is_commitment']:
+            finalize_ts = ev['ts'] + q['timeout']
+        q['bond'] = ev['bond']
+    elif event_type == 'LogAnswerReveal':
+        # Only a reveal of the latest commitment becomes the current answer
+        if ev['bond'] == q['bond']:
+            finalize_ts = timestamp + q['timeout']
+    elif event_type == 'LogNotifyOfArbitrationRequest':
+        q['is_pending_arbitration'] = True
+    elif event_type == 'LogFinalize':
+        q['is_pending_arbitration'] = False
+        q['arbitrated'] = True
+    if finalize_ts is not None:
+        q['finalize_ts'] = finalize_ts
+    return finalize_ts
+
+def is_finalized(q, now):
+    # As RealityCheck.isFinalized
+    return not q['is_pending_arbitration'] and q['finalize_ts'] > UNANSWERED and q['finalize_ts'] <= now
+
+def _event_type(ev):
+    t = ev['_event_type']
+    return t.decode('utf8') if isinstance(t, bytes) else t
+
+class FinalizationScheduler(object):
+
+    def __init__(self):
+        # question_id => timing, for questions not yet handed out by due()
+        self.questions = {}
+        # (finalize_ts, question_id), earliest first. An entry whose finalize_ts is no longer current is skipped.
+        self.heap = []
+
+    def __len__(self):
+        return len(self.questions)
+
+    def add_question(self, question_id, timeout):
+        if question_id not in self.questions:
+            self.questions[question_id] = new_timing(timeout)
+
+    def process_event(self, ev, timestamp):
+        event_type = _event_type(ev)
+        if event_type == 'LogNewQuestion':
+            self.add_question(ev['question_id'], ev['timeout'])
+            return
+        q = self.questions.get(ev.get('question_id'))
+        if q is None:
+            return
+        finalize_ts = update_timing(q, event_type, ev, timestamp)
+        if finalize_ts is not None:
+            heapq.heappush(self.heap, (finalize_ts, ev['question_id']))
+
+    def process_block(self, block_number, timestamp, events):
+        # For event_stream.ingest. Questions come out through due(), not here.
+        for ev in events:
+            self.process_event(ev, timestamp)
+
+    def _discard_stale(self):
+        while self.heap:
+            finalize_ts, question_id = self.heap[0]
+            q = self.questions.get(question_id)
+            if q is not None and q['finalize_ts'] == finalize_ts and not q['is_pending_arbitration']:
+                return
+            # Superseded by a later answer, frozen by arbitration (the arbitrator's answer pushes a new entry), or already handed out
+            heapq.heappop(self.heap)
+
+    def next_due(self):
+        # The earliest time a waiting question becomes final, or None if none are due to
+        self._discard_stale()
+        if not self.heap:
+            return None
+        return self.heap[0][0]
+
+    def due(self, now):
+        # Returns the questions final by now, earliest first, and stops tracking them
+        return [question_id for _, question_id in self.due_at(now)]
+
+    def due_at(self, now):
+        # As due(), but as (finalize_ts, question_id), for anyone measuring how long after finalization they act
+        result = []
+        while True:
+            self._discard_stale()
+            if not self.heap or self.heap[0][0] > now:
+                return result
+            finalize_ts, question_id = heapq.heappop(self.heap)
+            del self.questions[question_id]
+            result.append((finalize_ts, question_id))
+
+    def run(self, stream, on_claimable, poll_interval=5, clock=time.time, sleep=time.sleep):
+        # Follows an event_stream.EventStream, calling on_claimable(question_id) as each question becomes final by the clock.
+        # Sleeps until the next question is due or it's time to poll again, whichever comes first.
+        # There's no rollback, so give the stream enough confirmations that reorgs don't reach it.
+        while True:
+            ingest(stream.poll(), self)
+            for question_id in self.due(clock()):
+                on_claimable(question_id)
+            wait = poll_interval
+            next_ts = self.next_due()
+            if next_ts is not None:
+                wait = max(0, min(wait, next_ts - clock()))
+            sleep(wait)
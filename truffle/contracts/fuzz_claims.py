@@ -0,0 +1,277 @@
+import argparse
+import multiprocessing
+import random
+import sys
+import time
+
+from bond_sim import Game, payouts
+
+# Stateful fuzzing of answer histories and split claims, for what test_bond_claim_split_over_transactions checks by hand.
+# Each case is a random list of steps, played on the tester from the fixture's snapshot:
+#   ('answer', player, multiplier, answer)              submitAnswer, bond = last bond * multiplier
+#   ('commit', player, multiplier, answer)              submitAnswerCommitment
+#   ('reveal', k)                                       submitAnswerReveal of the k-th commitment, if it's still unrevealed
+#   ('arbitrate', player, answer)                       requestArbitration, then submitAnswerByArbitrator crediting the player
+# then claimed in chunks of random sizes. Steps that can't happen any more (anything after arbitration, a reveal of a
+# commitment that isn't there) are skipped, so any subset of a case's steps is still a valid case.
+# Each case is checked for:
+#   conservation     what claimWinnings credits adds up to the bounty plus every bond
+#   chunking         claiming in the case's chunks credits everyone the same as claiming in one go
+#   model            both match bond_sim.payouts()
+# A failing case is shrunk, by dropping steps, merging chunks and lowering multipliers while it still fails.
+#
+# Workers build the fixture once each and revert to it for every case, as run_parallel.py does for tests.
+#   python fuzz_claims.py -n 2000 -j 8
+#   python fuzz_claims.py --case 1234          # rerun one seed
+
+PLAYERS = 5
+MAX_STEPS = 12
+MAX_CHUNK = 6
+BOUNTY = 1000
+DISPUTE_FEE = 100
+TIMEOUT = 10
+CLAIM_GAS = 600000
+
+class Case(object):
+
+    def __init__(self, steps, chunks, seed=None):
+        self.steps = steps
+        # Entries per claimWinnings call, last-to-first. The last chunk takes whatever is left.
+        self.chunks = chunks
+        self.seed = seed
+
+    def __repr__(self):
+        return "Case(steps={}, chunks={}, seed={})".format(self.steps, self.chunks, self.seed)
+
+class Failure(Exception):
+    pass
+
+def generate(seed):
+    rng = random.Random(seed)
+    steps = []
+    commits = 0
+    for _ in range(rng.randint(1, MAX_STEPS)):
+        r = rng.random()
+        player = rng.randrange(PLAYERS)
+        answer = rng.randrange(3)
+        if r < 0.5:
+            steps.append(('answer', player, rng.choice((2, 2, 3)), answer))
+        elif r < 0.75:
+            steps.append(('commit', player, rng.choice((2, 2, 3)), answer))
+            commits = commits + 1
+        elif r < 0.95 and commits:
+            steps.append(('reveal', rng.randrange(commits)))
+        else:
+            steps.append(('arbitrate', player, answer))
+    chunks = [rng.randint(1, MAX_CHUNK) for _ in range(rng.randint(1, 4))]
+    return Case(steps, chunks, seed)
+
+def play(fixture, case, chunks):
+    # Runs the case and claims in the given chunks. Returns (model Game, sum of bonds, {player: balanceOf increase}),
+    # with None as the player for the null address, or None if the question never got an answer to finalize on.
+    from ethereum.tools import tester as t
+    from ethereum.tools import keys
+    from harness import QINDEX_HISTORY_HASH, advance_time, make_room, \
+        to_answer_for_contract, calculate_commitment_hash, calculate_commitment_id
+    from answer_history import AnswerHistory, NULL_HASH
+
+    player_keys = [t.k1, t.k2, t.k3, t.k4, t.k5][:PLAYERS]
+    addrs = [keys.privtoaddr(k) for k in player_keys]
+
+    fixture.revert()
+    c = fixture.c
+    rc = fixture.rc0
+    arb = fixture.arb0
+    arb.setDisputeFee(DISPUTE_FEE, sender=t.k0, startgas=200000)
+    question_fee = rc.arbitrator_question_fees(arb.address)
+    question_id = rc.askQuestion(0, "fuzzed", arb.address, TIMEOUT, 0, 1, value=BOUNTY + question_fee, startgas=200000)
+
+    hist = AnswerHistory()
+    game = Game([], [], [], [], [], None, None, False)
+    # (entry index, answer, nonce) for each commitment
+    commitments = []
+    bond = 0
+    for step in case.steps:
+        if game.arbitrated:
+            break
+        if step[0] in ('answer', 'commit'):
+            _, player, multiplier, answer = step
+            bond = max(1, bond * multiplier)
+            answer_bytes = to_answer_for_contract(answer)
+            if step[0] == 'answer':
+                rc.submitAnswer(question_id, answer_bytes, 0, value=bond, sender=player_keys[player], startgas=200000)
+                hist.add(addrs[player], bond, answer_bytes)
+                game.best_answer = answer
+            else:
+                nonce = len(hist) + 1
+                answer_hash = calculate_commitment_hash(answer_bytes, nonce)
+                rc.submitAnswerCommitment(question_id, answer_hash, 0, addrs[player], value=bond, sender=player_keys[player], startgas=200000)
+                hist.add(addrs[player], bond, calculate_commitment_id(question_id, answer_hash, bond), True)
+                commitments.append((len(game.players), answer, nonce))
+            game.players.append(player)
+            game.bonds.append(bond)
+            game.answers.append(answer)
+            game.commitments.append(step[0] == 'commit')
+            game.revealed.append(step[0] == 'answer')
+        elif step[0] == 'reveal':
+            if step[1] >= len(commitments):
+                continue
+            i, answer, nonce = commitments[step[1]]
+            if game.revealed[i]:
+                continue
+            rc.submitAnswerReveal(question_id, to_answer_for_contract(answer), nonce, game.bonds[i], startgas=200000)
+            game.revealed[i] = True
+            # Only the latest commitment becomes the answer when revealed
+            if game.bonds[i] == bond:
+                game.best_answer = answer
+        elif step[0] == 'arbitrate':
+            if game.best_answer is None:
+                # An unanswered question can be arbitrated, but it's not worth the case
+                continue
+            _, player, answer = step
+            answer_bytes = to_answer_for_contract(answer)
+            arb.requestArbitration(rc.address, question_id, value=DISPUTE_FEE, sender=player_keys[player], startgas=200000)
+            arb.submitAnswerByArbitrator(rc.address, question_id, answer_bytes, addrs[player], sender=t.k0, startgas=200000)
+            hist.add(addrs[player], 0, answer_bytes)
+            game.players.append(player)
+            game.bonds.append(0)
+            game.answers.append(answer)
+            game.commitments.append(False)
+            game.revealed.append(True)
+            game.best_answer = answer
+            game.arbitrated = True
+
+    if game.best_answer is None:
+        return None
+
+    # Claim in a fresh block, after the timeout, so the claims have the block's gas to themselves
+    advance_time(c, TIMEOUT + 1)
+
+    accounts = addrs + [b'\x00' * 20]
+    before = [rc.balanceOf(addr) for addr in accounts]
+    start = 0
+    for i, size in enumerate(chunks):
+        if start >= len(hist):
+            break
+        end = len(hist) if i == len(chunks) - 1 else start + size
+        make_room(c, CLAIM_GAS)
+        rc.claimWinnings(question_id, *hist.claim_args(start, end), startgas=CLAIM_GAS)
+        start = end
+    if rc.questions(question_id)[QINDEX_HISTORY_HASH] != NULL_HASH:
+        raise Failure("History not fully claimed after chunks {}".format(chunks))
+    after = [rc.balanceOf(addr) for addr in accounts]
+
+    deltas = {}
+    for p, (b, a) in enumerate(zip(before, after)):
+        if a != b:
+            deltas[None if p == len(addrs) else p] = a - b
+    return game, sum(game.bonds), deltas
+
+def check(fixture, case):
+    # Raises Failure if the case breaks a property
+    result = play(fixture, case, case.chunks)
+    if result is None:
+        return
+    game, bonds, chunked = result
+    if sum(chunked.values()) != BOUNTY + bonds:
+        raise Failure("Paid out {}, but the bounty and bonds came to {}".format(sum(chunked.values()), BOUNTY + bonds))
+    _, _, whole = play(fixture, case, [len(game)])
+    if chunked != whole:
+        raise Failure("Claiming in chunks {} paid {}, but in one go paid {}".format(case.chunks, chunked, whole))
+    expected = dict((p, v) for p, v in payouts(game, BOUNTY).items() if v > 0)
+    if whole != expected:
+        raise Failure("Contract paid {}, model expected {}".format(whole, expected))
+
+def candidates(case):
+    # Smaller versions of the case, most aggressive first
+    n = len(case.steps)
+    size = n // 2 if n > 1 else n
+    while size >= 1:
+        for start in range(0, n, size):
+            yield Case(case.steps[:start] + case.steps[start + size:], case.chunks, case.seed)
+        size = size // 2
+    for i in range(len(case.chunks) - 1):
+        yield Case(case.steps, case.chunks[:i] + [case.chunks[i] + case.chunks[i + 1]] + case.chunks[i + 2:], case.seed)
+    for i, step in enumerate(case.steps):
+        if step[0] in ('answer', 'commit') and step[2] > 2:
+            yield Case(case.steps[:i] + [step[:2] + (2,) + step[3:]] + case.steps[i + 1:], case.chunks, case.seed)
+
+def shrink(case, fails):
+    # Greedily replaces the case with the first smaller one that still fails, until none does.
+    # fails(case) returns the Failure, or None if the case passes.
+    failure = fails(case)
+    progress = True
+    while progress:
+        progress = False
+        for smaller in candidates(case):
+            f = fails(smaller)
+            if f is not None:
+                case, failure = smaller, f
+                progress = True
+                break
+    return case, failure
+
+def failure_of(fixture, case):
+    try:
+        check(fixture, case)
+    except Failure as e:
+        return e
+    except Exception as e:
+        # A transaction that reverts where the model expected it to go through is a finding too
+        return Failure("{}: {}".format(type(e).__name__, e))
+    return None
+
+def run_case(seed):
+    # For a worker process. Returns None, or (shrunk case, message) as strings to cross the process boundary.
+    from harness import get_fixture
+    fixture = get_fixture()
+    case = generate(seed)
+    if failure_of(fixture, case) is None:
+        return None
+    case, failure = shrink(case, lambda c: failure_of(fixture, c))
+    return repr(case), str(failure)
+
+def fuzz(n, processes=None, seed=0, stream=sys.stderr):
+    # Runs n cases, seeds seed to seed+n-1. Returns a list of (seed, shrunk case, message) for each failure.
+    import solc_cache
+    from harness import CONTRACTS
+    for name in CONTRACTS:
+        solc_cache.compile_file(name + '.sol')
+
+    failures = []
+    pool = multiprocessing.Pool(processes)
+    try:
+        for i, res in enumerate(pool.imap(run_case, range(seed, seed + n), 4)):
+            if res is not None:
+                failures.append((seed + i,) + res)
+            stream.write('.' if res is None else 'F')
+            stream.flush()
+    finally:
+        pool.close()
+        pool.join()
+    stream.write("\n")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description='Fuzz answer histories and split claims against the contract')
+    parser.add_argument('-n', type=int, default=1000, help='number of cases (default: %(default)s)')
+    parser.add_argument('-j', type=int, default=multiprocessing.cpu_count(), help='processes (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='first seed (default: %(default)s)')
+    parser.add_argument('--case', type=int, metavar='SEED', help='run and shrink the case with this seed only')
+    args = parser.parse_args()
+
+    if args.case is not None:
+        res = run_case(args.case)
+        sys.stdout.write("passed\n" if res is None else "{}\n{}\n".format(*res))
+        sys.exit(0 if res is None else 1)
+
+    started = time.time()
+    failures = fuzz(args.n, args.j, args.seed)
+    elapsed = time.time() - started
+    for seed, case, message in failures:
+        sys.stdout.write("seed {}: {}\n  {}\n".format(seed, message, case))
+    sys.stdout.write("{} cases in {:.1f}s, {} failed\n".format(args.n, elapsed, len(failures)))
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
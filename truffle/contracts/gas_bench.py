@@ -0,0 +1,210 @@
+import argparse
+import json
+import os
+import sys
+
+from ethereum.tools import tester as t
+from ethereum.tools import keys
+
+from harness import ChainFixture, rich_alloc, measure_gas, advance_time
+from harness import to_answer_for_contract, calculate_commitment_hash
+from answer_history import AnswerHistory
+
+# Measures the gas used by each RealityCheck entry point, and compares it with a stored baseline.
+#   python gas_bench.py                  # compare with gas_baseline.json, exit 1 if anything got more than 1% dearer,
+#                                        # or 2 if there's no baseline to compare with
+#   python gas_bench.py --tolerance 5    # allow 5%
+#   python gas_bench.py --update         # write the current figures as the new baseline
+# Gas in the tester is deterministic, so any change in a figure comes from the contract or the compiler.
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gas_baseline.json')
+
+HISTORY_LENGTHS = [1, 2, 4, 8, 16, 32]
+BOND_SIZES = [1, 10**18]
+
+# Long enough that no question finalizes while we're still answering it
+TIMEOUT = 86400
+
+# The fixture's arbitrator charges 100 to ask a question
+BOUNTY = 1000
+
+# Answerers take turns, so both takeovers and repeat answers show up in the history
+ANSWERERS = [t.k3, t.k4, t.k5, t.k6]
+
+class GasBench(object):
+
+    def __init__(self):
+        self.fixture = ChainFixture(alloc=rich_alloc())
+        self.results = {}
+        self.nonce = 0
+
+    def record(self, name, gas):
+        self.results[name] = gas
+
+    def start(self):
+        self.fixture.revert()
+        self.c = self.fixture.c
+        self.rc0 = self.fixture.rc0
+        self.arb0 = self.fixture.arb0
+
+    def ask(self):
+        self.nonce = self.nonce + 1
+        qid, gas = measure_gas(self.c, self.rc0.askQuestion, 0, "gas bench question", self.arb0.address, TIMEOUT, 0, self.nonce, value=BOUNTY, startgas=200000)
+        return qid, gas
+
+    def answer(self, qid, hist, bond, answer, sender):
+        hist.add(keys.privtoaddr(sender), bond, to_answer_for_contract(answer))
+        _, gas = measure_gas(self.c, self.rc0.submitAnswer, qid, to_answer_for_contract(answer), 0, value=bond, sender=sender, startgas=200000)
+        return gas
+
+    def answer_many(self, qid, length, start_bond):
+        # Gives answers 1, 2, 1, 2... with each bond double the last, and returns the history and the gas of the last answer
+        hist = AnswerHistory()
+        gas = None
+        for i in range(length):
+            gas = self.answer(qid, hist, start_bond * 2**i, 1 + i % 2, ANSWERERS[i % len(ANSWERERS)])
+        return hist, gas
+
+    def claim_startgas(self, length):
+        return 100000 + length * 50000
+
+    def bench_ask(self):
+        self.start()
+        _, gas = self.ask()
+        self.record("askQuestion", gas)
+
+        self.start()
+        _, gas = measure_gas(self.c, self.rc0.createTemplateAndAskQuestion,
+            '{"title": "%s", "type": "bool", "category": "%s"}', "gas bench question", self.arb0.address, TIMEOUT, 0, 0,
+            value=BOUNTY, startgas=300000)
+        self.record("createTemplateAndAskQuestion", gas)
+
+    def bench_answer(self, length, bond):
+        self.start()
+        qid, _ = self.ask()
+        _, gas = self.answer_many(qid, length, bond)
+        self.record("submitAnswer[history={},bond={}]".format(length, bond), gas)
+
+    def bench_commit_reveal(self, length, bond):
+        self.start()
+        qid, _ = self.ask()
+        hist, _ = self.answer_many(qid, length-1, bond)
+
+        commit_bond = bond * 2**(length-1)
+        answer = to_answer_for_contract(1 + (length-1) % 2)
+        nonce = 1234
+        sender = ANSWERERS[(length-1) % len(ANSWERERS)]
+        answer_hash = calculate_commitment_hash(answer, nonce)
+        _, gas = measure_gas(self.c, self.rc0.submitAnswerCommitment, qid, answer_hash, 0, keys.privtoaddr(sender), value=commit_bond, sender=sender, startgas=200000)
+        self.record("submitAnswerCommitment[history={},bond={}]".format(length, bond), gas)
+
+        _, gas = measure_gas(self.c, self.rc0.submitAnswerReveal, qid, answer, nonce, commit_bond, sender=sender, startgas=200000)
+        self.record("submitAnswerReveal[history={},bond={}]".format(length, bond), gas)
+
+    def bench_arbitrator(self, length, bond):
+        self.start()
+        qid, _ = self.ask()
+        hist, _ = self.answer_many(qid, length, bond)
+        fee, _ = measure_gas(self.c, self.arb0.getDisputeFee, qid, startgas=100000)
+        _, gas = measure_gas(self.c, self.arb0.requestArbitration, self.rc0.address, qid, value=fee, sender=t.k7, startgas=200000)
+        self.record("requestArbitration[history={},bond={}]".format(length, bond), gas)
+        _, gas = measure_gas(self.c, self.arb0.submitAnswerByArbitrator, self.rc0.address, qid, to_answer_for_contract(1), keys.privtoaddr(t.k3), startgas=200000)
+        self.record("submitAnswerByArbitrator[history={},bond={}]".format(length, bond), gas)
+
+    def bench_claim(self, length, bond):
+        self.start()
+        qid, _ = self.ask()
+        hist, _ = self.answer_many(qid, length, bond)
+        advance_time(self.c, TIMEOUT + 1)
+        hashes, addrs, bonds, answers = hist.claim_args()
+        _, gas = measure_gas(self.c, self.rc0.claimWinnings, qid, hashes, addrs, bonds, answers, startgas=self.claim_startgas(length))
+        self.record("claimWinnings[history={},bond={}]".format(length, bond), gas)
+
+        # The last answerer always ends up with something to withdraw
+        winner = ANSWERERS[(length-1) % len(ANSWERERS)]
+        _, gas = measure_gas(self.c, self.rc0.withdraw, sender=winner, startgas=100000)
+        self.record("withdraw[history={},bond={}]".format(length, bond), gas)
+
+    def bench_claim_multiple(self, length, bond):
+        self.start()
+        qid, _ = self.ask()
+        hist, _ = self.answer_many(qid, length, bond)
+        advance_time(self.c, TIMEOUT + 1)
+        hashes, addrs, bonds, answers = hist.claim_args()
+        winner = ANSWERERS[(length-1) % len(ANSWERERS)]
+        _, gas = measure_gas(self.c, self.rc0.claimMultipleAndWithdrawBalance, [qid], [length], hashes, addrs, bonds, answers, sender=winner, startgas=self.claim_startgas(length))
+        self.record("claimMultipleAndWithdrawBalance[history={},bond={}]".format(length, bond), gas)
+
+    def run(self):
+        self.bench_ask()
+        for length in HISTORY_LENGTHS:
+            for bond in BOND_SIZES:
+                self.bench_answer(length, bond)
+                self.bench_commit_reveal(length, bond)
+                self.bench_arbitrator(length, bond)
+                self.bench_claim(length, bond)
+                self.bench_claim_multiple(length, bond)
+        return self.results
+
+def compare(results, baseline, tolerance):
+    # Returns a list of (name, baseline gas, current gas) for everything that went up by more than tolerance percent
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        if results[name] > baseline[name] * (1 + tolerance / 100.0):
+            regressions.append((name, baseline[name], results[name]))
+    return regressions
+
+def load_baseline(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+def write_baseline(filename, results):
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=4, sort_keys=True)
+        f.write("\n")
+
+def report(results, baseline, stream=sys.stdout):
+    for name in sorted(results):
+        if name in baseline:
+            diff = results[name] - baseline[name]
+            stream.write("{:<60} {:>9} {:>+9}\n".format(name, results[name], diff))
+        else:
+            stream.write("{:<60} {:>9} {:>9}\n".format(name, results[name], "new"))
+    for name in sorted(baseline):
+        if name not in results:
+            stream.write("{:<60} {:>9} {:>9}\n".format(name, "", "gone"))
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure gas for each RealityCheck entry point')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='baseline file (default: %(default)s)')
+    parser.add_argument('--tolerance', type=float, default=1.0, help='percentage increase allowed before failing (default: %(default)s)')
+    parser.add_argument('--update', action='store_true', help='write the results as the new baseline')
+    args = parser.parse_args()
+
+    results = GasBench().run()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        baseline = load_baseline(args.baseline)
+    report(results, baseline)
+
+    if args.update:
+        write_baseline(args.baseline, results)
+        return
+
+    if not baseline:
+        # Passing with nothing to compare against would let any regression through
+        sys.stdout.write("No baseline at {}, run with --update to make one\n".format(args.baseline))
+        sys.exit(2)
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        sys.stdout.write("\nGas went up by more than {}%:\n".format(args.tolerance))
+        for name, was, now in regressions:
+            sys.stdout.write("  {}: {} -> {}\n".format(name, was, now))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+import argparse
+import bisect
+import os
+import sys
+import unittest
+
+from rlp.utils import decode_hex, encode_hex
+from ethereum import vm
+from ethereum import slogging
+from ethereum.abi import ContractTranslator
+
+import solc_cache
+
+# Where the gas goes, by opcode and by source line, for anything run on the tester.
+#   profiler = GasProfiler(load_contracts(CONTRACTS))
+#   with profiler:
+#       rc0.submitAnswer(...)
+#   profiler.report(sys.stdout)                 # the dearest opcodes and lines
+#   profiler.write_folded('submitAnswer.folded')  # for flamegraph.pl or speedscope
+# Each line of the folded output is a call stack, as "RealityCheck.submitAnswer;RealityCheck.sol:263;SHA3 1316":
+# contract and function, then the source line and opcode in each frame, with the gas spent there.
+#
+# Any test in test.py can be profiled by setting GAS_PROFILE to a directory, which gets a .folded and a .txt per test:
+#   GAS_PROFILE=/tmp/gas python -m unittest test.TestRealityCheck.test_answer_question_gas
+#   python gas_profiler.py test.TestRealityCheck.test_answer_question_gas      # the same, with the report on stdout
+#
+# It uses the VM's own trace hook, which hands over the gas left before each instruction, so an instruction's cost is
+# the drop in gas to the next one, less whatever was spent in calls it made. Gas for memory expansion lands on the
+# instruction that expanded it, and gas for a call to an account with no code on the CALL.
+# The intrinsic gas of a transaction and the refunds for clearing storage happen outside the VM, so they're not in here.
+# Tracing makes the VM several times slower, so only turn it on when you want the figures.
+
+# Labels for code we have no source map for
+GENERATED = '<generated>'
+UNKNOWN = '<unknown>'
+
+class ContractMap(object):
+
+    # Finds the source line of each instruction in a contract's runtime code, from solc's source map
+
+    def __init__(self, name, abi, runtime, srcmap, source, segments):
+        self.name = name
+        self.runtime = runtime
+        self.functions = {}
+        translator = ContractTranslator(abi)
+        for fn, data in translator.function_data.items():
+            self.functions[data['prefix']] = fn
+        self.entries = parse_srcmap(srcmap)
+        self.instructions = instruction_indexes(runtime)
+        self.source = source.encode('utf8')
+        self.ascii = len(self.source) == len(source)
+        self.segment_starts = [seg[0] for seg in segments]
+        self.segments = segments
+        self.line_starts = {}
+        self.labels = {}
+
+    def function(self, selector):
+        return self.functions.get(selector, '<fallback>')
+
+    def line(self, pc):
+        label = self.labels.get(pc)
+        if label is None:
+            label = self._line(pc)
+            self.labels[pc] = label
+        return label
+
+    def _line(self, pc):
+        i = self.instructions.get(pc)
+        if i is None or i >= len(self.entries):
+            return UNKNOWN
+        start, length, file_index = self.entries[i]
+        if file_index < 0:
+            # Code solc made up, like the function dispatcher, rather than compiled from a line of ours
+            return GENERATED
+        # Source map offsets count bytes, our segments count characters
+        offset = start if self.ascii else len(self.source[:start].decode('utf8', 'ignore'))
+        seg = bisect.bisect_right(self.segment_starts, offset) - 1
+        if seg < 0:
+            return UNKNOWN
+        flat_start, path, file_start = self.segments[seg]
+        return '{}:{}'.format(os.path.basename(path), self._line_number(path, file_start + offset - flat_start))
+
+    def _line_number(self, path, offset):
+        starts = self.line_starts.get(path)
+        if starts is None:
+            with open(path) as f:
+                code = f.read()
+            starts = [0] + [i + 1 for i, ch in enumerate(code) if ch == '\n']
+            self.line_starts[path] = starts
+        return bisect.bisect_right(starts, offset)
+
+def parse_srcmap(srcmap):
+    # solc's compressed source map has an s:l:f:j entry per instruction, where a missing field repeats the one before.
+    # Returns (start, length, file index) for each instruction.
+    entries = []
+    start, length, file_index = 0, 0, -1
+    for item in srcmap.split(';'):
+        fields = item.split(':')
+        if len(fields) > 0 and fields[0] != '':
+            start = int(fields[0])
+        if len(fields) > 1 and fields[1] != '':
+            length = int(fields[1])
+        if len(fields) > 2 and fields[2] != '':
+            file_index = int(fields[2])
+        entries.append((start, length, file_index))
+    return entries
+
+def instruction_indexes(code):
+    # Maps the pc of each instruction to its place in the source map, skipping over the data of PUSH1 to PUSH32
+    indexes = {}
+    pc = 0
+    i = 0
+    while pc < len(code):
+        indexes[pc] = i
+        op = code[pc]
+        pc = pc + 1
+        if 0x60 <= op <= 0x7f:
+            pc = pc + op - 0x5f
+        i = i + 1
+    return indexes
+
+_contracts = {}
+
+def load_contract(name, optimize=True, cache_dir=None):
+    # Compiled as harness.ChainFixture does, so the runtime code matches what's deployed
+    key = (name, optimize)
+    contract = _contracts.get(key)
+    if contract is None:
+        segments = []
+        source = solc_cache.flatten_source(name + '.sol', segments=segments)
+        outputs = solc_cache.compile_outputs(source, optimize=optimize, cache_dir=cache_dir)
+        contract = ContractMap(name, outputs['abi'], decode_hex(outputs['bin-runtime']), outputs['srcmap-runtime'], source, segments)
+        _contracts[key] = contract
+    return contract
+
+def load_contracts(names, optimize=True, cache_dir=None):
+    return [load_contract(name, optimize, cache_dir) for name in names]
+
+class Frame(object):
+
+    def __init__(self, contract, label):
+        self.contract = contract
+        self.label = label
+        # Gas used by calls made since the last instruction, which isn't that instruction's own
+        self.child_gas = 0
+        self.pc = None
+        self.op = None
+        self.last_gas = None
+
+    def line(self, pc):
+        return self.contract.line(pc) if self.contract is not None else UNKNOWN
+
+class GasProfiler(object):
+
+    def __init__(self, contracts=()):
+        self.contracts = {}
+        for contract in contracts:
+            self.contracts[contract.runtime] = contract
+        self.frames = []
+        # op -> [count, gas], "file:line" -> [count, gas], folded stack -> gas
+        self.opcodes = {}
+        self.lines = {}
+        self.stacks = {}
+        self.calls = 0
+        self.total = 0
+        self._vm_execute = None
+        self._level = None
+        self._saved_trace = None
+
+    def start(self):
+        self._vm_execute = vm.vm_execute
+        vm.vm_execute = self._execute
+        # vm_execute only traces if the logger is at TRACE, and calls its trace() with the details of each instruction.
+        # Taking over trace() on the logger itself gets us those without formatting a log message for each one.
+        self._level = vm.log_vm_op.level
+        self._saved_trace = vm.log_vm_op.__dict__.get('trace')
+        vm.log_vm_op.setLevel(slogging.TRACE)
+        vm.log_vm_op.trace = self._trace
+
+    def stop(self):
+        vm.vm_execute = self._vm_execute
+        vm.log_vm_op.setLevel(self._level)
+        # Put back the profiler we started inside, if there was one
+        if self._saved_trace is not None:
+            vm.log_vm_op.trace = self._saved_trace
+        else:
+            del vm.log_vm_op.trace
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _label(self, msg, code):
+        contract = self.contracts.get(code)
+        if contract is not None:
+            return contract, '{}.{}'.format(contract.name, contract.function(msg.data.extract32(0) >> 224))
+        if msg.is_create:
+            return None, '<create>'
+        return None, '0x' + encode_hex(msg.to)
+
+    def _execute(self, ext, msg, code):
+        contract, label = self._label(msg, code)
+        frame = Frame(contract, label)
+        self.frames.append(frame)
+        try:
+            res, gas, data = self._vm_execute(ext, msg, code)
+            # The last instruction, whether it returned, stopped or failed, cost whatever it left off the gas remaining
+            if frame.op is not None:
+                self._charge(frame.op, frame.pc, frame.last_gas - gas - frame.child_gas)
+        finally:
+            self.frames.pop()
+        if self.frames:
+            self.frames[-1].child_gas = self.frames[-1].child_gas + msg.gas - gas
+        else:
+            self.calls = self.calls + 1
+        return res, gas, data
+
+    def _trace(self, event, op=None, pc=None, gas=None, **kwargs):
+        if not self.frames:
+            return
+        frame = self.frames[-1]
+        gas = int(gas)
+        if frame.op is not None:
+            self._charge(frame.op, frame.pc, frame.last_gas - gas - frame.child_gas)
+        frame.child_gas = 0
+        frame.op = op
+        frame.pc = int(pc)
+        frame.last_gas = gas
+
+    def _charge(self, op, pc, cost):
+        frame = self.frames[-1]
+        line = frame.line(pc)
+
+        stats = self.opcodes.setdefault(op, [0, 0])
+        stats[0] = stats[0] + 1
+        stats[1] = stats[1] + cost
+
+        stats = self.lines.setdefault(line, [0, 0])
+        stats[0] = stats[0] + 1
+        stats[1] = stats[1] + cost
+
+        # Callers are at the CALL that got us here
+        path = []
+        for caller in self.frames[:-1]:
+            path.append(caller.label)
+            path.append(caller.line(caller.pc))
+        path.extend([frame.label, line, op])
+        stack = ';'.join(path)
+        self.stacks[stack] = self.stacks.get(stack, 0) + cost
+        self.total = self.total + cost
+
+    def reset(self):
+        self.opcodes = {}
+        self.lines = {}
+        self.stacks = {}
+        self.calls = 0
+        self.total = 0
+
+    def write_folded(self, filename):
+        with open(filename, 'w') as f:
+            for stack in sorted(self.stacks):
+                f.write("{} {}\n".format(stack, self.stacks[stack]))
+
+    def report(self, stream, top=20):
+        stream.write("{} gas in {} calls\n".format(self.total, self.calls))
+        for title, table in (('opcode', self.opcodes), ('line', self.lines)):
+            stream.write("\n{:<28} {:>10} {:>8} {:>7}\n".format(title, 'gas', 'count', '%'))
+            rows = sorted(table.items(), key=lambda item: -item[1][1])
+            for name, (count, gas) in rows[:top]:
+                stream.write("{:<28} {:>10} {:>8} {:>6.1f}%\n".format(name, gas, count, 100.0 * gas / max(self.total, 1)))
+
+def main():
+    from harness import CONTRACTS, get_fixture
+
+    parser = argparse.ArgumentParser(description='Run tests from test.py under the gas profiler')
+    parser.add_argument('tests', nargs='+', help='test names, as for python -m unittest')
+    parser.add_argument('--top', type=int, default=20, help='rows per table (default: %(default)s)')
+    parser.add_argument('--folded', help='file to write the folded stacks to')
+    args = parser.parse_args()
+
+    suite = unittest.defaultTestLoader.loadTestsFromNames(args.tests)
+    profiler = GasProfiler(load_contracts(CONTRACTS))
+    # Deploy before we start, so the figures are only for the tests
+    get_fixture()
+    with profiler:
+        result = unittest.TextTestRunner(stream=sys.stderr).run(suite)
+    profiler.report(sys.stdout, args.top)
+    if args.folded:
+        profiler.write_folded(args.folded)
+    sys.exit(0 if result.wasSuccessful() else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+from rlp.utils import encode_hex, decode_hex
+from ethereum.tools import tester as t
+from ethereum.state import STATE_DEFAULTS
+from ethereum.block import Block
+from ethereum.common import mk_block_from_prevstate, calc_difficulty
+import rlp
+import copy
+from sha3 import keccak_256
+from web3 import Web3
+
+import evm_backends
+
+# Shared by test.py and the benchmarks: helpers for talking to the contract, and the chain fixture they all start from.
+
+QINDEX_CONTENT_HASH = 0
+QINDEX_ARBITRATOR = 1
+QINDEX_OPENING_TS = 2
+QINDEX_STEP_DELAY = 3
+QINDEX_FINALIZATION_TS = 4
+QINDEX_IS_PENDING_ARBITRATION = 5
+QINDEX_BOUNTY = 6
+QINDEX_BEST_ANSWER_ID = 7
+QINDEX_HISTORY_HASH = 8
+QINDEX_BOND = 9
+
+def calculate_commitment_hash(answer, nonce):
+    return decode_hex(keccak_256(answer + decode_hex(hex(nonce)[2:].zfill(64))).hexdigest())
+
+def calculate_commitment_id(question_id, answer_hash, bond):
+    return decode_hex(keccak_256(question_id + answer_hash + decode_hex(hex(bond)[2:].zfill(64))).hexdigest())
+
+def calculate_content_hash(template_id, question_str, opening_ts):
+    return Web3.soliditySha3(['uint256', 'uint32', 'string'], [template_id, opening_ts, question_str])
+
+def from_question_for_contract(txt):
+    return txt
+
+def to_answer_for_contract(txt):
+    # to_answer_for_contract(("my answer")),
+    return decode_hex(hex(txt)[2:].zfill(64))
+
+def from_answer_for_contract(txt):
+    return int(encode_hex(txt), 16)
+
+CONTRACTS = ['RealityCheck', 'Arbitrator', 'CallbackClient', 'ExplodingCallbackClient', 'CallerBacker']
+
+class ChainFixture(object):
+
+    # Compiles and deploys everything once, then takes a snapshot of the chain as it stands after askQuestion.
+    # Each test calls revert() to start again from that snapshot instead of building a new chain.
+    # It runs on an evm_backends backend, pyethereum unless another is named. An alloc needs the tester, so it always
+    # gets pyethereum. On pyethereum, c is the tester's chain, for the tools that work on it directly.
+
+    def __init__(self, alloc=None, backend=evm_backends.DEFAULT_BACKEND):
+
+        if alloc is not None:
+            self.chain = evm_backends.PyEthereumBackend(alloc)
+        else:
+            self.chain = evm_backends.get_backend(backend)
+        self.c = getattr(self.chain, 'c', None)
+
+        for name in CONTRACTS:
+            self.chain.compile(name)
+
+        self.caller_backer = self.deploy('CallerBacker', sender=t.k0)
+
+        self.arb0 = self.deploy('Arbitrator', sender=t.k0)
+        self.arb0.setDisputeFee(10000000000000000, sender=t.k0, startgas=200000)
+        self.chain.mine()
+        self.rc0 = self.deploy('RealityCheck', sender=t.k0)
+
+        self.chain.mine()
+
+        self.arb0.setQuestionFee(self.rc0.address, 100)
+
+        self.question_id = self.rc0.askQuestion(
+            0,
+            "my question",
+            self.arb0.address,
+            10,
+            0,
+            0,
+            value=1100
+        )
+
+        # Read by setUp to check the starting state.
+        # Calls are transactions in the tester, so they have to happen before the snapshot to leave it as it was.
+        self.question = self.rc0.questions(self.question_id)
+
+        self.take_snapshot()
+
+    def deploy(self, name, sender=t.k0):
+        return self.chain.deploy(name, sender)
+
+    def take_snapshot(self):
+        self.snapshot = self.chain.snapshot()
+
+    def revert(self):
+        self.chain.revert(self.snapshot)
+
+def snapshot_chain(c):
+    # The tester's own snapshot() can't go back past a mine(), and many tests mine.
+    # So we keep the head block, the pending block and a copy of the pending state, and put all three back.
+    c.head_state.commit()
+    head_state = c.head_state.ephemeral_clone()
+    head_state_vars = dict((k, copy.copy(getattr(c.head_state, k))) for k in STATE_DEFAULTS)
+    return c.chain.head_hash, rlp.encode(c.block), head_state, head_state_vars
+
+def revert_chain(c, snapshot):
+    head_hash, block_rlp, head_state, head_state_vars = snapshot
+    c.chain.head_hash = head_hash
+    c.chain.state = c.chain.mk_poststate_of_blockhash(head_hash)
+    c.block = rlp.decode(block_rlp, Block)
+    c.head_state = head_state.ephemeral_clone()
+    for k in STATE_DEFAULTS:
+        setattr(c.head_state, k, copy.copy(head_state_vars[k]))
+    c.last_tx = None
+    c.last_sender = None
+
+# backend name => ChainFixture
+_fixtures = {}
+
+def get_fixture(backend=evm_backends.DEFAULT_BACKEND):
+    # Built on first use, so a run where everything is skipped doesn't pay for deployment
+    if backend not in _fixtures:
+        _fixtures[backend] = ChainFixture(backend=backend)
+    return _fixtures[backend]
+
+def rich_alloc(balance=2**250):
+    # The tester's accounts only hold 1 ether, which runs out after about 60 doublings of a 1 wei bond.
+    alloc = dict((addr, dict(data)) for addr, data in t.base_alloc.items())
+    for addr in t.accounts:
+        alloc[addr] = {'balance': balance}
+    return alloc
+
+def make_room(c, startgas):
+    # A transaction whose startgas doesn't fit in what's left of the pending block raises BlockGasLimitReached,
+    # rather than TransactionFailed, so mine and start a new block first.
+    if c.head_state.gas_used + startgas > c.head_state.gas_limit:
+        c.mine()
+
+def measure_gas(c, fn, *args, **kwargs):
+    # Returns the result of the call and the gas it used, including the 21000 base cost of the transaction.
+    make_room(c, kwargs.get('startgas', t.STARTGAS))
+    gas_before = c.head_state.gas_used
+    result = fn(*args, **kwargs)
+    return result, c.head_state.gas_used - gas_before
+
+def open_block(c, timestamp):
+    # What tester.Chain.mine() does once it has mined, but with a timestamp of our choosing.
+    c.block = mk_block_from_prevstate(c.chain, timestamp=timestamp)
+    c.head_state = c.chain.state.ephemeral_clone()
+    c.cs.initialize(c.head_state, c.block)
+
+def advance_time(c, seconds):
+    # Setting head_state.timestamp with transactions pending breaks mine(), which replays the block at its header's timestamp.
+    # So mine what's pending and open the next block the requested time later.
+    c.mine()
+    open_block(c, c.chain.state.timestamp + seconds)
+
+class ChainClock(object):
+
+    # Moves the tester's clock and mines its blocks, so tests don't have to reach into head_state for either.
+    #   clock = ChainClock(c)
+    #   clock.advance(11)            # mines only if transactions are pending
+    #   result, gas = clock.measure(rc0.submitAnswer, question_id, answer, 0, value=1)
+    #   clock.state.get_balance(addr)   # head_state as it is now, even after a mine
+    # Transactions go into the open block until it's mined, however many there are, so a long escalation runs in a
+    # block or two instead of a block per answer. make_room() mines when the next one wouldn't fit.
+    # Gas is read from the receipts, which carry the block's running total, so measuring it never needs a mine.
+    #
+    # An empty open block is retimed where it stands, without mining. With transactions pending, the block is mined
+    # first: mine() replays a block at its header's timestamp, so all of a block's transactions have to run at one time.
+
+    def __init__(self, c):
+        self.c = c
+
+    @property
+    def state(self):
+        return self.c.head_state
+
+    @property
+    def now(self):
+        return self.c.head_state.timestamp
+
+    @property
+    def pending(self):
+        # Transactions in the open block
+        return len(self.c.block.transactions)
+
+    def set_time(self, timestamp):
+        # A block can't come before its parent, so the earliest this goes is a second after the last mined block
+        if self.pending:
+            self.mine()
+        parent = self.c.chain.state.prev_headers[0]
+        timestamp = max(timestamp, parent.timestamp + 1)
+        header = self.c.block.header
+        header.timestamp = timestamp
+        header.difficulty = calc_difficulty(parent, timestamp, self.c.chain.config)
+        self.c.head_state.timestamp = timestamp
+        self.c.head_state.block_difficulty = header.difficulty
+
+    def advance(self, seconds):
+        self.set_time(self.now + seconds)
+
+    def mine(self):
+        # Mines the open block, and returns the gas of each transaction in it.
+        # The next block opens 14 seconds on, as it does from the tester's own mine().
+        gas = self.tx_gas()
+        # The chain holds back blocks from after its idea of the time, which is when it was created
+        self.c.chain.localtime = max(self.c.chain.localtime, self.c.block.header.timestamp)
+        self.c.mine()
+        return gas
+
+    def tx_gas(self):
+        # The gas of each transaction in the open block, in order
+        gas = []
+        total = 0
+        for receipt in self.c.head_state.receipts:
+            gas.append(receipt.gas_used - total)
+            total = receipt.gas_used
+        return gas
+
+    def last_gas(self):
+        # The gas of the last transaction, or None if the open block has none
+        receipts = self.c.head_state.receipts
+        if not receipts:
+            return None
+        return receipts[-1].gas_used - (receipts[-2].gas_used if len(receipts) > 1 else 0)
+
+    def measure(self, fn, *args, **kwargs):
+        # As measure_gas(), from the receipt of the transaction fn sends
+        make_room(self.c, kwargs.get('startgas', t.STARTGAS))
+        result = fn(*args, **kwargs)
+        return result, self.last_gas()
+
+def pending_events(c, contract):
+    # Decoded events logged by contract in the block that hasn't been mined yet, in the order they happened.
+    # Read from the receipts, so a transaction that reverted contributes nothing.
+    events = []
+    for receipt in c.head_state.receipts:
+        for log in receipt.logs:
+            if log.address != contract.address:
+                continue
+            ev = contract.translator.listen(log)
+            if ev is not None:
+                events.append(ev)
+    return events
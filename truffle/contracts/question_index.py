@@ -0,0 +1,248 @@
+import heapq
+import json
+import os
+
+from rlp.utils import encode_hex, decode_hex
+
+from finalization_scheduler import UNANSWERED, new_timing, update_timing, is_finalized
+
+# Keeps the question lists cron.js was building, updated from RealityCheck's events as each block comes in:
+#   latest_created     every question, by the time it was asked
+#   latest_active      questions not yet finalized, by the time of the last question, answer, reveal or bounty
+#   latest_completed   finalized questions, by finalization time
+#   highest_bounty     questions not yet finalized, by bounty
+# Nothing is scanned: each list is a heap, updated in place as events arrive, and questions move from the open
+# lists to latest_completed as block timestamps pass their finalize_ts, following the rules in finalization_scheduler.py.
+# save() writes the state and the last block seen to a checkpoint, and load() picks up from there after a restart.
+# rollback() undoes the last few blocks, for when a reorg replaces them (see event_stream.py).
+#
+# Events are dicts as the contract translator or web3 decodes them, with '_event_type' set.
+# LogNewQuestion doesn't log the bounty, so pass fetch_bounty to read it from the contract once per new question.
+# Without it a question's bounty stays at 0 until its first LogFundAnswerBounty.
+# Events for questions asked before the index started are ignored.
+
+# How many blocks back rollback() can go
+UNDO_BLOCKS = 128
+
+class TopList(object):
+
+    # Question IDs ranked by a value, highest first.
+    # Changing a value pushes a new heap entry and leaves the old one to be thrown away when it reaches the top.
+
+    def __init__(self):
+        self.heap = []
+        self.values = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def __contains__(self, question_id):
+        return question_id in self.values
+
+    def set(self, question_id, value):
+        if self.values.get(question_id) == value:
+            return
+        self.values[question_id] = value
+        heapq.heappush(self.heap, (-value, question_id))
+        if len(self.heap) > 2 * len(self.values) + 64:
+            self._compact()
+
+    def discard(self, question_id):
+        self.values.pop(question_id, None)
+
+    def _compact(self):
+        self.heap = [(-v, qid) for qid, v in self.values.items()]
+        heapq.heapify(self.heap)
+
+    def top(self, n):
+        # Returns up to n (question_id, value), highest first, with ties in question_id order
+        result = []
+        keep = []
+        while self.heap and len(result) < n:
+            entry = heapq.heappop(self.heap)
+            question_id = entry[1]
+            if self.values.get(question_id) != -entry[0] or (keep and keep[-1] == entry):
+                continue
+            keep.append(entry)
+            result.append((question_id, -entry[0]))
+        for entry in keep:
+            heapq.heappush(self.heap, entry)
+        return result
+
+def _event_type(ev):
+    t = ev['_event_type']
+    return t.decode('utf8') if isinstance(t, bytes) else t
+
+class QuestionIndex(object):
+
+    LISTS = ['latest_created', 'latest_active', 'latest_completed', 'highest_bounty']
+
+    def __init__(self, fetch_bounty=None):
+        self.fetch_bounty = fetch_bounty
+        self.questions = {}
+        self.block_number = None
+        self.timestamp = 0
+        self.latest_created = TopList()
+        self.latest_active = TopList()
+        self.latest_completed = TopList()
+        self.highest_bounty = TopList()
+        # (finalize_ts, question_id) for answered questions, earliest first. Stale entries are skipped when popped.
+        self.finalizing = []
+        # (block_number, previous block_number, previous timestamp, {question_id: copy from before the block, or None if new})
+        # for the last UNDO_BLOCKS blocks, so rollback() can undo them
+        self.undo = []
+        self._saved = None
+
+    def top(self, list_name, n=10):
+        if list_name not in self.LISTS:
+            raise KeyError("No such list: {}".format(list_name))
+        return getattr(self, list_name).top(n)
+
+    def is_finalized(self, question_id):
+        # As RealityCheck.isFinalized, at the timestamp of the last block processed
+        return is_finalized(self.questions[question_id], self.timestamp)
+
+    def process_block(self, block_number, timestamp, events):
+        # Returns False for a block already processed, so replaying from before a checkpoint is harmless
+        if self.block_number is not None and block_number <= self.block_number:
+            return False
+        self._saved = {}
+        self.undo.append((block_number, self.block_number, self.timestamp, self._saved))
+        if len(self.undo) > UNDO_BLOCKS:
+            del self.undo[0]
+        for ev in events:
+            self.process_event(ev, timestamp)
+        self.block_number = block_number
+        self.advance(timestamp)
+        return True
+
+    def process_event(self, ev, timestamp):
+        handler = getattr(self, '_on_' + _event_type(ev), None)
+        if handler is None:
+            return
+        question_id = ev['question_id']
+        if self._saved is not None and question_id not in self._saved:
+            q = self.questions.get(question_id)
+            self._saved[question_id] = dict(q) if q is not None else None
+        handler(ev, timestamp)
+
+    def advance(self, timestamp):
+        # Moves every question whose finalize_ts has passed over to latest_completed
+        self.timestamp = max(self.timestamp, timestamp)
+        while self.finalizing and self.finalizing[0][0] <= self.timestamp:
+            finalize_ts, question_id = heapq.heappop(self.finalizing)
+            q = self.questions[question_id]
+            if q['finalize_ts'] != finalize_ts or q['is_pending_arbitration'] or question_id in self.latest_completed:
+                continue
+            self.latest_active.discard(question_id)
+            self.highest_bounty.discard(question_id)
+            self.latest_completed.set(question_id, finalize_ts)
+
+    def _touch(self, q, question_id, timestamp):
+        q['last_activity'] = max(q['last_activity'], timestamp)
+        self.latest_active.set(question_id, q['last_activity'])
+
+    def _on_LogNewQuestion(self, ev, timestamp):
+        question_id = ev['question_id']
+        bounty = 0
+        if self.fetch_bounty is not None:
+            bounty = self.fetch_bounty(question_id)
+        q = new_timing(ev['timeout'])
+        q['created'] = ev['created']
+        q['bounty'] = bounty
+        q['last_activity'] = ev['created']
+        self.questions[question_id] = q
+        self.latest_created.set(question_id, q['created'])
+        self.latest_active.set(question_id, q['last_activity'])
+        self.highest_bounty.set(question_id, bounty)
+
+    def _on_LogFundAnswerBounty(self, ev, timestamp):
+        question_id = ev['question_id']
+        q = self.questions.get(question_id)
+        if q is None:
+            return
+        q['bounty'] = ev['bounty']
+        self.highest_bounty.set(question_id, q['bounty'])
+        self._touch(q, question_id, timestamp)
+
+    def _on_LogNewAnswer(self, ev, timestamp):
+        self._timing_event(ev, timestamp, 'LogNewAnswer', ev['ts'])
+
+    def _on_LogAnswerReveal(self, ev, timestamp):
+        self._timing_event(ev, timestamp, 'LogAnswerReveal', timestamp)
+
+    def _on_LogNotifyOfArbitrationRequest(self, ev, timestamp):
+        self._timing_event(ev, timestamp, 'LogNotifyOfArbitrationRequest', timestamp)
+
+    def _on_LogFinalize(self, ev, timestamp):
+        self._timing_event(ev, timestamp, 'LogFinalize', None)
+
+    def _timing_event(self, ev, timestamp, event_type, activity_ts):
+        question_id = ev['question_id']
+        q = self.questions.get(question_id)
+        if q is None:
+            return
+        if activity_ts is not None:
+            self._touch(q, question_id, activity_ts)
+        finalize_ts = update_timing(q, event_type, ev, timestamp)
+        if finalize_ts is not None:
+            heapq.heappush(self.finalizing, (finalize_ts, question_id))
+
+    def rollback(self, block_number):
+        # Undoes every block after block_number, for when they've been replaced by a reorg
+        while self.undo and self.undo[-1][0] > block_number:
+            _, prev_block_number, prev_timestamp, saved = self.undo.pop()
+            for question_id, q in saved.items():
+                if q is None:
+                    del self.questions[question_id]
+                else:
+                    self.questions[question_id] = q
+            self.block_number = prev_block_number
+            self.timestamp = prev_timestamp
+        if self.block_number is not None and self.block_number > block_number:
+            raise ValueError("Can't roll back to block {}, only the last {} blocks are kept".format(block_number, UNDO_BLOCKS))
+        self._rebuild()
+
+    def _rebuild(self):
+        # Puts every question back in the right lists, after a load or a rollback
+        self.latest_created = TopList()
+        self.latest_active = TopList()
+        self.latest_completed = TopList()
+        self.highest_bounty = TopList()
+        self.finalizing = []
+        for question_id, q in self.questions.items():
+            self.latest_created.set(question_id, q['created'])
+            if q['finalize_ts'] > UNANSWERED:
+                self.finalizing.append((q['finalize_ts'], question_id))
+            if self.is_finalized(question_id):
+                self.latest_completed.set(question_id, q['finalize_ts'])
+            else:
+                self.latest_active.set(question_id, q['last_activity'])
+                self.highest_bounty.set(question_id, q['bounty'])
+        heapq.heapify(self.finalizing)
+
+    def save(self, filename):
+        data = {
+            'block_number': self.block_number,
+            'timestamp': self.timestamp,
+            'questions': dict((encode_hex(qid), q) for qid, q in self.questions.items()),
+        }
+        # Write then rename, so a crash mid-write leaves the last checkpoint in place
+        tmp_file = '{}.{}.tmp'.format(filename, os.getpid())
+        with open(tmp_file, 'w') as f:
+            json.dump(data, f, sort_keys=True)
+        os.rename(tmp_file, filename)
+
+    @classmethod
+    def load(cls, filename, fetch_bounty=None):
+        # Rebuilds an index from a checkpoint. Carry on by passing it blocks from block_number + 1.
+        index = cls(fetch_bounty)
+        if not os.path.exists(filename):
+            return index
+        with open(filename) as f:
+            data = json.load(f)
+        index.block_number = data['block_number']
+        index.timestamp = data['timestamp']
+        index.questions = dict((decode_hex(qid_hex), q) for qid_hex, q in data['questions'].items())
+        index._rebuild()
+        return index
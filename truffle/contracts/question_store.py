@@ -0,0 +1,239 @@
+import json
+import mmap
+import os
+import sys
+
+from rlp.utils import decode_hex
+
+from harness import QINDEX_CONTENT_HASH, QINDEX_ARBITRATOR, QINDEX_OPENING_TS, QINDEX_STEP_DELAY, \
+    QINDEX_FINALIZATION_TS, QINDEX_IS_PENDING_ARBITRATION, QINDEX_BOUNTY, QINDEX_BEST_ANSWER_ID, \
+    QINDEX_HISTORY_HASH, QINDEX_BOND
+
+# Column-per-file store for the Question, Commitment and Claim structs in RealityCheck.sol, for indexes too big
+# to hold as a Python tuple per question.
+# Each column is a memory-mapped file of fixed-width cells, so a column can be sliced without copying:
+#   store = open_questions('/var/lib/rc/questions')
+#   store.put(question_id, bounty=1000, timeout=86400)
+#   store.column('finalize_ts')     # memoryview of uint32s, one per row
+#   store.column('bounty')          # memoryview of raw bytes, 32 per row, big-endian as the contract stores them
+# Rows are found by key through a dict, rebuilt from the key column when the store is opened.
+# uint32 and bool cells are in native byte order, so the files are only for the machine that wrote them.
+#
+# Growing the store remaps the columns. A view from column() doesn't grow with it, so take a new one after adding rows.
+
+# type => (width, memoryview format)
+COLUMN_TYPES = {
+    'bytes32': (32, None),
+    'address': (20, None),
+    'uint256': (32, None),
+    'uint32': (4, 'I'),
+    'bool': (1, 'B'),
+}
+
+QUESTION_COLUMNS = [
+    ('question_id', 'bytes32'),
+    ('content_hash', 'bytes32'),
+    ('arbitrator', 'address'),
+    ('opening_ts', 'uint32'),
+    ('timeout', 'uint32'),
+    ('finalize_ts', 'uint32'),
+    ('is_pending_arbitration', 'bool'),
+    ('bounty', 'uint256'),
+    ('best_answer', 'bytes32'),
+    ('history_hash', 'bytes32'),
+    ('bond', 'uint256'),
+]
+
+COMMITMENT_COLUMNS = [
+    ('commitment_id', 'bytes32'),
+    ('reveal_ts', 'uint32'),
+    ('is_revealed', 'bool'),
+    ('revealed_answer', 'bytes32'),
+]
+
+CLAIM_COLUMNS = [
+    ('question_id', 'bytes32'),
+    ('payee', 'address'),
+    ('last_bond', 'uint256'),
+    ('queued_funds', 'uint256'),
+]
+
+# Where each field comes in the tuple the questions() getter returns
+QUESTION_TUPLE_FIELDS = [
+    ('content_hash', QINDEX_CONTENT_HASH),
+    ('arbitrator', QINDEX_ARBITRATOR),
+    ('opening_ts', QINDEX_OPENING_TS),
+    ('timeout', QINDEX_STEP_DELAY),
+    ('finalize_ts', QINDEX_FINALIZATION_TS),
+    ('is_pending_arbitration', QINDEX_IS_PENDING_ARBITRATION),
+    ('bounty', QINDEX_BOUNTY),
+    ('best_answer', QINDEX_BEST_ANSWER_ID),
+    ('history_hash', QINDEX_HISTORY_HASH),
+    ('bond', QINDEX_BOND),
+]
+
+INITIAL_CAPACITY = 1024
+
+def _encode(col_type, value):
+    width = COLUMN_TYPES[col_type][0]
+    if col_type == 'uint256':
+        return int(value).to_bytes(width, 'big')
+    if col_type in ('uint32', 'bool'):
+        return int(value).to_bytes(width, sys.byteorder)
+    if col_type == 'address' and not isinstance(value, bytes):
+        # The tester's translator gives addresses as 0x-prefixed hex
+        value = decode_hex(value[2:] if value.startswith('0x') else value)
+    if len(value) != width:
+        raise ValueError("Expected {} bytes for a {}, got {}".format(width, col_type, len(value)))
+    return value
+
+def _decode(col_type, data):
+    if col_type == 'uint256':
+        return int.from_bytes(data, 'big')
+    if col_type == 'uint32':
+        return int.from_bytes(data, sys.byteorder)
+    if col_type == 'bool':
+        return data != b'\x00'
+    return bytes(data)
+
+class ColumnStore(object):
+
+    def __init__(self, path, columns, capacity=INITIAL_CAPACITY):
+        # The first column is the key
+        self.path = path
+        self.columns = columns
+        self.types = dict(columns)
+        self.key = columns[0][0]
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        self.meta_file = os.path.join(path, 'meta.json')
+        self.count = 0
+        self.capacity = capacity
+        if os.path.exists(self.meta_file):
+            with open(self.meta_file) as f:
+                meta = json.load(f)
+            if meta['columns'] != [list(c) for c in columns]:
+                raise ValueError("{} holds different columns: {}".format(path, meta['columns']))
+            self.count = meta['count']
+            self.capacity = meta['capacity']
+
+        self.files = {}
+        self.maps = {}
+        for name, col_type in columns:
+            self.files[name] = open(os.path.join(path, name + '.col'), 'a+b')
+            self.maps[name] = self._map(name, self.capacity)
+
+        self.rows = {}
+        keys = self.maps[self.key]
+        width = self._width(self.key)
+        for row in range(self.count):
+            self.rows[keys[row*width:(row+1)*width]] = row
+
+    def _width(self, name):
+        return COLUMN_TYPES[self.types[name]][0]
+
+    def _map(self, name, capacity):
+        f = self.files[name]
+        size = capacity * self._width(name)
+        f.seek(0, os.SEEK_END)
+        if f.tell() < size:
+            f.truncate(size)
+        return mmap.mmap(f.fileno(), size)
+
+    def _grow(self, capacity):
+        # Maps every column at the new size before letting go of the old maps, so if mapping fails the store is as it was.
+        maps = {}
+        try:
+            for name, _ in self.columns:
+                maps[name] = self._map(name, capacity)
+        except Exception:
+            for m in maps.values():
+                m.close()
+            raise
+        old_maps = self.maps
+        self.maps = maps
+        self.capacity = capacity
+        for m in old_maps.values():
+            try:
+                m.close()
+            except BufferError:
+                # A view from column() still holds it. The map goes when the view does, and as both maps share the file,
+                # the view still reads the rows it covers.
+                pass
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def row(self, key):
+        return self.rows[key]
+
+    def put(self, key, **values):
+        # Inserts or updates the row for key, setting the columns given. Columns not given are left as they were, or zero.
+        row = self.rows.get(key)
+        if row is None:
+            values[self.key] = key
+        # Encode everything before taking a row, so a bad value doesn't leave an empty row behind
+        cells = [(name, _encode(self.types[name], value)) for name, value in values.items()]
+        if row is None:
+            if self.count == self.capacity:
+                self._grow(self.capacity * 2)
+            row = self.count
+            self.count = self.count + 1
+            self.rows[key] = row
+        for name, cell in cells:
+            width = self._width(name)
+            self.maps[name][row*width:(row+1)*width] = cell
+        return row
+
+    def get(self, key, name):
+        row = self.rows[key]
+        width = self._width(name)
+        return _decode(self.types[name], self.maps[name][row*width:(row+1)*width])
+
+    def get_row(self, key):
+        return dict((name, self.get(key, name)) for name, _ in self.columns)
+
+    def column(self, name):
+        # A view over the filled part of the column, without copying.
+        # uint32 and bool columns come back as one item per row; the rest as raw bytes, a fixed width per row.
+        width, fmt = COLUMN_TYPES[self.types[name]]
+        view = memoryview(self.maps[name])[:self.count * width]
+        if fmt is not None:
+            view = view.cast(fmt)
+        return view
+
+    def flush(self):
+        for name, _ in self.columns:
+            self.maps[name].flush()
+        tmp_file = '{}.{}.tmp'.format(self.meta_file, os.getpid())
+        with open(tmp_file, 'w') as f:
+            json.dump({'columns': self.columns, 'count': self.count, 'capacity': self.capacity}, f)
+        os.rename(tmp_file, self.meta_file)
+
+    def close(self):
+        self.flush()
+        for name, _ in self.columns:
+            self.maps[name].close()
+            self.files[name].close()
+
+class QuestionStore(ColumnStore):
+
+    def __init__(self, path, capacity=INITIAL_CAPACITY):
+        ColumnStore.__init__(self, path, QUESTION_COLUMNS, capacity)
+
+    def put_question(self, question_id, question):
+        # Stores the tuple rc.questions(question_id) returns
+        return self.put(question_id, **dict((name, question[i]) for name, i in QUESTION_TUPLE_FIELDS))
+
+def open_questions(path):
+    return QuestionStore(path)
+
+def open_commitments(path):
+    return ColumnStore(path, COMMITMENT_COLUMNS)
+
+def open_claims(path):
+    return ColumnStore(path, CLAIM_COLUMNS)
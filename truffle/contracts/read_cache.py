@@ -0,0 +1,150 @@
+from collections import OrderedDict
+
+from harness import QINDEX_CONTENT_HASH, QINDEX_ARBITRATOR, QINDEX_OPENING_TS, QINDEX_STEP_DELAY, \
+    QINDEX_FINALIZATION_TS, QINDEX_IS_PENDING_ARBITRATION, QINDEX_BOUNTY, QINDEX_BEST_ANSWER_ID, \
+    QINDEX_HISTORY_HASH, QINDEX_BOND
+
+# Read-through cache in front of the questions() and templates() getters, for services that read the same questions over and over.
+#   cache = ReadCache(rc.questions, rc.templates)
+#   cache.question(question_id)                   # the same list rc.questions(question_id) returns
+#   cache.get(question_id, 'bounty')
+#   ingest(stream.poll(), cache)                  # keeps it up to date from event_stream.py
+#
+# Fields that never change once a question is asked, and the block number of each template, are kept for good.
+# best_answer is kept for good too once the question is finalized by the time of the last block seen.
+# The rest (finalize_ts, is_pending_arbitration, bounty, best_answer, history_hash, bond) are kept for up to `capacity`
+# questions, least recently used first out, and dropped when a block brings an event for the question.
+# rollback() drops them all, since they may have been read from blocks a reorg replaced, and winds back the time.
+#
+# The mutable fields are as fresh as the last block the cache was given, so feed it blocks as soon as the stream has them.
+
+IMMUTABLE_FIELDS = [
+    ('content_hash', QINDEX_CONTENT_HASH),
+    ('arbitrator', QINDEX_ARBITRATOR),
+    ('opening_ts', QINDEX_OPENING_TS),
+    ('timeout', QINDEX_STEP_DELAY),
+]
+
+MUTABLE_FIELDS = [
+    ('finalize_ts', QINDEX_FINALIZATION_TS),
+    ('is_pending_arbitration', QINDEX_IS_PENDING_ARBITRATION),
+    ('bounty', QINDEX_BOUNTY),
+    ('best_answer', QINDEX_BEST_ANSWER_ID),
+    ('history_hash', QINDEX_HISTORY_HASH),
+    ('bond', QINDEX_BOND),
+]
+
+FIELD_INDEX = dict(IMMUTABLE_FIELDS + MUTABLE_FIELDS)
+
+NULL_HASH = b'\x00' * 32
+
+DEFAULT_CAPACITY = 10000
+
+class ReadCache(object):
+
+    def __init__(self, fetch_question, fetch_template=None, capacity=DEFAULT_CAPACITY):
+        self.fetch_question = fetch_question
+        self.fetch_template = fetch_template
+        self.capacity = capacity
+        # question_id => tuple of the IMMUTABLE_FIELDS
+        self.immutable = {}
+        # question_id => best_answer, for finalized questions
+        self.final_answers = {}
+        # question_id => tuple of the MUTABLE_FIELDS, least recently used first
+        self.mutable = OrderedDict()
+        # template_id => block number
+        self.templates = {}
+        self.block_number = None
+        self.timestamp = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'immutable': len(self.immutable),
+            'mutable': len(self.mutable),
+            'templates': len(self.templates),
+        }
+
+    def _load(self, question_id):
+        self.misses = self.misses + 1
+        q = self.fetch_question(question_id)
+        # An unknown question comes back all zeroes, and may yet be asked, so don't keep anything for it
+        if q[QINDEX_CONTENT_HASH] == NULL_HASH:
+            return q
+        self.immutable[question_id] = tuple(q[i] for _, i in IMMUTABLE_FIELDS)
+        self.mutable[question_id] = tuple(q[i] for _, i in MUTABLE_FIELDS)
+        self.mutable.move_to_end(question_id)
+        while len(self.mutable) > self.capacity:
+            self.mutable.popitem(last=False)
+        return q
+
+    def _check_final(self, question_id, fields):
+        # As isFinalized, at the last block seen. Once final, the answer can't change.
+        finalize_ts, is_pending_arbitration, _, best_answer = fields[:4]
+        if not is_pending_arbitration and 0 < finalize_ts <= self.timestamp:
+            self.final_answers[question_id] = best_answer
+
+    def question(self, question_id):
+        entry = self.mutable.get(question_id)
+        if entry is None:
+            return self._load(question_id)
+        self.hits = self.hits + 1
+        self.mutable.move_to_end(question_id)
+        return list(self.immutable[question_id] + entry)
+
+    def get(self, question_id, field):
+        i = FIELD_INDEX[field]
+        if i < len(IMMUTABLE_FIELDS):
+            if question_id in self.immutable:
+                self.hits = self.hits + 1
+                return self.immutable[question_id][i]
+        elif field == 'best_answer':
+            if question_id in self.final_answers:
+                self.hits = self.hits + 1
+                return self.final_answers[question_id]
+            q = self.question(question_id)
+            if question_id in self.mutable:
+                self._check_final(question_id, self.mutable[question_id])
+            return q[i]
+        return self.question(question_id)[i]
+
+    def template(self, template_id):
+        # The block the template was created in
+        if template_id in self.templates:
+            self.hits = self.hits + 1
+            return self.templates[template_id]
+        self.misses = self.misses + 1
+        block_number = self.fetch_template(template_id)
+        # 0 means no such template yet
+        if block_number > 0:
+            self.templates[template_id] = block_number
+        return block_number
+
+    def invalidate(self, question_id):
+        if self.mutable.pop(question_id, None) is not None:
+            self.invalidations = self.invalidations + 1
+
+    def process_block(self, block_number, timestamp, events):
+        # For event_stream.ingest: drops what the block's events changed
+        for ev in events:
+            question_id = ev.get('question_id')
+            if question_id is not None:
+                self.invalidate(question_id)
+        self.block_number = block_number
+        self.timestamp = max(self.timestamp, timestamp)
+
+    def rollback(self, block_number, timestamp=0):
+        # Drops the mutable fields and finalized answers, which may not hold on the new chain.
+        # Immutable fields stay: a question ID is a hash of its content, arbitrator and timeout, so it can't come back different.
+        # The time goes back to that of the block rolled back to, or to 0 if it isn't given, as event_stream.ingest doesn't,
+        # so nothing is taken as final by the time of a replaced block. The next block sets it again.
+        self.invalidations = self.invalidations + len(self.mutable)
+        self.mutable = OrderedDict()
+        self.final_answers = {}
+        self.block_number = block_number
+        self.timestamp = timestamp
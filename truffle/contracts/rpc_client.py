@@ -0,0 +1,206 @@
+import asyncio
+import json
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+from rlp.utils import encode_hex, decode_hex
+
+# asyncio JSON-RPC client for contract reads, for dashboards and bots that read many questions at once.
+# Requests made while a batch is being gathered go out together as one JSON-RPC batch, over a small pool of
+# keep-alive HTTP connections, so N reads cost one round trip rather than N:
+#   client = RPCClient('http://localhost:8545')
+#   rc = ContractReader(client, rc_address, translator)
+#   questions = await asyncio.gather(*[rc.call('questions', qid) for qid in question_ids])
+# Pass block= a block number to read every question at the same block.
+#
+# We have no multicall contract deployed, so reads are batched at the JSON-RPC level, one eth_call per read.
+# chain_rpc_server.py serves the same calls from a t.Chain, for testing.
+
+DEFAULT_MAX_BATCH = 100
+
+# How long to wait for more requests before sending a batch, in seconds
+DEFAULT_BATCH_WAIT = 0.002
+
+class RPCError(Exception):
+
+    def __init__(self, message, code=None):
+        Exception.__init__(self, message)
+        self.code = code
+
+def _hex(data):
+    return '0x' + encode_hex(data)
+
+def _unhex(data):
+    return decode_hex(data[2:] if data.startswith('0x') else data)
+
+class ConnectionPool(object):
+
+    # Up to `size` keep-alive HTTP/1.1 connections to one host, each carrying one request at a time
+
+    def __init__(self, host, port, size=4, ssl=None):
+        self.host = host
+        self.port = port
+        self.ssl = ssl
+        self.idle = []
+        self.semaphore = asyncio.Semaphore(size)
+
+    async def post(self, path, body):
+        # Returns (status, response body)
+        async with self.semaphore:
+            reused = bool(self.idle)
+            conn = self.idle.pop() if reused else await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+            try:
+                status, keep_alive, data = await self._exchange(conn, path, body)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                conn[1].close()
+                if not reused:
+                    raise
+                # The server may have closed an idle connection, so try once more on a fresh one
+                conn = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+                status, keep_alive, data = await self._exchange(conn, path, body)
+            if keep_alive:
+                self.idle.append(conn)
+            else:
+                conn[1].close()
+            return status, data
+
+    async def _exchange(self, conn, path, body):
+        reader, writer = conn
+        head = "POST {} HTTP/1.1\r\nHost: {}:{}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n".format(
+            path, self.host, self.port, len(body))
+        writer.write(head.encode('ascii') + body)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed before a response")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            data = b''
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                data = data + await reader.readexactly(size)
+                await reader.readline()
+        else:
+            data = await reader.readexactly(int(headers.get('content-length', 0)))
+
+        keep_alive = headers.get('connection', '').lower() != 'close'
+        return status, keep_alive, data
+
+    def close(self):
+        for reader, writer in self.idle:
+            writer.close()
+        self.idle = []
+
+class RPCClient(object):
+
+    def __init__(self, url, pool_size=4, max_batch=DEFAULT_MAX_BATCH, batch_wait=DEFAULT_BATCH_WAIT):
+        parts = urlsplit(url)
+        ssl = parts.scheme == 'https' or None
+        self.path = parts.path or '/'
+        self.pool = ConnectionPool(parts.hostname, parts.port or (443 if ssl else 80), pool_size, ssl)
+        self.max_batch = max_batch
+        self.batch_wait = batch_wait
+        self.pending = []
+        self.flush_handle = None
+        self.next_id = 0
+        self.sending = set()
+        # Counts, for seeing how well reads are being coalesced
+        self.requests = 0
+        self.batches = 0
+
+    def request(self, method, params):
+        # Returns a future for the result. The request goes out with whatever else arrives within batch_wait.
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self.next_id = self.next_id + 1
+        self.pending.append(({'jsonrpc': '2.0', 'id': self.next_id, 'method': method, 'params': params}, future))
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.batch_wait, self.flush)
+        return future
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch = self.pending
+        self.pending = []
+        if batch:
+            task = asyncio.ensure_future(self._send(batch))
+            self.sending.add(task)
+            task.add_done_callback(self.sending.discard)
+
+    async def _send(self, batch):
+        self.requests = self.requests + len(batch)
+        self.batches = self.batches + 1
+        try:
+            status, data = await self.pool.post(self.path, json.dumps([req for req, _ in batch]).encode('utf8'))
+            if status != 200:
+                raise RPCError("HTTP status {}".format(status))
+            responses = json.loads(data.decode('utf8'))
+            if isinstance(responses, dict):
+                # Some servers answer a batch they can't handle with a single error
+                raise RPCError(responses.get('error', {}).get('message', 'Bad batch response'), responses.get('error', {}).get('code'))
+            by_id = dict((res.get('id'), res) for res in responses)
+            for req, future in batch:
+                res = by_id.get(req['id'])
+                if future.done():
+                    continue
+                if res is None:
+                    future.set_exception(RPCError("No response to request {}".format(req['id'])))
+                elif 'error' in res:
+                    future.set_exception(RPCError(res['error'].get('message'), res['error'].get('code')))
+                else:
+                    future.set_result(res['result'])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    async def eth_call(self, to, data, block='latest', sender=None):
+        tx = {'to': _hex(to), 'data': _hex(data)}
+        if sender is not None:
+            tx['from'] = _hex(sender)
+        if not isinstance(block, str):
+            block = hex(block)
+        return _unhex(await self.request('eth_call', [tx, block]))
+
+    async def block_number(self):
+        return int(await self.request('eth_blockNumber', []), 16)
+
+    async def close(self):
+        self.flush()
+        if self.sending:
+            await asyncio.wait(list(self.sending))
+        self.pool.close()
+
+class ContractReader(object):
+
+    # Read-only calls to a contract through an RPCClient, encoded and decoded with the contract's translator
+
+    def __init__(self, client, address, translator):
+        self.client = client
+        self.address = address
+        self.translator = translator
+
+    async def call(self, function_name, *args, **kwargs):
+        data = self.translator.encode(function_name, args)
+        result = await self.client.eth_call(self.address, data, kwargs.get('block', 'latest'), kwargs.get('sender'))
+        o = self.translator.decode(function_name, result)
+        return o[0] if len(o) == 1 else o
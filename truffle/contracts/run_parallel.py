@@ -0,0 +1,123 @@
+import argparse
+import multiprocessing
+import sys
+import time
+import unittest
+
+import solc_cache
+from harness import CONTRACTS
+
+# Runs the tests in test.py over a pool of processes.
+# Each worker builds its own chain fixture the first time it runs a test, then reverts to it for the rest,
+# so the deployment is paid once per worker rather than once per test.
+#   python run_parallel.py -j 8
+#   python run_parallel.py -j 4 TestRealityCheck.test_bonds TestRealityCheck.test_withdrawal
+# WORKING_ONLY is read from the environment by each worker on import, so it skips the same tests as test.py does.
+
+TEST_MODULE = 'test'
+
+def iter_tests(suite):
+    for item in suite:
+        if isinstance(item, unittest.TestSuite):
+            for t in iter_tests(item):
+                yield t
+        else:
+            yield item
+
+def collect_test_ids(names):
+    loader = unittest.defaultTestLoader
+    if names:
+        suite = loader.loadTestsFromNames(names, __import__(TEST_MODULE))
+    else:
+        suite = loader.loadTestsFromName(TEST_MODULE)
+    return [t.id() for t in iter_tests(suite)]
+
+def init_worker():
+    # Import in the worker so each process gets its own module-level fixture
+    __import__(TEST_MODULE)
+
+def run_test(test_id):
+    # Results have to cross a process boundary, so return strings rather than TestCase and traceback objects
+    suite = unittest.defaultTestLoader.loadTestsFromName(test_id)
+    result = unittest.TestResult()
+    started = time.time()
+    suite.run(result)
+    elapsed = time.time() - started
+    if result.errors:
+        return test_id, 'error', result.errors[0][1], elapsed
+    if result.failures:
+        return test_id, 'fail', result.failures[0][1], elapsed
+    if result.skipped:
+        return test_id, 'skip', result.skipped[0][1], elapsed
+    if result.unexpectedSuccesses:
+        return test_id, 'unexpected success', '', elapsed
+    if result.expectedFailures:
+        return test_id, 'expected failure', result.expectedFailures[0][1], elapsed
+    return test_id, 'ok', '', elapsed
+
+STATUS_CHARS = {
+    'ok': '.',
+    'fail': 'F',
+    'error': 'E',
+    'skip': 's',
+    'expected failure': 'x',
+    'unexpected success': 'u',
+}
+
+def run_parallel(test_ids, processes, stream=sys.stderr):
+
+    # Fill the compile cache before forking, so the workers don't all start solc on the same sources at once
+    for name in CONTRACTS:
+        solc_cache.compile_file(name + '.sol')
+
+    started = time.time()
+    pool = multiprocessing.Pool(processes, initializer=init_worker)
+    results = []
+    try:
+        # chunksize 1, since tests vary a lot in length and we'd rather not leave a worker idle at the end
+        for res in pool.imap_unordered(run_test, test_ids, 1):
+            stream.write(STATUS_CHARS[res[1]])
+            stream.flush()
+            results.append(res)
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - started
+
+    results.sort(key=lambda r: r[0])
+    stream.write("\n")
+    for test_id, status, detail, _ in results:
+        if status in ('fail', 'error'):
+            stream.write("=" * 70 + "\n")
+            stream.write("{}: {}\n".format(status.upper(), test_id))
+            stream.write("-" * 70 + "\n")
+            stream.write(detail + "\n")
+
+    counts = {}
+    for r in results:
+        counts[r[1]] = counts.get(r[1], 0) + 1
+
+    stream.write("-" * 70 + "\n")
+    stream.write("Ran {} tests in {:.3f}s on {} processes\n\n".format(len(results), elapsed, processes))
+
+    details = []
+    for status, label in (('fail', 'failures'), ('error', 'errors'), ('skip', 'skipped'), ('expected failure', 'expected failures'), ('unexpected success', 'unexpected successes')):
+        if counts.get(status):
+            details.append("{}={}".format(label, counts[status]))
+    ok = not counts.get('fail') and not counts.get('error') and not counts.get('unexpected success')
+    stream.write(("OK" if ok else "FAILED") + (" (" + ", ".join(details) + ")" if details else "") + "\n")
+
+    return ok, results
+
+def main():
+    parser = argparse.ArgumentParser(description='Run test.py over several processes')
+    parser.add_argument('-j', '--processes', type=int, default=multiprocessing.cpu_count(), help='number of worker processes (default: one per core)')
+    parser.add_argument('tests', nargs='*', help='tests to run, eg TestRealityCheck.test_bonds (default: all)')
+    args = parser.parse_args()
+
+    test_ids = collect_test_ids(args.tests)
+    ok, _ = run_parallel(test_ids, max(1, min(args.processes, len(test_ids))))
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
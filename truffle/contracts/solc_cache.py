@@ -0,0 +1,114 @@
+import hashlib
+import io
+import json
+import os
+import re
+
+from rlp.utils import decode_hex
+from ethereum.tools import _solidity
+
+# Compile results are stored here, one JSON file per flattened source + compiler version.
+# Set SOLC_CACHE_DIR to move it, or to an empty string to turn the cache off.
+SOLC_CACHE_DIR = os.environ.get('SOLC_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.solc_cache'))
+
+IMPORT_RE = re.compile(r'''^[ \t]*import[ \t]+['"]([^'"]+)['"][ \t]*;[ \t]*$''', re.MULTILINE)
+
+# What compile_outputs() asks solc for. The runtime code and its source map are for gas_profiler.py.
+OUTPUTS = ['abi', 'bin', 'bin-runtime', 'srcmap-runtime']
+
+_compiler_version = None
+
+def flatten_source(filename, included=None, segments=None):
+    # Inline the imports of a .sol file, and their imports in turn.
+    # Each file goes in once, at the first place it's imported, since solc won't accept a contract defined twice.
+    # Import paths are relative to the importing file, as they are for truffle.
+    # If segments is a list, (offset in the output, file path, offset in that file) is added to it for each run of text
+    # copied from one file, so a position in the flattened source can be traced back to the file it came from.
+    out = io.StringIO()
+    _flatten(filename, set() if included is None else included, out, segments)
+    return out.getvalue()
+
+def _flatten(filename, included, out, segments):
+    path = os.path.abspath(filename)
+    included.add(path)
+    with open(path) as f:
+        code = f.read()
+
+    def copy(start, end):
+        if end > start:
+            if segments is not None:
+                segments.append((out.tell(), path, start))
+            out.write(code[start:end])
+
+    pos = 0
+    for match in IMPORT_RE.finditer(code):
+        copy(pos, match.start())
+        dep = os.path.normpath(os.path.join(os.path.dirname(path), match.group(1)))
+        if dep not in included:
+            _flatten(dep, included, out, segments)
+        pos = match.end()
+    copy(pos, len(code))
+
+def compiler_version():
+    # solc --version is a subprocess call of its own, so only make it once
+    global _compiler_version
+    if _compiler_version is None:
+        _compiler_version = _solidity.compiler_version()
+        if isinstance(_compiler_version, bytes):
+            _compiler_version = _compiler_version.decode('utf8')
+    return _compiler_version
+
+def cache_key(code, optimize=True):
+    h = hashlib.sha256()
+    h.update(compiler_version().encode('utf8'))
+    h.update(b'\x01' if optimize else b'\x00')
+    h.update(code.encode('utf8'))
+    return h.hexdigest()
+
+def compile_outputs(code, optimize=True, cache_dir=None):
+    # Returns solc's output for the last contract in the code, as c.contract(code, language='solidity') would deploy:
+    # the abi, and bin, bin-runtime and srcmap-runtime as hex and text.
+    # Unchanged code with an unchanged compiler comes out of the cache without running solc.
+    if cache_dir is None:
+        cache_dir = SOLC_CACHE_DIR
+
+    cache_file = None
+    if cache_dir:
+        cache_file = os.path.join(cache_dir, cache_key(code, optimize) + '.json')
+        if os.path.exists(cache_file):
+            with open(cache_file) as f:
+                cached = json.load(f)
+            # Files from before we kept the runtime code and source map get compiled again
+            if all(k in cached for k in OUTPUTS):
+                return cached
+
+    # c.contract() runs solc twice, once for the abi and once for the bin.
+    # Ask for everything in one run, and take the last contract in the source like the tester does.
+    contract_name = _solidity.solidity_names(code)[-1][1]
+    result = _solidity.compile_code(code, optimize=optimize, combined=','.join(OUTPUTS))
+    contract_data = _solidity.solidity_get_contract_data(result, None, contract_name)
+    outputs = {
+        'abi': contract_data['abi'],
+        'bin': contract_data['bin_hex'],
+        'bin-runtime': contract_data['bin-runtime'],
+        'srcmap-runtime': contract_data['srcmap-runtime'],
+    }
+
+    if cache_file:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # Write then rename, so a parallel run never reads a half-written file
+        tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+        with open(tmp_file, 'w') as f:
+            json.dump(outputs, f)
+        os.rename(tmp_file, cache_file)
+
+    return outputs
+
+def compile_solidity(code, optimize=True, cache_dir=None):
+    # Returns (abi, bin) for the last contract in the code
+    outputs = compile_outputs(code, optimize=optimize, cache_dir=cache_dir)
+    return outputs['abi'], decode_hex(outputs['bin'])
+
+def compile_file(filename, optimize=True, cache_dir=None):
+    return compile_solidity(flatten_source(filename), optimize=optimize, cache_dir=cache_dir)
@@ -0,0 +1,176 @@
+import json
+import mmap
+import os
+import re
+
+from question_store import ColumnStore
+from content_hashes import WORD, content_hashes
+from event_stream import ingest
+
+# Keeps every template's content on disk, so questions can be rendered without fetching a LogNewTemplate log for each one.
+# The contract only stores the block a template was created in; the content is in the log. So:
+#   store = TemplateStore('/var/lib/rc/templates')
+#   store.sync(EventStream(source, rc_address, translator, ['LogNewTemplate'], start_block=deploy_block))
+#   store.render(template_id, question_text)      # the question JSON, as the dapp's populatedJSONForTemplate makes it
+#   store.verify_many([(template_id, opening_ts, question_text, content_hash), ...])     # hashed in one batch by content_hashes.py
+# Template content goes in one append-only file, memory-mapped for reading, with a ColumnStore index by template_id.
+# Each template is split around its placeholders once, the first time it's used, and kept that way.
+#
+# Rendering follows the dapp: the question text is split on QUESTION_DELIMITER, the parts fill the template's %s
+# placeholders in order, as sprintf-js would, and the result is parsed as JSON, falling back to a bool question titled
+# with the raw text if it isn't valid JSON.
+
+QUESTION_DELIMITER = u'\u241f'
+
+QUESTION_MAX_OUTCOMES = 128
+
+TEMPLATE_COLUMNS = [
+    ('template_id', 'bytes32'),
+    ('block_number', 'uint32'),
+    ('offset', 'uint32'),
+    ('length', 'uint32'),
+]
+
+PLACEHOLDER = re.compile('%(%|s)')
+
+def _key(template_id):
+    return template_id.to_bytes(32, 'big')
+
+def _text(s):
+    return s.decode('utf8') if isinstance(s, bytes) else s
+
+class CompiledTemplate(object):
+
+    def __init__(self, content):
+        # Literal text around each %s, with any %% already turned into %
+        self.pieces = ['']
+        pos = 0
+        for m in PLACEHOLDER.finditer(content):
+            self.pieces[-1] = self.pieces[-1] + content[pos:m.start()]
+            if m.group(1) == '%':
+                self.pieces[-1] = self.pieces[-1] + '%'
+            else:
+                self.pieces.append('')
+            pos = m.end()
+        self.pieces[-1] = self.pieces[-1] + content[pos:]
+
+    def interpolate(self, question_text):
+        args = question_text.split(QUESTION_DELIMITER)
+        out = [self.pieces[0]]
+        for i, piece in enumerate(self.pieces[1:]):
+            # sprintf-js renders a missing argument as "undefined"
+            out.append(args[i] if i < len(args) else 'undefined')
+            out.append(piece)
+        return ''.join(out)
+
+def parse_question_json(data):
+    # As parseQuestionJSON in the dapp
+    try:
+        question_json = json.loads(data)
+    except ValueError:
+        question_json = {'title': data, 'type': 'bool'}
+    if not isinstance(question_json, dict):
+        question_json = {'title': data, 'type': 'bool'}
+    if len(question_json.get('outcomes') or []) > QUESTION_MAX_OUTCOMES:
+        raise ValueError("Too many outcomes")
+    return question_json
+
+class TemplateStore(object):
+
+    def __init__(self, path):
+        self.index = ColumnStore(path, TEMPLATE_COLUMNS)
+        self.content_file = open(os.path.join(path, 'content.dat'), 'a+b')
+        self.content_file.seek(0, os.SEEK_END)
+        self.content_size = self.content_file.tell()
+        self.content_map = None
+        self.mapped_size = 0
+        self.compiled = {}
+        # The last block sync() has read, so the next sync carries on from there.
+        # After a restart, the block of the newest template we have.
+        self.block_number = None
+        if len(self.index):
+            self.block_number = max(self.index.column('block_number'))
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, template_id):
+        return _key(template_id) in self.index
+
+    def add(self, template_id, block_number, content):
+        # Templates never change, so adding one we already have does nothing
+        key = _key(template_id)
+        if key in self.index:
+            return
+        data = _text(content).encode('utf8')
+        self.content_file.seek(0, os.SEEK_END)
+        self.content_file.write(data)
+        self.index.put(key, block_number=block_number, offset=self.content_size, length=len(data))
+        self.content_size = self.content_size + len(data)
+
+    def block_number_of(self, template_id):
+        return self.index.get(_key(template_id), 'block_number')
+
+    def content(self, template_id):
+        key = _key(template_id)
+        offset = self.index.get(key, 'offset')
+        length = self.index.get(key, 'length')
+        if length == 0:
+            return ''
+        if offset + length > self.mapped_size:
+            # Written since we last mapped the file
+            self.content_file.flush()
+            if self.content_map is not None:
+                self.content_map.close()
+            self.content_map = mmap.mmap(self.content_file.fileno(), self.content_size, access=mmap.ACCESS_READ)
+            self.mapped_size = self.content_size
+        return self.content_map[offset:offset + length].decode('utf8')
+
+    def compiled_template(self, template_id):
+        template = self.compiled.get(template_id)
+        if template is None:
+            template = CompiledTemplate(self.content(template_id))
+            self.compiled[template_id] = template
+        return template
+
+    def process_block(self, block_number, timestamp, events):
+        # For event_stream.ingest
+        for ev in events:
+            if _text(ev['_event_type']) == 'LogNewTemplate':
+                self.add(ev['template_id'], block_number, ev['question_text'])
+        self.block_number = block_number
+
+    def sync(self, stream):
+        # Reads new templates from an event_stream.EventStream following LogNewTemplate.
+        # Templates are created once and never change, so there's nothing to roll back: give the stream enough confirmations.
+        if self.block_number is not None:
+            stream.next_block = max(stream.next_block, self.block_number + 1)
+        ingest(stream.poll(), self)
+        self.flush()
+
+    def interpolate(self, template_id, question_text):
+        return self.compiled_template(template_id).interpolate(_text(question_text))
+
+    def render(self, template_id, question_text):
+        return parse_question_json(self.interpolate(template_id, question_text))
+
+    def render_many(self, questions):
+        # questions is a list of (template_id, question_text). Returns the question JSON for each, in the same order.
+        return [self.render(template_id, question_text) for template_id, question_text in questions]
+
+    def verify_many(self, questions):
+        # questions is a list of (template_id, opening_ts, question_text, content_hash).
+        # Returns whether each content hash matches, and the template exists, as askQuestion would insist.
+        hashes = memoryview(content_hashes([q[0] for q in questions], [q[1] for q in questions], [q[2] for q in questions]))
+        return [q[0] in self and hashes[i*WORD:(i+1)*WORD] == q[3] for i, q in enumerate(questions)]
+
+    def flush(self):
+        self.content_file.flush()
+        self.index.flush()
+
+    def close(self):
+        self.flush()
+        if self.content_map is not None:
+            self.content_map.close()
+        self.content_file.close()
+        self.index.close()
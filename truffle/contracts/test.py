@@ -2,102 +2,77 @@ import unittest
 from unittest import TestCase, main
 from rlp.utils import encode_hex, decode_hex
 from ethereum.tools import tester as t
-from ethereum.tools.tester import TransactionFailed
 from ethereum.tools import keys
 import time
-from sha3 import keccak_256
+import datetime
 from hashlib import sha256
-from web3 import Web3
 
 import os
+import tempfile
+import asyncio
+
+import solc_cache
+from harness import QINDEX_CONTENT_HASH, QINDEX_ARBITRATOR, QINDEX_STEP_DELAY, \
+    QINDEX_FINALIZATION_TS, QINDEX_IS_PENDING_ARBITRATION, QINDEX_BOUNTY, QINDEX_BEST_ANSWER_ID, \
+    QINDEX_HISTORY_HASH
+from harness import calculate_commitment_hash, calculate_commitment_id, calculate_content_hash, \
+    to_answer_for_contract, from_answer_for_contract
+from harness import get_fixture, pending_events, CONTRACTS, ChainClock
+import answer_history
+import gas_bench
+import claim_bench
+import claim_planner
+import commitments
+import answer_codec
+import question_index
+import event_stream
+import question_store
+import finalization_scheduler
+import rpc_client
+import chain_rpc_server
+import read_cache
+import template_store
+import content_hashes
+import bond_sim
+import fuzz_claims
+import gas_profiler
+import arbitration_queue
+import callback_dispatcher
+import final_answer_checks
+import evm_backends
+from evm_backends import TransactionFailed
 
 # Command-line flag to skip tests we're not working on
 WORKING_ONLY = os.environ.get('WORKING_ONLY', False)
 
-QINDEX_CONTENT_HASH = 0
-QINDEX_ARBITRATOR = 1
-QINDEX_OPENING_TS = 2
-QINDEX_STEP_DELAY = 3
-QINDEX_FINALIZATION_TS = 4
-QINDEX_IS_PENDING_ARBITRATION = 5
-QINDEX_BOUNTY = 6
-QINDEX_BEST_ANSWER_ID = 7
-QINDEX_HISTORY_HASH = 8
-QINDEX_BOND = 9
+# Directory to write a gas profile of each test to, as described in gas_profiler.py
+GAS_PROFILE = os.environ.get('GAS_PROFILE', '')
 
-def calculate_commitment_hash(answer, nonce):
-    return decode_hex(keccak_256(answer + decode_hex(hex(nonce)[2:].zfill(64))).hexdigest())
+# The EVM to run TestRealityCheck on, as described in evm_backends.py
+EVM_BACKEND = os.environ.get('EVM_BACKEND', evm_backends.DEFAULT_BACKEND)
 
-def calculate_commitment_id(question_id, answer_hash, bond):
-    return decode_hex(keccak_256(question_id + answer_hash + decode_hex(hex(bond)[2:].zfill(64))).hexdigest())
-
-def calculate_content_hash(template_id, question_str, opening_ts):
-    return Web3.soliditySha3(['uint256', 'uint32', 'string'], [template_id, opening_ts, question_str])
-
-def from_question_for_contract(txt):
-    return txt
-
-def to_answer_for_contract(txt):
-    # to_answer_for_contract(("my answer")),
-    return decode_hex(hex(txt)[2:].zfill(64))
-
-def from_answer_for_contract(txt):
-    return int(encode_hex(txt), 16)
+# For tests that work on the tester's chain directly: its blocks, receipts, head_state, or the tools built on them
+pyethereum_only = unittest.skipIf(EVM_BACKEND != evm_backends.PyEthereumBackend.name, "Needs the pyethereum tester")
 
 class TestRealityCheck(TestCase):
 
     def setUp(self):
 
-        self.c = t.Chain()
-
-        realitycheck_code = open('RealityCheck.sol').read()
-        arb_code_raw = open('Arbitrator.sol').read()
-        owned_code_raw = open('Owned.sol').read()
-        client_code_raw = open('CallbackClient.sol').read()
-        exploding_client_code_raw = open('ExplodingCallbackClient.sol').read()
-        caller_backer_code_raw = open('CallerBacker.sol').read()
-
-        # Not sure what the right way is to get pyethereum to import the dependencies
-        # Pretty sure it's not this, but it does the job:
-        safemath = open('SafeMath.sol').read()
-        safemath32 = open('SafeMath32.sol').read()
-        balance_holder = open('BalanceHolder.sol').read()
-        realitycheck_code = realitycheck_code.replace("import './SafeMath.sol';", safemath);
-        realitycheck_code = realitycheck_code.replace("import './SafeMath32.sol';", safemath32);
-        realitycheck_code = realitycheck_code.replace("import './BalanceHolder.sol';", balance_holder);
-
-        self.rc_code = realitycheck_code
-        self.arb_code = arb_code_raw.replace("import './Owned.sol';", owned_code_raw);
-        self.client_code = client_code_raw
-        self.exploding_client_code = exploding_client_code_raw
-        self.caller_backer_code = caller_backer_code_raw
-
-        self.caller_backer = self.c.contract(self.caller_backer_code, language='solidity', sender=t.k0)
-
-        self.arb0 = self.c.contract(self.arb_code, language='solidity', sender=t.k0)
-        self.arb0.setDisputeFee(10000000000000000, sender=t.k0, startgas=200000)
-        self.c.mine()
-        self.rc0 = self.c.contract(self.rc_code, language='solidity', sender=t.k0)
+        self.fixture = get_fixture(EVM_BACKEND)
+        self.fixture.revert()
 
-        self.c.mine()
-        self.s = self.c.head_state
+        self.chain = self.fixture.chain
+        self.c = self.fixture.c
+        self.caller_backer = self.fixture.caller_backer
+        self.arb0 = self.fixture.arb0
+        self.rc0 = self.fixture.rc0
+        self.question_id = self.fixture.question_id
 
-        self.arb0.setQuestionFee(self.rc0.address, 100)
+        if self.c is not None:
+            self.s = self.c.head_state
+            self.clock = ChainClock(self.c)
 
-        self.question_id = self.rc0.askQuestion(
-            0,
-            "my question",
-            self.arb0.address,
-            10,
-            0,
-            0,
-            value=1100
-        )
-
-        ts = self.s.timestamp
-        self.s = self.c.head_state
-
-        question = self.rc0.questions(self.question_id)
+        question = self.fixture.question
         self.assertEqual(int(question[QINDEX_FINALIZATION_TS]), 0)
         self.assertEqual(decode_hex(question[QINDEX_ARBITRATOR][2:]), self.arb0.address)
 
@@ -105,6 +80,19 @@ class TestRealityCheck(TestCase):
         #self.assertEqual(question[QINDEX_CONTENT_HASH], to_question_for_contract(("my question")))
         self.assertEqual(question[QINDEX_BOUNTY], 1000)
 
+        if GAS_PROFILE and self.c is not None:
+            self.profiler = gas_profiler.GasProfiler(gas_profiler.load_contracts(CONTRACTS))
+            self.profiler.start()
+            self.addCleanup(self.save_gas_profile)
+
+    def save_gas_profile(self):
+        self.profiler.stop()
+        if not os.path.isdir(GAS_PROFILE):
+            os.makedirs(GAS_PROFILE)
+        self.profiler.write_folded(os.path.join(GAS_PROFILE, self.id() + '.folded'))
+        with open(os.path.join(GAS_PROFILE, self.id() + '.txt'), 'w') as f:
+            self.profiler.report(f)
+
     @unittest.skipIf(WORKING_ONLY, "Not under construction")
     def test_fund_increase(self):
 
@@ -120,7 +108,7 @@ class TestRealityCheck(TestCase):
         # Should not be final if too soon
         self.assertFalse(self.rc0.isFinalized(self.question_id, startgas=200000))
 
-        self.s.timestamp = self.s.timestamp + 11
+        self.chain.advance_time(11)
 
         # Should not be final if there is no answer
         self.assertFalse(self.rc0.isFinalized(self.question_id, startgas=200000))
@@ -130,12 +118,9 @@ class TestRealityCheck(TestCase):
     @unittest.skipIf(WORKING_ONLY, "Not under construction")
     def test_simple_response_finalization(self):
 
-        gas_used = self.s.gas_used # Find out how much we used as this will affect the balance
-
         self.rc0.submitAnswer(self.question_id, to_answer_for_contract(12345), 0, value=1) 
-        #self.assertEqual(gas_used - self.s.gas_used, 100000)
 
-        self.s.timestamp = self.s.timestamp + 11
+        self.chain.advance_time(11)
         self.assertTrue(self.rc0.isFinalized(self.question_id, startgas=200000))
 
         self.assertEqual(from_answer_for_contract(self.rc0.getFinalAnswer(self.question_id)), 12345)
@@ -165,7 +150,7 @@ class TestRealityCheck(TestCase):
                 startgas=100000
             )
 
-        self.s.timestamp = self.s.timestamp + 11
+        self.chain.advance_time(11)
 
         with self.assertRaises(TransactionFailed):
             self.rc0.getFinalAnswerIfMatches(
@@ -227,7 +212,7 @@ class TestRealityCheck(TestCase):
         self.rc0.submitAnswer(self.question_id, to_answer_for_contract(12345), 0, value=1) 
         ts1 = self.rc0.questions(self.question_id)[QINDEX_FINALIZATION_TS]
 
-        self.s.timestamp = self.s.timestamp + 8
+        self.chain.advance_time(8)
         self.rc0.submitAnswer(self.question_id, to_answer_for_contract(54321), value=10) 
         ts2 = self.rc0.questions(self.question_id)[QINDEX_FINALIZATION_TS]
 
@@ -240,7 +225,7 @@ class TestRealityCheck(TestCase):
 
         self.rc0.submitAnswer(self.question_id, to_answer_for_contract(54321), 0, value=10) 
 
-        self.s.timestamp = self.s.timestamp + 11
+        self.chain.advance_time(11)
 
         self.assertTrue(self.rc0.isFinalized(self.question_id))
         self.assertEqual(from_answer_for_contract(self.rc0.getFinalAnswer(self.question_id)), 54321)
@@ -269,8 +254,7 @@ class TestRealityCheck(TestCase):
         with self.assertRaises(TransactionFailed):
             self.rc0.notifyOfArbitrationRequest(self.question_id, keys.privtoaddr(t.k0), startgas=200000) 
 
-        self.c.mine()
-        self.s = self.c.head_state
+        self.chain.mine()
         self.arb0.submitAnswerByArbitrator(self.rc0.address, self.question_id, to_answer_for_contract(123456), keys.privtoaddr(t.k0), startgas=200000) 
 
         self.assertTrue(self.rc0.isFinalized(self.question_id))
@@ -341,7 +325,7 @@ class TestRealityCheck(TestCase):
         st = self.submitAnswerReturnUpdatedState( st, self.question_id, 1001, 8, 16, t.k3)
         st = self.submitAnswerReturnUpdatedState( st, self.question_id, 1001, 16, 32, t.k3)
         st = self.submitAnswerReturnUpdatedState( st, self.question_id, 1001, 32, 64, t.k3)
-        self.s.timestamp = self.s.timestamp + 11
+        self.chain.advance_time(11)
         self.rc0.claimWinnings(self.question_id, st['hash'], st['addr'], st['bond'], st['answer'], startgas=400000)
         self.assertEqual(self.rc0.balanceOf(keys.privtoaddr(t.k3)), 64+32+16+8+4+2+1000)
 
@@ -354,7 +338,7 @@ class TestRealityCheck(TestCase):
         st = self.submitAnswerReturnUpdatedState( st, self.question_id, 1004, 8, 16, t.k3)
         st = self.submitAnswerReturnUpdatedState( st, self.question_id, 1003, 16, 32, t.k3)
         st = self.submitAnswerReturnUpdatedState( st, self.question_id, 1001, 32, 64, t.k3)
-        self.s.timestamp = self.s.timestamp + 11
+        self.chain.advance_time(11)
         self.rc0.claimWinnings(self.question_id, st['hash'], st['addr'], st['bond'], st['answer'], startgas=400000)
         self.assertEqual(self.rc0.balanceOf(keys.privtoaddr(t.k3)), 64+32+16+8+4+2+1000)
 
@@ -422,7 +406,7 @@ class TestRealityCheck(TestCase):
         st = self.submitAnswerReturnUpdatedState( st, self.question_id, 1002, 4, 8, t.k4)
         st = self.submitAnswerReturnUpdatedState( st, self.question_id, 1001, 8, 16, t.k4)
 
-        self.s.timestamp = self.s.timestamp + 11
+        self.chain.advance_time(11)
         self.rc0.claimWinnings(self.question_id, st['hash'][:2], st['addr'][:2], st['bond'][:2], st['answer'][:2], startgas=400000)
         self.assertEqual(self.rc0.balanceOf(keys.privtoaddr(t.k4)), 16+1000)
         self.rc0.claimWinnings(self.question_id, st['hash'][2:], st['addr'][2:], st['bond'][2:], st['answer'][2:], startgas=400000)
@@ -438,7 +422,7 @@ class TestRealityCheck(TestCase):
         st = self.submitAnswerReturnUpdatedState( st, self.question_id, 1004,  8, 16, t.k5, True)
         st = self.submitAnswerReturnUpdatedState( st, self.question_id, 1002, 16, 32, t.k4, True)
     
-        self.s.timestamp = self.s.timestamp + 11
+        self.chain.advance_time(11)
         self.rc0.claimWinnings(self.question_id, st['hash'], st['addr'], st['bond'], st['answer'], startgas=600000)
         self.assertEqual(self.rc0.balanceOf(keys.privtoaddr(t.k6)), 32+16+8+4+2-1+1000)
         self.assertEqual(self.rc0.balanceOf(keys.privtoaddr(t.k3)), 1+1)
@@ -453,12 +437,513 @@ class TestRealityCheck(TestCase):
         st = self.submitAnswerReturnUpdatedState( st, self.question_id, 1004,  8, 16, t.k5, True)
         st = self.submitAnswerReturnUpdatedState( st, self.question_id, 1002, 16, 32, t.k4, True)
 
-        self.s.timestamp = self.s.timestamp + 11
+        self.chain.advance_time(11)
         self.rc0.claimWinnings(self.question_id, st['hash'][:2], st['addr'][:2], st['bond'][:2], st['answer'][:2], startgas=400000)
         self.rc0.claimWinnings(self.question_id, st['hash'][2:], st['addr'][2:], st['bond'][2:], st['answer'][2:], startgas=400000)
         self.assertEqual(self.rc0.balanceOf(keys.privtoaddr(t.k6)), 32+16+8+4+2-1+1000)
         self.assertEqual(self.rc0.balanceOf(keys.privtoaddr(t.k3)), 1+1)
 
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    def test_answer_history_matches_contract(self):
+        hist = answer_history.AnswerHistory()
+
+        hist.add(keys.privtoaddr(t.k3), 1, to_answer_for_contract(1001))
+        self.rc0.submitAnswer(self.question_id, to_answer_for_contract(1001), 0, value=1, sender=t.k3)
+
+        answer_hash = calculate_commitment_hash(to_answer_for_contract(1002), 1234)
+        commitment_id = calculate_commitment_id(self.question_id, answer_hash, 2)
+        hist.add(keys.privtoaddr(t.k4), 2, commitment_id, True)
+        self.rc0.submitAnswerCommitment(self.question_id, answer_hash, 0, keys.privtoaddr(t.k4), value=2, sender=t.k4)
+
+        self.assertEqual(self.rc0.questions(self.question_id)[QINDEX_HISTORY_HASH], hist.history_hash)
+
+        self.rc0.submitAnswerReveal(self.question_id, to_answer_for_contract(1002), 1234, 2, sender=t.k4, startgas=200000)
+        self.chain.advance_time(11)
+
+        hashes, addrs, bonds, answers = hist.claim_args(0, 1)
+        self.rc0.claimWinnings(self.question_id, hashes, addrs, bonds, answers, startgas=400000)
+        hashes, addrs, bonds, answers = hist.claim_args(1)
+        self.rc0.claimWinnings(self.question_id, hashes, addrs, bonds, answers, startgas=400000)
+        self.assertEqual(self.rc0.balanceOf(keys.privtoaddr(t.k4)), 2+1+1000)
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    @pyethereum_only
+    def test_rebuild_history_from_events(self):
+        st = None
+        st = self.submitAnswerReturnUpdatedState( st, self.question_id, 1002,  0,  1, t.k3, False)
+        st = self.submitAnswerReturnUpdatedState( st, self.question_id, 1001,  1,  2, t.k5, False)
+        st = self.submitAnswerReturnUpdatedState( st, self.question_id, 1003,  2,  4, t.k4, False)
+        st = self.submitAnswerReturnUpdatedState( st, self.question_id, 1002,  4,  8, t.k6, False)
+        st = self.submitAnswerReturnUpdatedState( st, self.question_id, 1004,  8, 16, t.k5, True)
+        st = self.submitAnswerReturnUpdatedState( st, self.question_id, 1002, 16, 32, t.k4, True)
+
+        hist = answer_history.rebuild_histories(pending_events(self.c, self.rc0))[self.question_id]
+        self.assertEqual(hist.claim_args(), (st['hash'], st['addr'], st['bond'], st['answer']))
+
+        self.s.timestamp = self.s.timestamp + 11
+
+        gas_budget = answer_history.CLAIM_BASE_GAS + 2 * answer_history.CLAIM_GAS_PER_ENTRY
+        chunks = answer_history.claim_chunks(hist, gas_budget)
+        self.assertEqual(len(chunks), 3)
+
+        self.rc0.claimWinnings(self.question_id, *chunks[0], startgas=gas_budget)
+        self.assertEqual(answer_history.claimed_entries(hist, self.rc0.questions(self.question_id)[QINDEX_HISTORY_HASH]), 2)
+
+        for chunk in chunks[1:]:
+            self.rc0.claimWinnings(self.question_id, *chunk, startgas=gas_budget)
+        self.assertEqual(self.rc0.balanceOf(keys.privtoaddr(t.k6)), 32+16+8+4+2-1+1000)
+        self.assertEqual(self.rc0.balanceOf(keys.privtoaddr(t.k3)), 1+1)
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    @pyethereum_only
+    def test_claim_planner(self):
+        question_ids = [self.question_id]
+        for nonce in [1, 2]:
+            question_ids.append(self.rc0.askQuestion(0, "my question", self.arb0.address, 10, 0, nonce, value=1100, startgas=200000))
+
+        for qid in question_ids:
+            for bond in [1, 2, 4]:
+                self.rc0.submitAnswer(qid, to_answer_for_contract(12345), 0, value=bond, sender=t.k3, startgas=200000)
+
+        histories = answer_history.rebuild_histories(pending_events(self.c, self.rc0))
+        self.assertEqual(sorted(histories.keys()), sorted(question_ids))
+
+        self.s.timestamp = self.s.timestamp + 11
+
+        # Room for two three-entry questions per transaction, so three questions take two
+        costs = claim_planner.ClaimCosts(60000, 30000, 35000)
+        gas_ceiling = costs.batch([3, 3])
+        batches = claim_planner.plan_claims(histories, gas_ceiling, costs)
+        self.assertEqual(len(batches), 2)
+        self.assertEqual(sorted(qid for b in batches for qid in b.question_ids), sorted(question_ids))
+
+        for b in batches:
+            self.assertTrue(b.gas <= gas_ceiling)
+            self.rc0.claimMultipleAndWithdrawBalance(*b.args(), sender=t.k5, startgas=b.gas)
+
+        for qid in question_ids:
+            self.assertEqual(self.rc0.questions(qid)[QINDEX_HISTORY_HASH], decode_hex("0"*64))
+        self.assertEqual(self.rc0.balanceOf(keys.privtoaddr(t.k3)), 3 * (1+2+4+1000))
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    @pyethereum_only
+    def test_question_index(self):
+        q1 = self.rc0.askQuestion(0, "my question", self.arb0.address, 10, 0, 1, value=1100, startgas=200000)
+        q2 = self.rc0.askQuestion(0, "my question", self.arb0.address, 10, 0, 2, value=2100, startgas=200000)
+        q3 = self.rc0.askQuestion(0, "my question", self.arb0.address, 10, 0, 3, value=600, startgas=200000)
+        self.rc0.fundAnswerBounty(q3, value=5000, startgas=200000)
+        self.rc0.submitAnswer(q1, to_answer_for_contract(12345), 0, value=1, sender=t.k3, startgas=200000)
+
+        index = question_index.QuestionIndex(fetch_bounty=lambda qid: self.rc0.questions(qid)[QINDEX_BOUNTY])
+        self.assertTrue(index.process_block(1, self.s.timestamp, pending_events(self.c, self.rc0)))
+        self.assertEqual(index.top('highest_bounty', 2), [(q3, 5500), (q2, 2000)])
+        self.assertEqual(len(index.top('latest_created')), 3)
+        self.assertEqual(index.top('latest_completed'), [])
+
+        self.s.timestamp = self.s.timestamp + 11
+        index.process_block(2, self.s.timestamp, [])
+        self.assertTrue(index.is_finalized(q1))
+        self.assertEqual([qid for qid, _ in index.top('latest_completed')], [q1])
+        self.assertNotIn(q1, [qid for qid, _ in index.top('latest_active')])
+        self.assertNotIn(q1, [qid for qid, _ in index.top('highest_bounty')])
+
+        checkpoint = os.path.join(tempfile.mkdtemp(), 'index.json')
+        index.save(checkpoint)
+        restored = question_index.QuestionIndex.load(checkpoint)
+        self.assertEqual(restored.block_number, 2)
+        self.assertFalse(restored.process_block(2, self.s.timestamp, []))
+        for list_name in question_index.QuestionIndex.LISTS:
+            self.assertEqual(restored.top(list_name), index.top(list_name))
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    @pyethereum_only
+    def test_event_stream_reorg(self):
+        # The fixture's askQuestion is in the pending block, so it's the first block the stream reads
+        start = self.c.chain.head.header.number + 1
+        source = event_stream.ChainLogSource(self.c, max_range=2)
+        stream = event_stream.EventStream(source, self.rc0.address, self.rc0.translator, start_block=start, page_size=4)
+        index = question_index.QuestionIndex()
+
+        self.c.mine()
+        self.rc0.submitAnswer(self.question_id, to_answer_for_contract(12345), 0, value=1, sender=t.k3, startgas=200000)
+        self.c.mine()
+        self.c.mine()
+
+        items = list(stream.poll())
+        event_stream.ingest(items, index)
+        self.assertEqual(items[-1].number, start + 2)
+        events = [ev['_event_type'] for item in items for ev in item.events]
+        self.assertEqual(events, [b'LogNewQuestion', b'LogNewAnswer'])
+        self.assertEqual(index.questions[self.question_id]['bond'], 1)
+
+        # Go back to the fixture and build a different chain on it, as a reorg would
+        self.fixture.revert()
+        self.rc0.submitAnswer(self.question_id, to_answer_for_contract(54321), 0, value=3, sender=t.k4, startgas=200000)
+        self.c.mine()
+        self.c.mine()
+        self.c.mine()
+
+        items = list(stream.poll())
+        self.assertTrue(isinstance(items[0], event_stream.Rollback))
+        self.assertEqual(items[0].block_number, start - 1)
+        event_stream.ingest(items, index)
+        q = index.questions[self.question_id]
+        self.assertEqual(q['bond'], 3)
+        self.assertEqual(q['finalize_ts'], self.rc0.questions(self.question_id)[QINDEX_FINALIZATION_TS])
+        self.assertEqual(index.block_number, start + 2)
+
+        self.assertEqual(list(event_stream.prefetch(iter(items), 1)), items)
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    def test_question_store(self):
+        self.rc0.submitAnswer(self.question_id, to_answer_for_contract(12345), 0, value=1, sender=t.k3, startgas=200000)
+        question = self.rc0.questions(self.question_id)
+
+        path = tempfile.mkdtemp()
+        store = question_store.open_questions(path)
+        store.put_question(self.question_id, question)
+        # Enough rows to make the columns grow past their initial capacity
+        for i in range(question_store.INITIAL_CAPACITY + 1):
+            store.put(decode_hex(hex(i)[2:].zfill(64)), finalize_ts=i, bounty=i * 10**18)
+        store.close()
+
+        store = question_store.open_questions(path)
+        self.assertEqual(len(store), question_store.INITIAL_CAPACITY + 2)
+        row = store.get_row(self.question_id)
+        self.assertEqual(row['content_hash'], question[QINDEX_CONTENT_HASH])
+        self.assertEqual(row['arbitrator'], self.arb0.address)
+        self.assertEqual(row['timeout'], question[QINDEX_STEP_DELAY])
+        self.assertEqual(row['finalize_ts'], question[QINDEX_FINALIZATION_TS])
+        self.assertEqual(row['bounty'], question[QINDEX_BOUNTY])
+        self.assertEqual(row['best_answer'], question[QINDEX_BEST_ANSWER_ID])
+        self.assertEqual(row['history_hash'], question[QINDEX_HISTORY_HASH])
+        self.assertEqual(row['bond'], 1)
+        self.assertFalse(row['is_pending_arbitration'])
+
+        finalize_ts = store.column('finalize_ts')
+        self.assertEqual(finalize_ts[1:4].tolist(), [0, 1, 2])
+        bounty = store.column('bounty')
+        self.assertEqual(int.from_bytes(bounty[32*3:32*4], 'big'), 2 * 10**18)
+        finalize_ts.release()
+        bounty.release()
+        store.close()
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    @pyethereum_only
+    def test_finalization_scheduler(self):
+        q2 = self.rc0.askQuestion(0, "my question", self.arb0.address, 10, 0, 1, value=1100, startgas=200000)
+        self.rc0.submitAnswer(self.question_id, to_answer_for_contract(12345), 0, value=1, sender=t.k3, startgas=200000)
+        self.rc0.submitAnswer(q2, to_answer_for_contract(12345), 0, value=1, sender=t.k3, startgas=200000)
+        fee = self.arb0.getDisputeFee(q2)
+        self.arb0.requestArbitration(self.rc0.address, q2, value=fee, sender=t.k4, startgas=200000)
+
+        scheduler = finalization_scheduler.FinalizationScheduler()
+        events = pending_events(self.c, self.rc0)
+        scheduler.process_block(0, self.s.timestamp, events)
+
+        self.assertEqual(scheduler.next_due(), self.rc0.questions(self.question_id)[QINDEX_FINALIZATION_TS])
+        self.assertEqual(scheduler.due(self.s.timestamp), [])
+
+        self.s.timestamp = self.s.timestamp + 11
+        self.assertEqual(scheduler.due(self.s.timestamp), [self.question_id])
+        self.assertTrue(self.rc0.isFinalized(self.question_id))
+
+        # Frozen pending arbitration, so nothing else is due however long we wait
+        self.assertFalse(self.rc0.isFinalized(q2))
+        self.assertEqual(scheduler.next_due(), None)
+
+        self.arb0.submitAnswerByArbitrator(self.rc0.address, q2, to_answer_for_contract(123456), keys.privtoaddr(t.k4), startgas=200000)
+        scheduler.process_block(1, self.s.timestamp, pending_events(self.c, self.rc0)[len(events):])
+        self.assertEqual(scheduler.due(self.s.timestamp), [q2])
+        self.assertTrue(self.rc0.isFinalized(q2))
+        self.assertEqual(len(scheduler), 0)
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    @pyethereum_only
+    def test_read_cache(self):
+        cache = read_cache.ReadCache(self.rc0.questions, self.rc0.templates)
+        self.assertEqual(cache.question(self.question_id), self.rc0.questions(self.question_id))
+        self.assertEqual(cache.get(self.question_id, 'bounty'), 1000)
+        self.assertEqual(cache.template(0), self.rc0.templates(0))
+        self.assertEqual(cache.template(0), self.rc0.templates(0))
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+        events = pending_events(self.c, self.rc0)
+        cache.process_block(1, self.s.timestamp, events)
+        self.rc0.submitAnswer(self.question_id, to_answer_for_contract(12345), 0, value=1, sender=t.k3, startgas=200000)
+        self.assertEqual(cache.get(self.question_id, 'bond'), 0)
+
+        # The answer's event drops the mutable fields, but not the ones that can't change
+        cache.process_block(2, self.s.timestamp, pending_events(self.c, self.rc0)[len(events):])
+        self.assertEqual(cache.get(self.question_id, 'arbitrator'), self.rc0.questions(self.question_id)[QINDEX_ARBITRATOR])
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(cache.get(self.question_id, 'bond'), 1)
+        self.assertEqual(cache.misses, 3)
+
+        self.s.timestamp = self.s.timestamp + 11
+        cache.process_block(3, self.s.timestamp, [])
+        self.assertEqual(cache.get(self.question_id, 'best_answer'), to_answer_for_contract(12345))
+        cache.rollback(2)
+        self.assertEqual(cache.stats()['mutable'], 0)
+        self.assertEqual(cache.question(self.question_id), self.rc0.questions(self.question_id))
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    @pyethereum_only
+    def test_template_store(self):
+        self.rc0.createTemplate('{"title": "%s", "type": "uint", "decimals": 0, "category": "%s"}', startgas=200000)
+        self.c.mine()
+
+        path = tempfile.mkdtemp()
+        source = event_stream.ChainLogSource(self.c)
+        store = template_store.TemplateStore(path)
+        store.sync(event_stream.EventStream(source, self.rc0.address, self.rc0.translator, ['LogNewTemplate'], start_block=self.rc0.templates(0)))
+        self.assertEqual(len(store), 7)
+        self.assertEqual(store.block_number_of(6), self.rc0.templates(6))
+        store.close()
+
+        store = template_store.TemplateStore(path)
+        question_text = u"How many?␟numbers"
+        self.assertEqual(store.render(6, question_text), {'title': 'How many?', 'type': 'uint', 'decimals': 0, 'category': 'numbers'})
+        self.assertEqual(store.render_many([(0, "my question")]), [{'title': 'my question', 'type': 'bool', 'category': 'undefined'}])
+
+        content_hash = self.rc0.questions(self.question_id)[QINDEX_CONTENT_HASH]
+        self.assertEqual(store.verify_many([(0, 0, "my question", content_hash), (0, 0, "not my question", content_hash), (7, 0, "my question", content_hash)]), [True, False, False])
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    @pyethereum_only
+    def test_content_hashes(self):
+        self.rc0.askQuestion(3, u"Which?␟\"a\", \"b\"␟misc", self.arb0.address, 10, 1500000000, 1, value=1100, startgas=200000)
+        events = [ev for ev in pending_events(self.c, self.rc0) if ev['_event_type'] == b'LogNewQuestion']
+        self.assertEqual(len(events), 2)
+        self.assertEqual(content_hashes.mismatched_questions(events), [])
+
+        hashes = content_hashes.content_hashes([0, 3], [0, 1500000000], ["my question", u"Which?␟\"a\", \"b\"␟misc"])
+        self.assertEqual(hashes[:32], self.rc0.questions(self.question_id)[QINDEX_CONTENT_HASH])
+        self.assertEqual(hashes[32:], decode_hex(calculate_content_hash(3, u"Which?␟\"a\", \"b\"␟misc", 1500000000)[2:]))
+
+        events[0]['question'] = b"not my question"
+        self.assertEqual(content_hashes.mismatched_questions(events), [self.question_id])
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    @pyethereum_only
+    def test_bond_sim_matches_contract(self):
+        # The same history as test_bond_claim_after_reveal_fail
+        game = bond_sim.Game([3, 5, 4, 6, 5, 4], [1, 2, 4, 8, 16, 32], [1002, 1001, 1003, 1002, 1004, 1002],
+            [False, False, False, False, True, True], [True, True, True, True, False, False], 1002, None, False)
+        self.assertEqual(bond_sim.payouts(game, 1000), {6: 32+16+8+4+2-1+1000, 3: 1+1})
+
+        config = bond_sim.GameConfig(['honest', 'troll', 'committer', 'sniper'], budget=2**12, arbitration_fee=500, max_entries=8)
+        self.assertEqual(bond_sim.differential(config, 8, seed=1, fixture=self.fixture), [])
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    @pyethereum_only
+    def test_fuzz_claims(self):
+        for seed in range(4):
+            self.assertEqual(fuzz_claims.failure_of(self.fixture, fuzz_claims.generate(seed)), None)
+
+        case = fuzz_claims.Case([('answer', 0, 2, 1), ('commit', 1, 3, 0), ('reveal', 0), ('arbitrate', 2, 1)], [2, 1, 3])
+        fails = lambda c: fuzz_claims.Failure("reveal") if ('reveal', 0) in c.steps else None
+        shrunk, _ = fuzz_claims.shrink(case, fails)
+        self.assertEqual(shrunk.steps, [('reveal', 0)])
+        self.assertEqual(shrunk.chunks, [6])
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    @pyethereum_only
+    def test_gas_profiler(self):
+        self.c.mine()
+        self.s = self.c.head_state
+
+        with gas_profiler.GasProfiler(gas_profiler.load_contracts(CONTRACTS)) as profiler:
+            self.rc0.submitAnswer(self.question_id, to_answer_for_contract(12345), 0, value=1)
+
+        self.assertEqual(profiler.calls, 1)
+        # The intrinsic gas of the transaction isn't spent in the VM
+        self.assertTrue(0 < profiler.total < self.s.gas_used - 21000)
+        self.assertEqual(sum(gas for _, gas in profiler.opcodes.values()), profiler.total)
+        self.assertEqual(sum(gas for _, gas in profiler.lines.values()), profiler.total)
+        self.assertEqual(sum(profiler.stacks.values()), profiler.total)
+
+        self.assertEqual(profiler.opcodes['SSTORE'][1] % 5000, 0)
+        self.assertIn('SHA3', profiler.opcodes)
+        self.assertTrue(any(line.startswith('RealityCheck.sol:') for line in profiler.lines))
+        self.assertTrue(all(stack.startswith('RealityCheck.submitAnswer;') for stack in profiler.stacks))
+
+        folded = os.path.join(tempfile.mkdtemp(), 'submitAnswer.folded')
+        profiler.write_folded(folded)
+        with open(folded) as f:
+            for line in f:
+                stack, gas = line.rsplit(' ', 1)
+                self.assertEqual(profiler.stacks[stack], int(gas))
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    @pyethereum_only
+    def test_arbitration_queue(self):
+        q2 = self.rc0.askQuestion(0, "my question", self.arb0.address, 10, 0, 1, value=1100, startgas=200000)
+        q3 = self.rc0.askQuestion(0, "my question", self.arb0.address, 10, 0, 2, value=1100, startgas=200000)
+        for qid in (self.question_id, q2, q3):
+            self.rc0.submitAnswer(qid, to_answer_for_contract(12345), 0, value=1, sender=t.k3, startgas=200000)
+        fee = self.arb0.getDisputeFee(q2)
+        self.arb0.setCustomDisputeFee(q3, fee * 2, startgas=200000)
+
+        self.arb0.requestArbitration(self.rc0.address, self.question_id, value=fee, sender=t.k4, startgas=200000)
+        self.arb0.requestArbitration(self.rc0.address, q3, value=fee, sender=t.k4, startgas=200000)
+
+        queue = arbitration_queue.ArbitrationQueue()
+        # The RealityCheck events first, as they may come from separate streams
+        queue.process_block(1, self.s.timestamp, pending_events(self.c, self.rc0))
+        queue.process_block(1, self.s.timestamp, pending_events(self.c, self.arb0))
+        self.assertEqual(len(queue), 1)
+        self.assertEqual(queue.metrics(self.s.timestamp)['part_paid'], 1)
+
+        rc_events = len(pending_events(self.c, self.rc0))
+        arb_events = len(pending_events(self.c, self.arb0))
+        self.s.timestamp = self.s.timestamp + 5
+        self.arb0.requestArbitration(self.rc0.address, q2, value=fee, sender=t.k5, startgas=200000)
+        self.arb0.requestArbitration(self.rc0.address, q3, value=fee, sender=t.k5, startgas=200000)
+        queue.process_block(2, self.s.timestamp, pending_events(self.c, self.arb0)[arb_events:])
+        queue.process_block(2, self.s.timestamp, pending_events(self.c, self.rc0)[rc_events:])
+
+        # q3 paid most, then the oldest of the two paying the default fee
+        self.assertEqual(len(queue), 3)
+        self.assertEqual(queue.peek(), q3)
+        batch = queue.next_batch(2)
+        self.assertEqual([(qid, paid) for qid, _, paid in batch], [(q3, fee * 2), (self.question_id, fee)])
+        self.assertEqual(queue.metrics(self.s.timestamp)['in_flight'], 2)
+
+        rc_events = len(pending_events(self.c, self.rc0))
+        self.s.timestamp = self.s.timestamp + 5
+        answerer = keys.privtoaddr(t.k3)
+        failed = arbitration_queue.send_resolutions(self.arb0, self.rc0.address, [(qid, to_answer_for_contract(12345), answerer) for qid, _, _ in batch])
+        self.assertEqual(failed, [])
+        queue.process_block(3, self.s.timestamp, pending_events(self.c, self.rc0)[rc_events:])
+
+        metrics = queue.metrics(self.s.timestamp)
+        self.assertEqual((metrics['depth'], metrics['in_flight'], metrics['resolved']), (1, 0, 2))
+        self.assertEqual((metrics['resolution_p50'], metrics['resolution_max']), (10, 10))
+        self.assertEqual(metrics['oldest_wait'], 5)
+        self.assertTrue(self.rc0.isFinalized(q3))
+        self.assertEqual([qid for qid, _, _ in queue.next_batch(2)], [q2])
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    @pyethereum_only
+    def test_callback_dispatcher(self):
+        cb = self.fixture.deploy('CallbackClient', sender=t.k0)
+        exploding_cb = self.fixture.deploy('ExplodingCallbackClient', sender=t.k0)
+        self.caller_backer.setRealityCheck(self.rc0.address)
+        q2 = self.rc0.askQuestion(0, "my question", self.arb0.address, 10, 0, 1, value=1100, startgas=200000)
+        for qid in (self.question_id, q2):
+            self.rc0.submitAnswer(qid, to_answer_for_contract(10005), 0, value=10, sender=t.k3, startgas=200000)
+        self.caller_backer.fundCallbackRequest(self.question_id, cb.address, 100000, value=100, startgas=200000)
+        self.caller_backer.fundCallbackRequest(self.question_id, exploding_cb.address, 100000, value=300, startgas=200000)
+
+        dispatcher = callback_dispatcher.CallbackDispatcher(callback_dispatcher.tester_sender(self.c, self.caller_backer), failure_threshold=1, cooldown=60)
+        dispatcher.process_block(1, self.s.timestamp, pending_events(self.c, self.rc0))
+        dispatcher.process_block(1, self.s.timestamp, pending_events(self.c, self.caller_backer))
+        self.assertEqual(dispatcher.wake(self.s.timestamp), [])
+        self.assertEqual(dispatcher.ready(self.s.timestamp), [])
+
+        self.s.timestamp = self.s.timestamp + 11
+        self.assertEqual(sorted(dispatcher.wake(self.s.timestamp)), sorted([self.question_id, q2]))
+        # q2 has nothing waiting, so it isn't kept
+        self.assertEqual(list(dispatcher.final), [self.question_id])
+        self.assertEqual([(d[1], d[3]) for d in dispatcher.ready(self.s.timestamp)], [(exploding_cb.address, 300), (cb.address, 100)])
+
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(dispatcher.dispatch(self.s.timestamp))
+            self.assertEqual([(r[1], r[4]) for r in results], [(exploding_cb.address, False), (cb.address, True)])
+            self.assertEqual(cb.answers(self.question_id), to_answer_for_contract(10005))
+            self.assertEqual(self.caller_backer.balanceOf(keys.privtoaddr(t.k0)), 400)
+
+            # The exploding client's circuit is open, so its next request waits out the cooldown
+            events = len(pending_events(self.c, self.caller_backer))
+            self.caller_backer.fundCallbackRequest(q2, exploding_cb.address, 100000, value=50, startgas=200000)
+            dispatcher.process_block(2, self.s.timestamp, pending_events(self.c, self.caller_backer)[events:])
+            self.assertEqual(dispatcher.ready(self.s.timestamp), [])
+            self.assertEqual(len(dispatcher.ready(self.s.timestamp + 60)), 1)
+            results = loop.run_until_complete(dispatcher.dispatch(self.s.timestamp + 60))
+            self.assertEqual([(r[0], r[4]) for r in results], [(q2, False)])
+        finally:
+            loop.close()
+
+        stats = dispatcher.stats(self.s.timestamp + 60)
+        self.assertEqual((stats['delivered'], stats['exploded'], stats['open_circuits'], stats['waiting']), (3, 2, 1, 0))
+        self.assertEqual(dispatcher.final, {})
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    def test_final_answer_checks_match_contract(self):
+        q2 = self.rc0.askQuestion(0, "my question", self.arb0.address, 10, 0, 1, value=1100, startgas=200000)
+        q3 = self.rc0.askQuestion(0, "my question", self.arb0.address, 10, 0, 2, value=1100, startgas=200000)
+        q4 = self.rc0.askQuestion(0, "my question", self.arb0.address, 20, 0, 3, value=1100, startgas=200000)
+        self.rc0.submitAnswer(self.question_id, to_answer_for_contract(12345), 0, value=10, sender=t.k3, startgas=200000)
+        self.rc0.submitAnswer(q2, to_answer_for_contract(12345), 0, value=10, sender=t.k3, startgas=200000)
+        self.rc0.submitAnswer(q4, to_answer_for_contract(54321), 0, value=7, sender=t.k4, startgas=200000)
+        self.arb0.requestArbitration(self.rc0.address, q2, value=self.arb0.getDisputeFee(q2), sender=t.k4, startgas=200000)
+        self.chain.advance_time(11)
+        now = self.chain.timestamp
+
+        # Final, pending arbitration, unanswered, answered but not final, unknown
+        unknown = decode_hex("1" * 64)
+        question_ids = [self.question_id, q2, q3, q4, unknown]
+        store = question_store.open_questions(tempfile.mkdtemp())
+        for qid in question_ids[:-1]:
+            store.put_question(qid, self.rc0.questions(qid))
+
+        checks = []
+        for qid in question_ids:
+            content_hash = store.get(qid, 'content_hash') if qid in store else decode_hex("2" * 64)
+            for ch in (content_hash, decode_hex("3" * 64)):
+                for arbitrator in (self.arb0.address, keys.privtoaddr(t.k5)):
+                    for min_timeout in (0, 10, 11):
+                        for min_bond in (0, 10, 11):
+                            checks.append((qid, ch, arbitrator, min_timeout, min_bond))
+        checks.append((self.question_id, store.get(self.question_id, 'content_hash'), self.arb0.address, 10, 10))
+
+        results = final_answer_checks.check_final_answers(store, checks, now)
+        self.assertEqual(results[-1], (None, to_answer_for_contract(12345)))
+        self.assertIn(final_answer_checks.MIN_BOND, [reason for reason, _ in results])
+        for check, (reason, answer) in zip(checks, results):
+            if reason is None:
+                self.assertEqual(self.rc0.getFinalAnswerIfMatches(*check, startgas=200000), answer)
+            else:
+                with self.assertRaises(TransactionFailed, msg="{} should revert for {}".format(check, reason)):
+                    self.rc0.getFinalAnswerIfMatches(*check, startgas=200000)
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    @pyethereum_only
+    def test_rpc_client_batching(self):
+        self.rc0.submitAnswer(self.question_id, to_answer_for_contract(12345), 0, value=1, sender=t.k3, startgas=200000)
+        user = keys.privtoaddr(t.k3)
+
+        async def read_all(server):
+            await server.start()
+            client = rpc_client.RPCClient(server.url)
+            rc = rpc_client.ContractReader(client, self.rc0.address, self.rc0.translator)
+            # A server that never answers fails the test rather than hanging it
+            results = await asyncio.wait_for(asyncio.gather(
+                rc.call('questions', self.question_id),
+                rc.call('isFinalized', self.question_id),
+                rc.call('balanceOf', user),
+            ), 10)
+            await client.close()
+            await server.stop()
+            return results, client
+
+        server = chain_rpc_server.ChainRPCServer(self.c)
+        loop = asyncio.new_event_loop()
+        try:
+            results, client = loop.run_until_complete(read_all(server))
+        finally:
+            loop.close()
+
+        self.assertEqual(results[0], self.rc0.questions(self.question_id))
+        self.assertEqual(results[1], self.rc0.isFinalized(self.question_id))
+        self.assertEqual(results[2], self.rc0.balanceOf(user))
+        # All three went out together
+        self.assertEqual(client.batches, 1)
+        self.assertEqual(server.batches, 1)
+        self.assertEqual(server.requests, 3)
+
     @unittest.skipIf(WORKING_ONLY, "Not under construction")
     def test_answer_reveal_calculation(self):
         h = calculate_commitment_hash(to_answer_for_contract(1003), 94989)
@@ -476,7 +961,7 @@ class TestRealityCheck(TestCase):
 
         self.rc0.submitAnswerReveal( self.question_id, to_answer_for_contract(1002), nonce, 1, sender=t.k3, startgas=200000)
 
-        self.s.timestamp = self.s.timestamp + 11
+        self.chain.advance_time(11)
 
         q = self.rc0.getFinalAnswer(self.question_id, startgas=200000)
         self.assertEqual(from_answer_for_contract(q), 1002)
@@ -497,7 +982,7 @@ class TestRealityCheck(TestCase):
 
         self.rc0.submitAnswerReveal( self.question_id, to_answer_for_contract(1002), nonce, 1, sender=t.k3, startgas=200000)
 
-        self.s.timestamp = self.s.timestamp + 11
+        self.chain.advance_time(11)
 
         q = self.rc0.getFinalAnswer(self.question_id, startgas=200000)
         self.assertEqual(from_answer_for_contract(q), 1002)
@@ -517,7 +1002,7 @@ class TestRealityCheck(TestCase):
 
         self.rc0.submitAnswerReveal( self.question_id, to_answer_for_contract(1002), nonce, 1, sender=t.k3, startgas=200000)
 
-        self.s.timestamp = self.s.timestamp + 11
+        self.chain.advance_time(11)
 
         q = self.rc0.getFinalAnswer(self.question_id, startgas=200000)
         self.assertEqual(from_answer_for_contract(q), 1002)
@@ -532,7 +1017,7 @@ class TestRealityCheck(TestCase):
         nonce = st['nonce'][0]
         hh = st['hash'][0]
 
-        self.s.timestamp = self.s.timestamp + 5
+        self.chain.advance_time(5)
         with self.assertRaises(TransactionFailed):
             st = self.rc0.submitAnswerReveal( self.question_id, to_answer_for_contract(1002), nonce, 1, sender=t.k3)
 
@@ -568,7 +1053,7 @@ class TestRealityCheck(TestCase):
     def test_simple_bond_claim(self):
         self.rc0.submitAnswer(self.question_id, to_answer_for_contract(12345), 0, value=3) 
 
-        self.s.timestamp = self.s.timestamp + 11
+        self.chain.advance_time(11)
 
         self.assertEqual(from_answer_for_contract(self.rc0.getFinalAnswer(self.question_id)), 12345)
 
@@ -576,6 +1061,50 @@ class TestRealityCheck(TestCase):
         self.assertEqual(self.rc0.balanceOf(keys.privtoaddr(t.k0)), 3+1000)
         self.assertEqual(self.rc0.balanceOf(keys.privtoaddr(t.k0)), 3+1000, "Winner gets their bond back plus the bounty")
 
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    @pyethereum_only
+    def test_chain_clock(self):
+
+        ts = self.clock.now
+        pending = self.clock.pending
+
+        # An escalation goes into the open block, with each answer's gas in its receipt
+        for i in range(8):
+            self.rc0.submitAnswer(self.question_id, to_answer_for_contract(1 + i % 2), 0, value=2**i, sender=[t.k3, t.k4][i % 2], startgas=200000)
+        self.assertEqual(self.clock.pending, pending + 8)
+        gas = self.clock.tx_gas()
+        self.assertEqual(len(gas), self.clock.pending)
+        self.assertTrue(all(g > 21000 for g in gas[-8:]))
+        self.assertEqual(self.clock.last_gas(), gas[-1])
+
+        _, answer_gas = self.clock.measure(self.rc0.submitAnswer, self.question_id, to_answer_for_contract(2), 0, value=2**8, sender=t.k3, startgas=200000)
+        self.assertEqual(answer_gas, self.clock.tx_gas()[-1])
+        self.assertFalse(self.rc0.isFinalized(self.question_id))
+
+        # With transactions pending, the block is mined at the time they ran, and the next opens at the new time
+        self.clock.advance(11)
+        self.assertEqual(self.clock.pending, 0)
+        self.assertEqual(self.clock.tx_gas(), [])
+        self.assertIsNone(self.clock.last_gas())
+        self.assertEqual(self.clock.now, ts + 11)
+
+        # With none pending, the open block is retimed without mining
+        block_number = self.clock.state.block_number
+        self.clock.advance(86400)
+        self.assertEqual(self.clock.state.block_number, block_number)
+        self.assertEqual(self.clock.now, ts + 11 + 86400)
+
+        # ...and still mines
+        self.assertTrue(self.rc0.isFinalized(self.question_id))
+        self.assertEqual(from_answer_for_contract(self.rc0.getFinalAnswer(self.question_id)), 2)
+        self.assertEqual(len(self.clock.mine()), 2)
+        self.assertEqual(self.c.chain.state.timestamp, ts + 11 + 86400)
+        self.assertEqual(self.c.chain.state.block_number, block_number)
+
+        # A block can't go back past its parent
+        self.clock.set_time(ts)
+        self.assertEqual(self.clock.now, ts + 11 + 86400 + 1)
+
     @unittest.skipIf(WORKING_ONLY, "Not under construction")
     def test_bonds(self):
 
@@ -638,20 +1167,13 @@ class TestRealityCheck(TestCase):
         claim_args_answs.append(to_answer_for_contract(10002))
         self.rc0.submitAnswer(self.question_id, to_answer_for_contract(10002), 11, value=22, sender=t.k5, startgas=200000) 
 
-        ts = self.s.timestamp
-
-        self.c.mine()
-        self.s = self.c.head_state
-
-        self.s.timestamp = ts
-
         self.assertFalse(self.rc0.isFinalized(self.question_id))
 
         #You can't claim the bond until the thing is finalized
         with self.assertRaises(TransactionFailed):
             self.rc0.claimWinnings(self.question_id, claim_args_state[::-1], claim_args_addrs[::-1], claim_args_bonds[::-1], claim_args_answs[::-1], startgas=200000)
 
-        self.s.timestamp = self.s.timestamp + 11
+        self.chain.advance_time(11)
 
         self.assertEqual(from_answer_for_contract(self.rc0.getFinalAnswer(self.question_id)), 10002)
 
@@ -674,13 +1196,12 @@ class TestRealityCheck(TestCase):
 
         self.assertEqual(self.rc0.balanceOf(keys.privtoaddr(t.k3)), 0, "Wrong answerers get nothing")
 
-        starting_bal = self.s.get_balance(keys.privtoaddr(t.k5))
+        starting_bal = self.chain.balance(keys.privtoaddr(t.k5))
 
-        starting_gas_used = self.s.gas_used
         self.rc0.withdraw(sender=t.k5)
-        gas_spent = self.s.gas_used - starting_gas_used
+        gas_spent = self.chain.last_gas_used
 
-        ending_bal = self.s.get_balance(keys.privtoaddr(t.k5))
+        ending_bal = self.chain.balance(keys.privtoaddr(t.k5))
 
         self.assertEqual(ending_bal, starting_bal + k5bal - gas_spent)
 
@@ -701,9 +1222,7 @@ class TestRealityCheck(TestCase):
         st = self.submitAnswerReturnUpdatedState( st, self.question_id, 1001, 32, 64, t.k3)
         claimable = 64+32+16+8+4+2+1000
 
-        self.s.timestamp = self.s.timestamp + 11
-        self.c.mine()
-        self.s = self.c.head_state
+        self.chain.advance_time(11)
 
         self.assertEqual(self.rc0.balanceOf(keys.privtoaddr(t.k3)), 0)
 
@@ -715,7 +1234,7 @@ class TestRealityCheck(TestCase):
 
 
     @unittest.skipIf(WORKING_ONLY, "Not under construction")
-    def test_bond_bulk_withdrawal_other_user(self):
+    def test_bond_bulk_withdrawal_answerer(self):
 
         st = None
         st = self.submitAnswerReturnUpdatedState( st, self.question_id, 1001, 0, 2, t.k3)
@@ -726,26 +1245,26 @@ class TestRealityCheck(TestCase):
         st = self.submitAnswerReturnUpdatedState( st, self.question_id, 1001, 32, 64, t.k3)
         claimable = 64+32+16+8+4+2+1000
 
-        self.s.timestamp = self.s.timestamp + 11
-        self.c.mine()
-        self.s = self.c.head_state
+        self.chain.advance_time(11)
 
-        starting_bal = self.s.get_balance(keys.privtoaddr(t.k3))
+        starting_bal = self.chain.balance(keys.privtoaddr(t.k3))
 
         # Have the user who gets all the cash do the claim
         # This will empty their balance from the contract and assign it to their normal account
         self.rc0.claimMultipleAndWithdrawBalance([self.question_id], [len(st['hash'])], st['hash'], st['addr'], st['bond'], st['answer'], sender=t.k3, startgas=200000)
-        ending_bal = self.s.get_balance(keys.privtoaddr(t.k3))
-        gas_used = self.s.gas_used # Find out how much we used as this will affect the balance
+        ending_bal = self.chain.balance(keys.privtoaddr(t.k3))
+        gas_used = self.chain.last_gas_used # Find out how much we used as this will affect the balance
 
         self.assertEqual(starting_bal+claimable-gas_used, ending_bal)
         self.assertEqual(self.rc0.balanceOf(keys.privtoaddr(t.k3)), 0, "All funds are gone from the contract once withdrawal is complete")
 
 
+    # The callbacks get 3000000 gas, which leaves too little room under eth-tester's 3141592 block gas limit
     @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    @pyethereum_only
     def test_callbacks_unbundled(self):
      
-        self.cb = self.c.contract(self.client_code, language='solidity', sender=t.k0)
+        self.cb = self.fixture.deploy('CallbackClient', sender=t.k0)
         self.caller_backer.setRealityCheck(self.rc0.address)
 
         self.rc0.submitAnswer(self.question_id, to_answer_for_contract(10005), 0, value=10, sender=t.k3, startgas=200000) 
@@ -768,13 +1287,15 @@ class TestRealityCheck(TestCase):
         self.assertEqual(self.cb.answers(self.question_id), to_answer_for_contract(10005))
         
         
+    # The callbacks get 3000000 gas, which leaves too little room under eth-tester's 3141592 block gas limit
     @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    @pyethereum_only
     def test_exploding_callbacks(self):
 
-        self.cb = self.c.contract(self.client_code, language='solidity', sender=t.k0)
+        self.cb = self.fixture.deploy('CallbackClient', sender=t.k0)
         self.caller_backer.setRealityCheck(self.rc0.address)
      
-        self.exploding_cb = self.c.contract(self.exploding_client_code, language='solidity', sender=t.k0)
+        self.exploding_cb = self.fixture.deploy('ExplodingCallbackClient', sender=t.k0)
 
         self.rc0.submitAnswer(self.question_id, to_answer_for_contract(10005), 0, value=10, sender=t.k3) 
         self.s.timestamp = self.s.timestamp + 11
@@ -801,25 +1322,18 @@ class TestRealityCheck(TestCase):
 
         self.rc0.submitAnswer(self.question_id, to_answer_for_contract(12345), 0, value=100, sender=t.k5) 
 
-        self.c.mine()
-        self.s.timestamp = self.s.timestamp + 11
+        self.chain.advance_time(11)
 
         self.rc0.claimWinnings(self.question_id, [""], [keys.privtoaddr(t.k5)], [100], [to_answer_for_contract(12345)], sender=t.k5, startgas=200000)
 
         starting_deposited = self.rc0.balanceOf(keys.privtoaddr(t.k5))
         self.assertEqual(starting_deposited, 1100)
 
-        # Mine to reset the gas used to 0
-        self.c.mine()
-        self.s = self.c.head_state
-
-        self.assertEqual(self.s.gas_used, 0)
-
-        starting_bal = self.s.get_balance(keys.privtoaddr(t.k5))
+        starting_bal = self.chain.balance(keys.privtoaddr(t.k5))
+        # The withdrawal's own gas, as this will affect the balance
         self.rc0.withdraw(sender=t.k5, startgas=100000)
-        ending_bal = self.s.get_balance(keys.privtoaddr(t.k5))
-
-        gas_used = self.s.gas_used # Find out how much we used as this will affect the balance
+        gas_used = self.chain.last_gas_used
+        ending_bal = self.chain.balance(keys.privtoaddr(t.k5))
 
         self.assertEqual(self.rc0.balanceOf(keys.privtoaddr(t.k5)), 0)
         self.assertEqual(ending_bal, starting_bal + starting_deposited - gas_used)
@@ -834,9 +1348,8 @@ class TestRealityCheck(TestCase):
     @unittest.skipIf(WORKING_ONLY, "Not under construction")
     def test_ask_question_gas(self):
 
-        self.c.mine()
-        self.s = self.c.head_state
-        self.assertEqual(self.s.gas_used, 0)
+        self.chain.mine()
+        self.assertEqual(self.chain.gas_used, 0)
 
         self.question_id = self.rc0.askQuestion(
             0,
@@ -846,20 +1359,19 @@ class TestRealityCheck(TestCase):
             0,
             value=1100
         )
-        gas_used = self.s.gas_used # Find out how much we used as this will affect the balance
+        gas_used = self.chain.gas_used # Find out how much we used as this will affect the balance
         #self.assertEqual(gas_used, 120000)
         self.assertTrue(gas_used < 100000)
     
     @unittest.skipIf(WORKING_ONLY, "Not under construction")
     def test_answer_question_gas(self):
 
-        self.c.mine()
-        self.s = self.c.head_state
-        self.assertEqual(self.s.gas_used, 0)
+        self.chain.mine()
+        self.assertEqual(self.chain.gas_used, 0)
 
         self.rc0.submitAnswer(self.question_id, to_answer_for_contract(12345), 0, value=1) 
 
-        gas_used = self.s.gas_used # Find out how much we used as this will affect the balance
+        gas_used = self.chain.gas_used # Find out how much we used as this will affect the balance
         #self.assertEqual(gas_used, 120000)
         self.assertTrue(gas_used < 100000)
 
@@ -868,7 +1380,7 @@ class TestRealityCheck(TestCase):
 
         self.rc0.submitAnswer(self.question_id, to_answer_for_contract(12346), 0, value=2) 
 
-        gas_used = self.s.gas_used - gas_used
+        gas_used = self.chain.gas_used - gas_used
         #self.assertEqual(gas_used, 120000)
         self.assertTrue(gas_used < 52000)
 
@@ -921,6 +1433,234 @@ class TestRealityCheck(TestCase):
 
 
 
+class TestSolcCache(TestCase):
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    def test_flatten_transitive_imports(self):
+        code = solc_cache.flatten_source('RealityCheck.sol')
+        self.assertNotIn("import ", code)
+        self.assertEqual(code.count("library SafeMath "), 1)
+        self.assertEqual(code.count("library SafeMath32 "), 1)
+        self.assertEqual(code.count("contract BalanceHolder "), 1)
+
+        code = solc_cache.flatten_source('Arbitrator.sol')
+        self.assertEqual(code.count("contract Owned "), 1)
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    def test_cache_key_follows_source(self):
+        code = solc_cache.flatten_source('RealityCheck.sol')
+        self.assertEqual(solc_cache.cache_key(code), solc_cache.cache_key(code))
+        self.assertNotEqual(solc_cache.cache_key(code), solc_cache.cache_key(code + "\n"))
+        self.assertNotEqual(solc_cache.cache_key(code), solc_cache.cache_key(code, optimize=False))
+
+class TestCommitments(TestCase):
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    def test_batch_matches_single(self):
+        qids = [decode_hex("1"*64), decode_hex("2"*64), decode_hex("1"*64)]
+        answers = [to_answer_for_contract(1003), to_answer_for_contract(0), to_answer_for_contract(2**255)]
+        nonces = [94989, 0, 2**256-1]
+        bonds = [1, 10**18, 2**200]
+
+        answer_hashes, ids = commitments.commitments(b''.join(qids), b''.join(answers), commitments.pack_uint256(nonces), commitments.pack_uint256(bonds))
+        self.assertEqual(encode_hex(commitments.split_words(answer_hashes)[0]), '23e796d2bf4f5f890b1242934a636f4802aadd480b6f83c754d2bd5920f78845')
+        for i in range(len(qids)):
+            answer_hash = calculate_commitment_hash(answers[i], nonces[i])
+            self.assertEqual(commitments.split_words(answer_hashes)[i], answer_hash)
+            self.assertEqual(commitments.split_words(ids)[i], calculate_commitment_id(qids[i], answer_hash, bonds[i]))
+
+        self.assertEqual(commitments.unpack_uint256(commitments.pack_uint256(nonces)), nonces)
+        with self.assertRaises(ValueError):
+            commitments.commitment_hashes(b''.join(answers), commitments.pack_uint256(nonces[:2]))
+
+class TestQuestionStore(TestCase):
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    def test_grow_with_view_open(self):
+        store = question_store.open_questions(tempfile.mkdtemp())
+        for i in range(4):
+            store.put(decode_hex(hex(i)[2:].zfill(64)), finalize_ts=i)
+        finalize_ts = store.column('finalize_ts')
+
+        # Growing past the capacity with a view still open leaves the view reading the rows it had, and the store usable
+        for i in range(4, question_store.INITIAL_CAPACITY + 1):
+            store.put(decode_hex(hex(i)[2:].zfill(64)), finalize_ts=i)
+        self.assertEqual(finalize_ts.tolist(), [0, 1, 2, 3])
+        self.assertEqual(store.get(decode_hex(hex(question_store.INITIAL_CAPACITY)[2:].zfill(64)), 'finalize_ts'), question_store.INITIAL_CAPACITY)
+        self.assertEqual(store.column('finalize_ts')[1020:1025].tolist(), [1020, 1021, 1022, 1023, 1024])
+        finalize_ts.release()
+        store.close()
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    def test_put_bad_value(self):
+        store = question_store.open_questions(tempfile.mkdtemp())
+        with self.assertRaises(OverflowError):
+            store.put(decode_hex("1"*64), finalize_ts=2**32)
+        with self.assertRaises(ValueError):
+            store.put(decode_hex("2"*64), best_answer=b'short')
+        # Neither left a row behind
+        self.assertEqual(len(store), 0)
+        self.assertNotIn(decode_hex("1"*64), store)
+        store.close()
+
+class TestCallbackDispatcher(TestCase):
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    def test_final_only_kept_while_requests_wait(self):
+        sent = []
+
+        async def send(question_id, client, gas, bounty):
+            sent.append(question_id)
+            return True
+
+        client = b'\x01' * 20
+        dispatcher = callback_dispatcher.CallbackDispatcher(send)
+        qids = [decode_hex(hex(i)[2:].zfill(64)) for i in range(1, 101)]
+        events = [{'_event_type': 'LogNewQuestion', 'question_id': qid, 'timeout': 10} for qid in qids]
+        events += [{'_event_type': 'LogNewAnswer', 'question_id': qid, 'ts': 100, 'is_commitment': False, 'bond': 1} for qid in qids]
+        events.append({'_event_type': 'LogFundCallbackRequest', 'question_id': qids[0], 'ctrct': client, 'gas': 100000, 'bounty': 5})
+        dispatcher.process_block(1, 100, events)
+
+        self.assertEqual(len(dispatcher.wake(110)), 100)
+        self.assertEqual(list(dispatcher.final), [qids[0]])
+
+        # Funding after the scheduler has let the question go is ready straight away
+        dispatcher.process_block(2, 120, [{'_event_type': 'LogFundCallbackRequest', 'question_id': qids[1], 'ctrct': client, 'gas': 100000, 'bounty': 3}])
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(dispatcher.dispatch(130))
+        finally:
+            loop.close()
+        self.assertEqual([r[0] for r in results], [qids[0], qids[1]])
+        self.assertEqual(dispatcher.final, {})
+        self.assertEqual(sorted(dispatcher.latencies), [10, 20])
+
+class TestReadCache(TestCase):
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    def test_rollback_winds_back_time(self):
+        question_id = decode_hex("1"*64)
+        # Answered at 240 with a timeout of 10 on the new chain
+        question = [decode_hex("2"*64), b'\x00' * 20, 0, 10, 250, False, 1000, to_answer_for_contract(1), decode_hex("3"*64), 1]
+        cache = read_cache.ReadCache(lambda qid: list(question))
+        cache.process_block(5, 300, [])
+
+        # A block from after the question's finalize_ts was replaced, so it isn't final yet
+        cache.rollback(3, 245)
+        self.assertEqual(cache.get(question_id, 'best_answer'), to_answer_for_contract(1))
+        self.assertNotIn(question_id, cache.final_answers)
+        cache.rollback(3)
+        self.assertEqual(cache.timestamp, 0)
+
+        cache.process_block(4, 250, [])
+        cache.get(question_id, 'best_answer')
+        self.assertIn(question_id, cache.final_answers)
+
+class TestAnswerCodec(TestCase):
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    def test_matches_hex_helpers(self):
+        for v in [0, 1, 12345, 2**255, 2**256-1]:
+            self.assertEqual(answer_codec.encode_uint(v), to_answer_for_contract(v))
+            self.assertEqual(answer_codec.decode_uint(to_answer_for_contract(v)), from_answer_for_contract(to_answer_for_contract(v)))
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    def test_answer_types(self):
+        self.assertEqual(answer_codec.encode('int', -1), decode_hex("f"*64))
+        self.assertEqual(answer_codec.decode('int', answer_codec.encode('int', -2**255)), -2**255)
+        self.assertEqual(answer_codec.decode('bool', answer_codec.encode('bool', True)), True)
+        with self.assertRaises(ValueError):
+            answer_codec.decode('bool', answer_codec.encode('uint', 2))
+        self.assertEqual(answer_codec.encode('multiple-select', [0, 2]), answer_codec.encode('uint', 5))
+        self.assertEqual(answer_codec.decode('multiple-select', answer_codec.encode('uint', 5)), [0, 2])
+        dt = datetime.datetime(2017, 12, 1, 15, 30)
+        self.assertEqual(answer_codec.decode('datetime', answer_codec.encode('datetime', dt)), dt)
+        self.assertEqual(answer_codec.encode('datetime', dt), answer_codec.encode('uint', 1512142200))
+        with self.assertRaises(ValueError):
+            answer_codec.encode('text', 1)
+
+        values = [3, -7, 0]
+        buf = answer_codec.encode_many('int', values)
+        self.assertEqual(len(buf), 3 * 32)
+        self.assertEqual(answer_codec.decode_many('int', buf), values)
+
+class TestGasBench(TestCase):
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    def test_compare_with_baseline(self):
+        baseline = {'askQuestion': 1000, 'withdraw': 1000}
+        self.assertEqual(gas_bench.compare({'askQuestion': 1010, 'withdraw': 900, 'new': 5}, baseline, 1), [])
+        self.assertEqual(gas_bench.compare({'askQuestion': 1011, 'withdraw': 1000}, baseline, 1), [('askQuestion', 1000, 1011)])
+
+class TestClaimBench(TestCase):
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    def test_largest_single_claim(self):
+        results = [
+            {'length': 10, 'single': 100000 + 10 * 20000},
+            {'length': 20, 'single': 100000 + 20 * 20000},
+            {'length': 40, 'single': 100000 + 40 * 20000},
+        ]
+        intercept, slope = claim_bench.fit_line([(r['length'], r['single']) for r in results])
+        self.assertAlmostEqual(intercept, 100000)
+        self.assertAlmostEqual(slope, 20000)
+        self.assertEqual(claim_bench.largest_single_claim(results, 600000), (20, 25))
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    def test_claim_costs_from_measurements(self):
+        costs = claim_planner.ClaimCosts.from_measurements(145000, 145000 + 9 * 35000, 10, 145000 + 4 * 65000, 5)
+        self.assertEqual((costs.base_gas, costs.question_gas, costs.entry_gas), (80000, 30000, 35000))
+        with self.assertRaises(ValueError):
+            claim_planner.ClaimCosts.from_measurements(145000, 145000, 1, 145000 + 4 * 65000, 5)
+        with self.assertRaises(ValueError):
+            claim_planner.ClaimCosts.from_measurements(145000, 145000 + 9 * 35000, 10, 145000, 1)
+
+class TestEventStream(TestCase):
+
+    class LimitedSource(object):
+        # A node with no logs that refuses ranges over limit blocks
+        def __init__(self, head, limit):
+            self.head = head
+            self.limit = limit
+            self.refused = 0
+
+        def head_number(self):
+            return self.head
+
+        def block_hash(self, number):
+            return decode_hex(hex(number)[2:].zfill(64))
+
+        def block_timestamp(self, number):
+            return number
+
+        def get_logs(self, from_block, to_block, address, topics):
+            if to_block - from_block + 1 > self.limit:
+                self.refused = self.refused + 1
+                raise event_stream.RangeTooLarge()
+            return []
+
+    class NoEvents(object):
+        event_data = {}
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    def test_page_size_stays_under_refused_range(self):
+        source = self.LimitedSource(20000, 300)
+        stream = event_stream.EventStream(source, b'', self.NoEvents(), page_size=100)
+        items = list(stream.poll())
+        self.assertEqual(items[-1].number, 20000)
+        # Finds the limit in a few refusals, where doubling past it again would be refused on every other page
+        self.assertTrue(source.refused < 10)
+        self.assertEqual(stream.page_size, 300)
+        self.assertEqual(stream.refused_range, 301)
+
+class TestEVMBackends(TestCase):
+
+    @unittest.skipIf(WORKING_ONLY, "Not under construction")
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            evm_backends.get_backend('no-such-evm')
+        self.assertIn(evm_backends.DEFAULT_BACKEND, evm_backends.available_backends())
+
 
 if __name__ == '__main__':
     main()